@@ -2,7 +2,6 @@ import sys
 import os
 import json
 import sqlite3
-import requests
 import urllib3
 import time
 import numpy as np
@@ -10,7 +9,18 @@ import re
 import hashlib
 import jieba
 import jieba.posseg as pseg
-from collections import defaultdict
+import threading
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from RAG_VectorStore import get_vector_searcher, encode_embedding, decode_embedding
+from RAG_Cache import get_shared_cache, make_cache_key, normalize_query_text
+from RAG_HttpClient import http_post
+from RAG_KeywordIndex import load_keyword_index, KeywordMatcher, DEFAULT_NODE_TITLE
+from RAG_JsonStream import PageIndexJsonStream
+from RAG_PageIndexSidecar import open_sidecar, ensure_sidecar
+from RAG_Fusion import fuse_ranked_lists, content_fingerprint, content_simhash, format_node_content, RRF_K
+from RAG_ContextPacker import pack_context, warm_token_counter
 
 # PyQt Core 组件用于线程和信号
 from PyQt5.QtCore import QThread, pyqtSignal, QMutex, QMutexLocker
@@ -18,6 +28,8 @@ from PyQt5.QtCore import QThread, pyqtSignal, QMutex, QMutexLocker
 # ================= 配置与环境 =================
 # 禁用 HTTPS 警告 (Win7/内网适配)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# 启动时在后台加载总结上下文打包用的分词器，召回线程中不再初始化
+warm_token_counter()
 os.environ['CURL_CA_BUNDLE'] = ''
 
 # API 配置 (硬编码 Key)
@@ -36,6 +48,20 @@ DEEPSEEK_API_URL = "https://18080/v1/chat/completions"
 # 模型名称常量 (仅作参考，实际使用前端传入的值)
 DEEPSEEK_V3_MODEL_NAME = "DeepSeek-V3"
 
+# 4. 本地结果缓存 (SQLite，跨会话持久化)
+RAG_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rag_cache", "rag_cache.db")
+EMBEDDING_CACHE_MAX_ENTRIES = 50000
+EMBEDDING_CACHE_TTL_SEC = 30 * 24 * 3600
+REWRITE_CACHE_MAX_ENTRIES = 5000
+REWRITE_CACHE_TTL_SEC = 7 * 24 * 3600
+# 近似查询复用改写结果的余弦阈值，设为 None 关闭近似查找 (仅精确命中)
+REWRITE_NEAR_DUP_THRESHOLD = 0.97
+RERANK_CACHE_MAX_ENTRIES = 200000
+RERANK_CACHE_TTL_SEC = 30 * 24 * 3600
+
+# 5. 总结 Prompt 的召回上下文 token 预算 (不含 System Prompt 与查询)
+SUMMARY_CONTEXT_TOKEN_BUDGET = 6000
+
 # ================= System Prompts =================
 
 REWRITE_SYSTEM_PROMPT = """你是一个工业级 RAG 系统中的「Query Rewrite 模块」。
@@ -166,6 +192,59 @@ def extract_keywords_with_jieba(query, stopwords=None, top_n=5):
             
     return result[:top_n]
 
+class LRUCache:
+    """线程安全的 LRU 缓存，供多个 RecallWorker 线程跨查询共享"""
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = OrderedDict()
+        self._mutex = QMutex()
+
+    def get(self, key, default=None):
+        locker = QMutexLocker(self._mutex)
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key, value):
+        locker = QMutexLocker(self._mutex)
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.capacity:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        locker = QMutexLocker(self._mutex)
+        return self._data.pop(key, default)
+
+    def __len__(self):
+        return len(self._data)
+
+# documents 行缓存: key = (db 绝对路径, db mtime, section_id)，
+# value = (embedding_text, original_snippet, section_path, 内容指纹, SimHash) 或 None (库中不存在)
+HYDRATION_CACHE_SIZE = 4096
+_HYDRATION_CACHE = LRUCache(HYDRATION_CACHE_SIZE)
+_CACHE_MISS = object()
+# Rewrite 近似查找用的查询向量矩阵: key = scope，value = {维度: (cache key 列表, 行归一化 float32 矩阵)}。
+# 首次近似查找时从 rewrite_embedding 表解码一次，store_rewrite 写入同 scope 时失效
+REWRITE_VECTOR_SCOPES = 16
+_REWRITE_VECTORS = LRUCache(REWRITE_VECTOR_SCOPES)
+# 单条 SQL 的参数上限 (兼容旧版 SQLite 的 999 限制)
+SQLITE_MAX_PARAMS = 500
+
+def format_document_text(embedding_text, original_snippet):
+    """documents 行 -> 候选正文 (PageIndex 中不存在的节点)"""
+    return f"【内容摘要】：{embedding_text or ''}\n\n【原始数据】：{original_snippet or ''}"
+
+def merge_vector_candidates(primary, secondary, top_k=40):
+    """按向量 id 合并两路向量候选 (如改写查询 + 原始查询)，同一 id 保留较高的相似度"""
+    merged = {}
+    for item in (primary or []) + (secondary or []):
+        prev = merged.get(item["id"])
+        if prev is None or item["vec_score"] > prev["vec_score"]:
+            merged[item["id"]] = item
+    return sorted(merged.values(), key=lambda x: x["vec_score"], reverse=True)[:top_k]
+
 def is_precise_intent(query):
     """
     动态路由逻辑：检测是否包含大写字母+数字的组合（如 CA1234, B737 等）
@@ -174,54 +253,292 @@ def is_precise_intent(query):
     return bool(re.search(pattern, query))
 
 # ================= PageIndex Loader =================
+# JSON 旁的二进制 sidecar (<json>.pidx) 可用时直接读取列式数据。
+# 开启自动生成时，sidecar 缺失或过期的 JSON 照常流式加载，加载完成后在后台线程生成 sidecar (供下次加载使用)
+PAGEINDEX_SIDECAR_AUTO_BUILD = False
+
+class PageIndexNode:
+    """按需生成的单节点只读记录 (路径不随节点保存，需要时经父指针由 PageIndexLoader.get_path 还原)"""
+    __slots__ = ("idx", "node_id", "title", "text", "summary")
+
+    def __init__(self, idx, node_id, title, text, summary):
+        self.idx = idx
+        self.node_id = node_id
+        self.title = title
+        self.text = text
+        self.summary = summary
+
 class PageIndexLoader:
+    """
+    PageIndex 结构的紧凑列式视图。由 PageIndexRegistry 加载后在多个线程间共享，加载完成后只读。
+    节点按遍历顺序编号 (含无 node_id 的节点)，按列保存:
+      titles      标题 (intern，兼作路径片段)；缺少 title 字段的节点记为 ""，编号另存于 missing_titles
+      parents     父节点编号 (int32，根为 -1)，路径经父指针回溯生成
+      node_ids    node_id 字符串，id_to_idx 为 node_id -> 编号
+      text / summary 各自拼接为一个 UTF-8 缓冲区 + int64 偏移表，取用时切片解码
+      fingerprints / simhashes 正文内容指纹与 SimHash (uint64)，加载时计算一次 (sidecar 中已预存)，供 RRF 去重
+      content_fingerprints / content_simhashes 同上，按向量通道候选的 content (摘要 + 正文) 计算
+    """
     def __init__(self):
-        self.index = {}          
-        self.ordered_ids = []    
+        self._reset()
         self.is_loaded = False
 
+    def _reset(self):
+        self.titles = []
+        self.missing_titles = set()
+        self.node_ids = []
+        self.id_to_idx = {}
+        self.parents = np.empty(0, dtype=np.int32)
+        self._text_buf = b""
+        self._text_offsets = np.zeros(1, dtype=np.int64)
+        self._summary_buf = b""
+        self._summary_offsets = np.zeros(1, dtype=np.int64)
+        self.fingerprints = np.empty(0, dtype=np.uint64)
+        self.simhashes = np.empty(0, dtype=np.uint64)
+        self.content_fingerprints = np.empty(0, dtype=np.uint64)
+        self.content_simhashes = np.empty(0, dtype=np.uint64)
+        self.estimated_bytes = 0
+
     def load_json(self, json_path):
         if not json_path or not os.path.exists(json_path):
             return False, "文件不存在"
         
         try:
-            with open(json_path, 'r', encoding='utf-8-sig') as f:
-                data = json.load(f)
-            
-            self.index = {}
-            self.ordered_ids = []
-            
-            root_structure = data.get("structure", []) if isinstance(data, dict) else data
-            
-            for item in root_structure:
-                self._traverse(item, parent_path=[])
+            self._reset()
+            # 优先读取二进制 sidecar，不可用时流式解析 JSON
+            sidecar = open_sidecar(json_path)
+            if sidecar is not None:
+                with sidecar:
+                    self._load_sidecar(sidecar)
+                source = "sidecar"
+            else:
+                self._build_columns(PageIndexJsonStream(json_path))
+                source = "JSON"
+                if PAGEINDEX_SIDECAR_AUTO_BUILD:
+                    threading.Thread(target=ensure_sidecar, args=(json_path,), daemon=True).start()
             
             self.is_loaded = True
-            return True, f"成功加载 PageIndex，包含 {len(self.index)} 个节点"
+            return True, f"成功加载 PageIndex ({source})，包含 {len(self.id_to_idx)} 个节点"
         except Exception as e:
+            self._reset()
             return False, f"加载异常: {str(e)}"
 
-    def _traverse(self, node, parent_path):
-        current_title = node.get("title", "")
-        node_id = str(node.get("node_id", "")) 
-        current_path = parent_path + [current_title]
-        
-        if node_id:
-            self.index[node_id] = {
-                "title": current_title,
-                "text": node.get("text", ""),
-                "summary": node.get("summary", ""),
-                "path": current_path,
-                "raw_node": node 
-            }
-            self.ordered_ids.append(node_id)
-        
-        if "nodes" in node and isinstance(node["nodes"], list):
-            for child in node["nodes"]:
-                self._traverse(child, current_path)
+    def _build_columns(self, stream):
+        # 流式解析按对象闭合顺序产出节点 (子先于父)，这里按前序编号 idx 归位
+        titles, node_ids, parents, texts, summaries, fingerprints, simhashes = [], [], [], [], [], [], []
+        content_fingerprints, content_simhashes = [], []
+        missing_titles = set()
+        interned = {}
+
+        for item in stream:
+            idx = item.idx
+            if idx >= len(parents):
+                grow = idx + 1 - len(parents)
+                for column in (titles, node_ids, parents, texts, summaries, fingerprints, simhashes,
+                               content_fingerprints, content_simhashes):
+                    column.extend([None] * grow)
+            node = item.node
+            if "title" not in node:
+                missing_titles.add(idx)
+            title = str(node.get("title", "") or "")
+            titles[idx] = interned.setdefault(title, title)
+            node_ids[idx] = str(node.get("node_id", ""))
+            parents[idx] = item.parent_idx
+            text = node.get("text") or ""
+            texts[idx] = text.encode("utf-8")
+            fingerprints[idx] = content_fingerprint(text)
+            simhashes[idx] = content_simhash(text)
+            summary = node.get("summary") or ""
+            summaries[idx] = summary.encode("utf-8")
+            content = format_node_content(summary, text)
+            content_fingerprints[idx] = content_fingerprint(content)
+            content_simhashes[idx] = content_simhash(content)
+
+        text_offsets = np.concatenate(([0], np.cumsum([len(t) for t in texts], dtype=np.int64)))
+        summary_offsets = np.concatenate(([0], np.cumsum([len(t) for t in summaries], dtype=np.int64)))
+        self._set_columns(titles, node_ids, parents,
+                          b"".join(texts), text_offsets, b"".join(summaries), summary_offsets,
+                          np.asarray(fingerprints, dtype=np.uint64), np.asarray(simhashes, dtype=np.uint64),
+                          np.asarray(content_fingerprints, dtype=np.uint64),
+                          np.asarray(content_simhashes, dtype=np.uint64))
+        self.missing_titles = missing_titles
+
+    def _load_sidecar(self, sidecar):
+        titles = sidecar.column_strings("title")
+        node_ids = sidecar.column_strings("node_id")
+        # 非字符串的标题 / node_id (数字、null) 保存在 extra 字段中，按 _build_columns 的规则转成字符串
+        missing_titles = set()
+        for idx in np.flatnonzero((sidecar.flags & 0b11) != 0b11):
+            node = sidecar.node_dict(int(idx))
+            if "title" not in node:
+                missing_titles.add(int(idx))
+            titles[idx] = str(node.get("title", "") or "")
+            node_ids[idx] = str(node.get("node_id", ""))
+        interned = {}
+        titles = [interned.setdefault(t, t) for t in titles]
+        text_buf, text_offsets = sidecar.column_buffer("text")
+        summary_buf, summary_offsets = sidecar.column_buffer("summary")
+        self._set_columns(titles, node_ids, np.array(sidecar.parents, dtype=np.int32),
+                          text_buf, text_offsets.astype(np.int64), summary_buf, summary_offsets.astype(np.int64),
+                          np.array(sidecar.text_fingerprints, dtype=np.uint64),
+                          np.array(sidecar.text_simhashes, dtype=np.uint64),
+                          np.array(sidecar.content_fingerprints, dtype=np.uint64),
+                          np.array(sidecar.content_simhashes, dtype=np.uint64))
+        self.missing_titles = missing_titles
+
+    def _set_columns(self, titles, node_ids, parents, text_buf, text_offsets, summary_buf, summary_offsets,
+                     fingerprints, simhashes, content_fingerprints, content_simhashes):
+        self.titles = titles
+        self.node_ids = node_ids
+        # 重复 node_id 以前序靠后的为准
+        for idx, node_id in enumerate(node_ids):
+            if node_id:
+                self.id_to_idx[node_id] = idx
+
+        self.parents = np.asarray(parents, dtype=np.int32)
+        self._text_buf = text_buf
+        self._text_offsets = text_offsets
+        self._summary_buf = summary_buf
+        self._summary_offsets = summary_offsets
+        self.fingerprints = fingerprints
+        self.simhashes = simhashes
+        self.content_fingerprints = content_fingerprints
+        self.content_simhashes = content_simhashes
+        # 粗略估算常驻内存: 两个缓冲区 + 偏移/父指针数组 + 每节点 id/标题引用与字典项开销
+        self.estimated_bytes = (len(self._text_buf) + len(self._summary_buf)
+                                + self._text_offsets.nbytes + self._summary_offsets.nbytes
+                                + self.parents.nbytes + self.fingerprints.nbytes + self.simhashes.nbytes
+                                + self.content_fingerprints.nbytes + self.content_simhashes.nbytes
+                                + 200 * len(node_ids))
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def __contains__(self, node_id):
+        return str(node_id) in self.id_to_idx
+
+    def node_text(self, idx):
+        start, end = self._text_offsets[idx], self._text_offsets[idx + 1]
+        return self._text_buf[start:end].decode("utf-8")
+
+    def node_summary(self, idx):
+        start, end = self._summary_offsets[idx], self._summary_offsets[idx + 1]
+        return self._summary_buf[start:end].decode("utf-8")
+
+    def get_path(self, idx, missing_title=None):
+        """经父指针回溯出从根到该节点的标题列表；missing_title 非 None 时替代缺少 title 字段的节点 (空标题保持不变)"""
+        path = []
+        while idx >= 0:
+            if missing_title is not None and idx in self.missing_titles:
+                path.append(missing_title)
+            else:
+                path.append(self.titles[idx])
+            idx = int(self.parents[idx])
+        path.reverse()
+        return path
 
     def get_node(self, node_id):
-        return self.index.get(str(node_id))
+        idx = self.id_to_idx.get(str(node_id))
+        if idx is None:
+            return None
+        return PageIndexNode(idx, self.node_ids[idx], self.titles[idx], self.node_text(idx), self.node_summary(idx))
+
+# ================= PageIndex 共享缓存 =================
+# 同一份 JSON 在进程内只解析一次，RecallWorker 与 JsonHardQueryWorker 共享同一个只读的 PageIndexLoader。
+# key = (绝对路径, mtime, size)；使用方 acquire / release 维护引用计数，
+# 总估算内存超过上限时按最近使用顺序淘汰未被引用的条目，文件变化后旧版本在引用归零时释放。
+# 加载 (含生成 sidecar) 在锁外进行: 同一 key 只由第一个调用方加载，其余调用方等待其 Future，
+# 不同文件的加载互不阻塞。
+PAGEINDEX_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+class PageIndexRegistry:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> {"loader", "refs"}
+        self._loading = {}              # key -> Future((success, msg))，正在加载的条目
+        self._mutex = QMutex()
+
+    @staticmethod
+    def _make_key(json_path):
+        abs_path = os.path.abspath(json_path)
+        st = os.stat(abs_path)
+        return (abs_path, st.st_mtime, st.st_size)
+
+    def acquire(self, json_path):
+        """返回 (loader, msg)，loader 为 None 表示加载失败；成功时调用方用完需 release(loader)"""
+        if not json_path or not os.path.exists(json_path):
+            return None, "文件不存在"
+        key = self._make_key(json_path)
+        while True:
+            locker = QMutexLocker(self._mutex)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry["refs"] += 1
+                self._evict_locked()
+                return entry["loader"], f"复用已加载的 PageIndex，包含 {len(entry['loader'].id_to_idx)} 个节点"
+            pending = self._loading.get(key)
+            if pending is None:
+                pending = Future()
+                self._loading[key] = pending
+                locker.unlock()
+                break
+            locker.unlock()
+            # 其他线程正在加载同一文件: 等待其完成后重新查表 (加载失败则直接返回同样的结果)
+            success, msg = pending.result()
+            if not success:
+                return None, msg
+
+        loader = PageIndexLoader()
+        success, msg = False, "加载中断"
+        try:
+            success, msg = loader.load_json(key[0])
+        finally:
+            locker = QMutexLocker(self._mutex)
+            del self._loading[key]
+            if success:
+                loader.registry_key = key
+                self._entries[key] = {"loader": loader, "refs": 1}
+                self._evict_locked()
+            locker.unlock()
+            pending.set_result((success, msg))
+        return (loader, msg) if success else (None, msg)
+
+    def release(self, loader):
+        if loader is None:
+            return
+        locker = QMutexLocker(self._mutex)
+        entry = self._entries.get(getattr(loader, "registry_key", None))
+        if entry is not None and entry["loader"] is loader:
+            entry["refs"] = max(0, entry["refs"] - 1)
+        self._evict_locked()
+
+    def _evict_locked(self):
+        # 1. 同一路径的旧版本 (文件已变化) 引用归零即释放
+        latest = {}
+        for key in self._entries:
+            if key[0] not in latest or key[1:] > latest[key[0]][1:]:
+                latest[key[0]] = key
+        for key in list(self._entries):
+            if key != latest[key[0]] and self._entries[key]["refs"] == 0:
+                del self._entries[key]
+        # 2. 超过内存上限时从最久未使用的条目开始淘汰 (仍被引用的条目保留)
+        total = self.total_bytes()
+        for key in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            entry = self._entries[key]
+            if entry["refs"] == 0:
+                total -= entry["loader"].estimated_bytes
+                del self._entries[key]
+
+    def total_bytes(self):
+        return sum(e["loader"].estimated_bytes for e in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+_PAGEINDEX_REGISTRY = PageIndexRegistry(PAGEINDEX_CACHE_MAX_BYTES)
 
 # ================= Worker: JSON Hard Query (独立线程) =================
 class JsonHardQueryWorker(QThread):
@@ -232,6 +549,7 @@ class JsonHardQueryWorker(QThread):
         self.json_path = json_path
         self.keywords = keywords
         self._is_interrupted = False
+        self._fallback_note = ""
 
     def stop(self):
         self._is_interrupted = True
@@ -241,51 +559,55 @@ class JsonHardQueryWorker(QThread):
             self.finished_signal.emit([], "JSON 路径无效或无关键词")
             return
 
+        # 优先走持久化倒排索引 (JSON 同目录 .kwidx，按内容哈希失效)；
+        # 首次使用或 JSON 变化时索引在后台构建，本次先回退线性扫描
+        keyword_index = load_keyword_index(self.json_path, wait=False)
+        if keyword_index is None:
+            self._fallback_note = "，倒排索引未就绪 (后台构建中)，本次使用线性扫描"
+        else:
+            try:
+                with keyword_index:
+                    self.search_with_index(keyword_index)
+                return
+            except Exception as e:
+                if self._is_interrupted: return
+                self._fallback_note = f"，倒排索引查询失败已回退线性扫描: {str(e)}"
+
         results = []
+        page_index = None
         try:
-            with open(self.json_path, 'r', encoding='utf-8-sig') as f:
-                data = json.load(f)
+            # 与 RecallWorker 共享进程内已解析的 PageIndex，避免同一文件重复 json.load
+            page_index, msg = _PAGEINDEX_REGISTRY.acquire(self.json_path)
+            if page_index is None:
+                self.finished_signal.emit([], f"JSON 加载失败: {msg}")
+                return
             
             if self._is_interrupted: return 
 
-            structure = data.get("structure", []) if isinstance(data, dict) else data
-            
-            def traverse_search(node, path_stack):
-                if self._is_interrupted: return
+            # 关键词集合编译为一个多模式自动机，每个节点正文单次扫描完成全部关键词计数
+            matcher = KeywordMatcher(self.keywords)
 
-                current_title = node.get("title", "未命名章节")
-                current_text = node.get("text", "")
-                node_id = str(node.get("node_id", "unknown"))
-                current_path = path_stack + [current_title]
-                
-                text_lower = current_text.lower()
-                hit_count = 0
-                for kw in self.keywords:
-                    if kw.lower() in text_lower:
-                        hit_count += 1
+            for idx in range(len(page_index)):
+                if self._is_interrupted: break
+
+                current_text = page_index.node_text(idx)
+                hit_count = matcher.count_hits(current_text)
                 
                 if hit_count > 0:
                     if len(current_text) > 10:
-                        path_str = " > ".join(current_path)
-                        # 这里依然保留基础分计算，但后续 Fusion 会忽略它
+                        # 倒排索引未就绪时的回退路径: 仅按命中数粗排 (索引可用时走 BM25F)
                         score = 10.0 + (hit_count * 2.0)
                         
                         results.append({
-                            "id": node_id,
+                            "id": page_index.node_ids[idx] or "unknown",
                             "content": current_text,
-                            "path": path_str,
+                            "node_idx": idx, # 路径只为最终候选生成
+                            "fingerprint": int(page_index.fingerprints[idx]), # 预计算的内容指纹 (RRF 去重)
+                            "simhash": int(page_index.simhashes[idx]), # 预计算的 SimHash (近似重复折叠)
                             "score": score,
                             "hit_count": hit_count, # 记录命中数供后续分析
                             "source": "JSON_Source" 
                         })
-
-                if "nodes" in node and isinstance(node["nodes"], list):
-                    for child in node["nodes"]:
-                        traverse_search(child, current_path)
-
-            for item in structure:
-                if self._is_interrupted: break
-                traverse_search(item, [])
             
             if self._is_interrupted:
                 self.finished_signal.emit([], "JSON 查询已中断")
@@ -294,11 +616,56 @@ class JsonHardQueryWorker(QThread):
             # 简单按照命中数预排序
             results.sort(key=lambda x: x['score'], reverse=True)
             top_results = results[:20] # 取前20做候选
+            for item in top_results:
+                item["path"] = " > ".join(page_index.get_path(item.pop("node_idx"), missing_title=DEFAULT_NODE_TITLE))
+                item["matches"] = matcher.find(item["content"])[1]
             
-            self.finished_signal.emit(top_results, f"JSON 原文检索命中: {len(top_results)} 条 (关键词: {self.keywords})")
+            self.finished_signal.emit(top_results, f"JSON 原文检索命中: {len(top_results)} 条 (关键词: {self.keywords}){self._fallback_note}")
             
         except Exception as e:
             self.finished_signal.emit([], f"JSON 查询异常: {str(e)}")
+        finally:
+            _PAGEINDEX_REGISTRY.release(page_index)
+
+    def search_with_index(self, keyword_index):
+        """
+        倒排表求交 + 候选子串校验 (命中语义与线性扫描一致)，命中节点按 BM25F (标题/摘要/正文) 排序
+        """
+        keyword_hits = keyword_index.match_keywords(self.keywords, should_stop=lambda: self._is_interrupted)
+        if self._is_interrupted:
+            self.finished_signal.emit([], "JSON 查询已中断")
+            return
+
+        hit_counts = defaultdict(int)
+        for hits in keyword_hits.values():
+            for idx in hits.tolist():
+                hit_counts[idx] += 1
+
+        # 正文过短的节点不参与
+        text_lens = keyword_index.node_lengths(hit_counts.keys())
+        candidates = [idx for idx in hit_counts if text_lens.get(idx, 0) > 10]
+        cand_idx, bm25_scores = keyword_index.bm25f_scores(keyword_hits, candidates)
+        order = sorted(range(len(cand_idx)), key=lambda i: (-bm25_scores[i], int(cand_idx[i])))
+        top = [(int(cand_idx[i]), float(bm25_scores[i])) for i in order[:20]] # 取前20做候选
+        nodes = keyword_index.get_nodes([idx for idx, _ in top])
+        matcher = KeywordMatcher(self.keywords)
+
+        top_results = []
+        for idx, score in top:
+            node = nodes[idx]
+            top_results.append({
+                "id": node["node_id"],
+                "content": node["text"],
+                "path": node["path"],
+                "score": score, # BM25F 分数，列表顺序即 RRF 使用的排名
+                "hit_count": hit_counts[idx],
+                "matches": matcher.find(node["text"])[1], # [(start, end, keyword)]，供片段高亮
+                "fingerprint": node["fingerprint"], # 建索引时预计算的内容指纹 (RRF 去重)
+                "simhash": node["simhash"], # 建索引时预计算的 SimHash (近似重复折叠)
+                "source": "JSON_Source"
+            })
+
+        self.finished_signal.emit(top_results, f"JSON 原文检索命中: {len(top_results)} 条 (关键词: {self.keywords}，BM25F 排序)")
 
 # ================= Worker: Recall + RRF Fusion =================
 class RecallWorker(QThread):
@@ -308,7 +675,7 @@ class RecallWorker(QThread):
     finish_signal = pyqtSignal(bool)      
 
     def __init__(self, query_text, db_path, json_path, search_mode="smart", summary_model="DeepSeek-R1", 
-                 doc_type="不指定类型", stopwords=None):
+                 doc_type="不指定类型", stopwords=None, vector_index="exact"):
         super().__init__()
         self.original_query = query_text 
         self.search_query = query_text   
@@ -318,14 +685,21 @@ class RecallWorker(QThread):
         self.summary_model = summary_model # DeepSeek-R1, X1-70B-thinking, etc.
         self.doc_type = doc_type # Feature: Document Type
         self.stopwords = stopwords if stopwords else [] # Feature: Stopwords
+        self.vector_index = vector_index # exact, ivf, hnsw, int8, pq (向量检索后端)
         
-        self.page_index = PageIndexLoader()
+        self.page_index = PageIndexLoader() # 运行时替换为 _PAGEINDEX_REGISTRY 中共享的只读实例
         self.json_search_results = [] 
         
         # 中断控制
         self._is_interrupted = False
         self._json_worker = None
 
+        # 阶段计时 & 并行阶段共享的 Embedding
+        self._query_start = time.time()
+        self.stage_times = []
+        self._embedding_lock = threading.Lock()
+        self._embedding_futures = {}
+
     def stop(self):
         """外部调用以停止任务"""
         self.log("🛑 收到停止指令，正在中断任务...")
@@ -342,6 +716,159 @@ class RecallWorker(QThread):
         self.json_search_results = results
         self.log(f"📄 {msg}")
 
+    # --- 阶段计时 (Time-to-first-results) ---
+    def mark_stage(self, name):
+        """记录某阶段产出结果的时刻 (相对查询开始)"""
+        offset = time.time() - self._query_start
+        self.stage_times.append((name, offset, None))
+        self.log(f"⏱️ [{name}] +{offset:.2f}s")
+
+    def timed_stage(self, name, func, *args):
+        """执行一个阶段并记录耗时与产出时刻 (可在线程池中调用)"""
+        start = time.time()
+        result = func(*args)
+        end = time.time()
+        self.stage_times.append((name, end - self._query_start, end - start))
+        self.log(f"⏱️ [{name}] 耗时 {end - start:.2f}s，+{end - self._query_start:.2f}s")
+        return result
+
+    def log_stage_summary(self):
+        lines = []
+        for name, offset, duration in sorted(self.stage_times, key=lambda x: x[1]):
+            cost = f" (耗时 {duration:.2f}s)" if duration is not None else ""
+            lines.append(f"   +{offset:6.2f}s  {name}{cost}")
+        self.log("⏱️ 阶段时间线:\n" + "\n".join(lines))
+
+    # --- Step 1 辅助: 同一 Worker 内共享的 Query Embedding ---
+    def get_query_embedding(self, text):
+        """
+        同一文本在本次查询内只请求一次 Embedding：推测检索、Rewrite 近似查找
+        与缓存写入并发请求同一文本时，后到者等待先到者的结果。
+        """
+        key = normalize_query_text(text)
+        with self._embedding_lock:
+            future = self._embedding_futures.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._embedding_futures[key] = future
+        if is_owner:
+            try:
+                future.set_result(self.get_remote_embedding(text))
+            except Exception as e:
+                self.log(f"❌ Embedding 异常: {str(e)}")
+                future.set_result(None)
+        return future.result()
+
+    # --- Step 1: Embedding + 向量检索 ---
+    def search_vectors(self, query_text, top_k=40):
+        """查询文本 -> Embedding -> 向量 Top-K 候选 [{id, vec_score, section_id}]；无法检索时返回 None"""
+        query_vec_list = self.get_query_embedding(query_text)
+        if self._is_interrupted or not query_vec_list:
+            return None
+        if not self.db_path or not os.path.exists(self.db_path):
+            return None
+        query_vec_np = np.array(query_vec_list, dtype=np.float32)
+
+        self.log(f"📂 正在连接数据库: {os.path.basename(self.db_path)}")
+        # 预解码 + 归一化的向量矩阵 (按 DB mtime/行数自动失效重建)，可选 IVF/HNSW 近似索引或 int8/PQ 量化存储
+        vector_searcher = get_vector_searcher(self.db_path, self.vector_index, log=self.log)
+        if self._is_interrupted: return None
+
+        search_start = time.time()
+        candidates = [
+            {"id": v_id, "vec_score": score, "section_id": sec_id}
+            for v_id, score, sec_id in vector_searcher.search(query_vec_np, top_k=top_k)
+        ]
+        self.log(f"⚡ 向量检索完成 [{self.vector_index}]: {len(vector_searcher)} 条中取 Top {len(candidates)} ({time.time() - search_start:.3f}s)")
+        return candidates
+
+    # --- Step 0 辅助: Rewrite 结果缓存 ---
+    def _rewrite_cache_keys(self, original_query):
+        """scope = (模型, 文档类型)；key = scope + 归一化原始查询"""
+        scope = make_cache_key(DEEPSEEK_V3_MODEL_NAME, self.doc_type)
+        return scope, make_cache_key(scope, normalize_query_text(original_query))
+
+    def lookup_cached_rewrite(self, original_query):
+        """先按 key 精确命中；未命中时在同 scope 的历史查询向量中找余弦相似度超过阈值的近似查询"""
+        cache = get_shared_cache(RAG_CACHE_PATH, "rewrite_cache",
+                                 max_entries=REWRITE_CACHE_MAX_ENTRIES, ttl_sec=REWRITE_CACHE_TTL_SEC)
+        if cache is None:
+            return None
+        scope, key = self._rewrite_cache_keys(original_query)
+
+        rewritten = cache.get(key)
+        if rewritten is not None:
+            self.log(f"🗄️ Rewrite 缓存命中 [{cache.stats_str()}]")
+            self.log(f"   Rewritten: {rewritten}")
+            return rewritten
+
+        if REWRITE_NEAR_DUP_THRESHOLD is None:
+            return None
+        vectors_by_dim = self._rewrite_vectors(scope)
+        if not vectors_by_dim:
+            return None
+
+        query_vec = self.get_query_embedding(original_query)
+        if query_vec is None:
+            return None
+        query_vec = np.asarray(query_vec, dtype=np.float32)
+        if query_vec.ndim != 1 or len(query_vec) not in vectors_by_dim:
+            return None
+        keys, matrix = vectors_by_dim[len(query_vec)]
+
+        query_norm = np.linalg.norm(query_vec)
+        sims = (matrix @ query_vec) / (query_norm if query_norm else 1.0)
+        best = int(np.argmax(sims))
+        if sims[best] < REWRITE_NEAR_DUP_THRESHOLD:
+            return None
+
+        rewritten = cache.get(keys[best])
+        if rewritten is not None:
+            self.log(f"🗄️ Rewrite 近似命中 (cos={sims[best]:.3f} ≥ {REWRITE_NEAR_DUP_THRESHOLD}) [{cache.stats_str()}]")
+            self.log(f"   Rewritten: {rewritten}")
+        return rewritten
+
+    def _rewrite_vectors(self, scope):
+        """scope 下历史查询按维度分组的 (keys, 行归一化矩阵)，解码结果常驻内存直到该 scope 有新写入"""
+        cached = _REWRITE_VECTORS.get(scope)
+        if cached is not None:
+            return cached
+        emb_cache = get_shared_cache(RAG_CACHE_PATH, "rewrite_embedding",
+                                     max_entries=REWRITE_CACHE_MAX_ENTRIES, ttl_sec=REWRITE_CACHE_TTL_SEC)
+        grouped = defaultdict(lambda: ([], []))
+        for cached_key, blob in (emb_cache.items_by_tag(scope) if emb_cache is not None else []):
+            vec = decode_embedding(blob)
+            if vec is not None and vec.ndim == 1:
+                keys, vecs = grouped[len(vec)]
+                keys.append(cached_key)
+                vecs.append(vec)
+        cached = {}
+        for dim, (keys, vecs) in grouped.items():
+            matrix = np.vstack(vecs).astype(np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            cached[dim] = (keys, matrix / norms)
+        _REWRITE_VECTORS.put(scope, cached)
+        return cached
+
+    def store_rewrite(self, original_query, rewritten):
+        cache = get_shared_cache(RAG_CACHE_PATH, "rewrite_cache",
+                                 max_entries=REWRITE_CACHE_MAX_ENTRIES, ttl_sec=REWRITE_CACHE_TTL_SEC)
+        if cache is None:
+            return
+        scope, key = self._rewrite_cache_keys(original_query)
+        cache.put(key, rewritten)
+
+        if REWRITE_NEAR_DUP_THRESHOLD is None:
+            return
+        emb_cache = get_shared_cache(RAG_CACHE_PATH, "rewrite_embedding",
+                                     max_entries=REWRITE_CACHE_MAX_ENTRIES, ttl_sec=REWRITE_CACHE_TTL_SEC)
+        query_vec = self.get_query_embedding(original_query) if emb_cache is not None else None
+        if query_vec is not None:
+            emb_cache.put(key, encode_embedding(query_vec), tag=scope)
+            _REWRITE_VECTORS.pop(scope)
+
     # --- Step 0: Query Rewrite (DeepSeek V3) ---
     def rewrite_query(self, original_query):
         if self._is_interrupted: return None
@@ -351,6 +878,12 @@ class RecallWorker(QThread):
             self.log("⏩ 精准模式：跳过查询重写")
             return original_query
 
+        # 【Cache】相同 (查询, 文档类型, 模型) 直接复用历史改写，结果稳定且无需 LLM 往返
+        cached_rewrite = self.lookup_cached_rewrite(original_query)
+        if cached_rewrite:
+            return cached_rewrite
+        if self._is_interrupted: return None
+
         self.log(f"🧠 正在请求 DeepSeek-V3 进行语义重写 (类型偏好: {self.doc_type})...")
         
         # 【Feature】注入 doc_type 到用户提示
@@ -374,7 +907,7 @@ class RecallWorker(QThread):
             start_time = time.time()
             if self._is_interrupted: return None
             
-            response = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload, verify=False, timeout=15)
+            response = http_post(DEEPSEEK_API_URL, endpoint="rewrite", headers=headers, json=payload)
             
             if response.status_code == 200:
                 data = response.json()
@@ -384,6 +917,8 @@ class RecallWorker(QThread):
                 self.log(f"✅ Rewrite 完成 ({time.time() - start_time:.2f}s)")
                 self.log(f"   Original: {original_query}")
                 self.log(f"   Rewritten: {content}")
+                if content:
+                    self.store_rewrite(original_query, content)
                 return content
             else:
                 self.log(f"⚠️ Rewrite API 返回错误: {response.status_code}，将使用原始查询。")
@@ -395,16 +930,30 @@ class RecallWorker(QThread):
     # --- Step 1: Embedding ---
     def get_remote_embedding(self, text):
         if self._is_interrupted: return None
-        self.log(f"📡 正在计算向量 Embedding: {text[:30]}...")
+
+        # 【Cache】按 (模型名, 归一化查询) 查本地缓存，命中则跳过远程调用
+        cache = get_shared_cache(RAG_CACHE_PATH, "embedding_cache",
+                                 max_entries=EMBEDDING_CACHE_MAX_ENTRIES, ttl_sec=EMBEDDING_CACHE_TTL_SEC)
+        cache_key = make_cache_key(EMBEDDING_MODEL_NAME, normalize_query_text(text))
+        if cache is not None:
+            cached_vec = decode_embedding(cache.get(cache_key))
+            if cached_vec is not None:
+                self.log(f"🗄️ Embedding 缓存命中 [{cache.stats_str()}]: {text[:30]}...")
+                return cached_vec.tolist()
+
+        self.log(f"📡 正在计算向量 Embedding: {text[:30]}..." + (f" [缓存 {cache.stats_str()}]" if cache is not None else ""))
         headers = { 'Content-Type': 'application/json', 'Authorization': f'Bearer {API_KEY}' }
         payload = { "model": EMBEDDING_MODEL_NAME, "input": [text] }
         
         try:
-            response = requests.post(EMBEDDING_API_URL, headers=headers, json=payload, verify=False, timeout=30)
+            response = http_post(EMBEDDING_API_URL, endpoint="embedding", headers=headers, json=payload)
             if response.status_code == 200:
                 data = response.json()
                 if 'data' in data and len(data['data']) > 0:
-                    return data['data'][0]['embedding']
+                    embedding = data['data'][0]['embedding']
+                    if cache is not None:
+                        cache.put(cache_key, encode_embedding(embedding))
+                    return embedding
         except Exception as e:
             self.log(f"❌ Embedding 网络异常: {str(e)}")
         return None
@@ -421,13 +970,32 @@ class RecallWorker(QThread):
             rerank_query = f"{query} (Prefer document type: {self.doc_type})"
             self.log(f"⚖️ Reranker 使用增强 Query: {rerank_query}")
 
-        self.log(f"⚖️ Reranker ({RERANK_MODEL_NAME}) 正在重排 {len(candidates_text_list)} 条数据...")
+        # 【Cache】按 (模型 + 重排 Query, 候选文本指纹) 缓存分数，只把未缓存的候选发给 Reranker
+        cache = get_shared_cache(RAG_CACHE_PATH, "rerank_cache",
+                                 max_entries=RERANK_CACHE_MAX_ENTRIES, ttl_sec=RERANK_CACHE_TTL_SEC)
+        query_key = make_cache_key(RERANK_MODEL_NAME, rerank_query)
+        pair_keys = [make_cache_key(query_key, get_text_hash(text)) for text in candidates_text_list]
+        scores = [None] * len(candidates_text_list)
+        if cache is not None:
+            cached_scores = cache.get_many(pair_keys)
+            for idx, pair_key in enumerate(pair_keys):
+                if pair_key in cached_scores:
+                    scores[idx] = float(cached_scores[pair_key])
+
+        pending_idx = [idx for idx, score in enumerate(scores) if score is None]
+        if not pending_idx:
+            self.log(f"🗄️ Reranker 缓存全部命中: {len(scores)} 条 [{cache.stats_str()}]")
+            return scores
+        pending_texts = [candidates_text_list[idx] for idx in pending_idx]
+
+        cache_note = f"，缓存命中 {len(scores) - len(pending_idx)} 条" if cache is not None else ""
+        self.log(f"⚖️ Reranker ({RERANK_MODEL_NAME}) 正在重排 {len(pending_texts)} 条数据{cache_note}...")
         headers = { 'Content-Type': 'application/json', 'Authorization': f'Bearer {API_KEY}' }
         
         payload = {
             "model": RERANK_MODEL_NAME,
             "query": rerank_query, 
-            "documents": candidates_text_list 
+            "documents": pending_texts 
         }
 
         try:
@@ -435,20 +1003,26 @@ class RecallWorker(QThread):
             if self._is_interrupted: return None
             
             # ================= 修复核心：增加超时时间到 120s =================
-            response = requests.post(RERANK_API_URL, headers=headers, json=payload, verify=False, timeout=120)
+            response = http_post(RERANK_API_URL, endpoint="rerank", headers=headers, json=payload)
             
             if response.status_code == 200:
                 data = response.json()
-                scores = [0.0] * len(candidates_text_list)
+                fresh_scores = [0.0] * len(pending_texts)
                 
                 if "results" in data:
                     for res in data["results"]:
                         idx = res.get("index")
                         score = res.get("relevance_score", 0.0)
-                        if idx is not None and 0 <= idx < len(scores):
-                            scores[idx] = score
+                        if idx is not None and 0 <= idx < len(fresh_scores):
+                            fresh_scores[idx] = score
                 elif isinstance(data, list):
-                     scores = data
+                     fresh_scores = data
+
+                # 新分数按原候选顺序合并回去，并写入缓存
+                for pos, idx in enumerate(pending_idx):
+                    scores[idx] = fresh_scores[pos] if pos < len(fresh_scores) else 0.0
+                if cache is not None:
+                    cache.put_many([(pair_keys[idx], float(scores[idx])) for idx in pending_idx])
 
                 self.log(f"✅ Reranker 完成，耗时: {time.time() - start_time:.2f}s")
                 return scores
@@ -459,6 +1033,46 @@ class RecallWorker(QThread):
             self.log(f"⚠️ Reranker 调用异常: {str(e)}")
             return None
 
+    # --- Step 2 辅助: 批量回填 documents 内容 ---
+    def hydrate_documents(self, cursor, section_ids):
+        """
+        批量取回 PageIndex 中缺失节点的 documents 行: 先查跨查询 LRU 缓存，
+        未命中的 id 合并为一次 VALUES-JOIN 查询 (与逐条 WHERE id=? 的类型匹配规则一致)。
+        返回 {section_id: (embedding_text, original_snippet, section_path, 内容指纹, SimHash)}，指纹随行缓存，不按查询重算
+        """
+        db_key = os.path.abspath(self.db_path)
+        db_mtime = os.path.getmtime(self.db_path)
+        rows = {}
+        pending = []
+        for sec_id in dict.fromkeys(section_ids):
+            cached = _HYDRATION_CACHE.get((db_key, db_mtime, sec_id), _CACHE_MISS)
+            if cached is _CACHE_MISS:
+                pending.append(sec_id)
+            elif cached is not None:
+                rows[sec_id] = cached
+
+        for start in range(0, len(pending), SQLITE_MAX_PARAMS):
+            chunk = pending[start:start + SQLITE_MAX_PARAMS]
+            placeholders = ",".join(["(?)"] * len(chunk))
+            cursor.execute(
+                f"WITH req(rid) AS (VALUES {placeholders}) "
+                f"SELECT req.rid, d.embedding_text, d.original_snippet, d.section_path "
+                f"FROM req JOIN documents d ON d.id = req.rid",
+                chunk
+            )
+            for rid, emb_text, snippet, section_path in cursor.fetchall():
+                if str(rid) not in rows:
+                    doc_text = format_document_text(emb_text, snippet)
+                    rows[str(rid)] = (emb_text, snippet, section_path,
+                                      content_fingerprint(doc_text), content_simhash(doc_text))
+
+        for sec_id in pending:
+            _HYDRATION_CACHE.put((db_key, db_mtime, sec_id), rows.get(sec_id))
+
+        if section_ids:
+            self.log(f"🗂️ documents 回填: {len(rows)} 条 (缓存命中 {len(set(section_ids)) - len(pending)}，单次 SQL 批量查询 {len(pending)} 个 id)")
+        return rows
+
     # --- Step 4: LLM Summary (流式 + Multi-Model 支持) ---
     def call_deepseek_summary(self, user_original_query, top_results):
         if self._is_interrupted: return
@@ -479,17 +1093,13 @@ class RecallWorker(QThread):
 """
             current_system_prompt += doc_type_constraint
 
-        context_str = ""
-        for item in top_results:
-            source_tag = item.get('source', 'VECTOR')
-            context_str += f"""
----
-[Rank {item['rank']}] [Source: {source_tag}] (RRF: {item['final_score']:.4f})
-Section Path: {item['path']}
-Content:
-{item['content']}
-"""
-        
+        # 按 token 预算打包召回片段 (去重叠句、按排名 / 融合分截断)
+        context_str, pack_stats = pack_context(top_results, SUMMARY_CONTEXT_TOKEN_BUDGET)
+        self.log(f"📦 上下文打包: {pack_stats['total_chunks']} → {pack_stats['chunks']} 个片段, "
+                 f"{pack_stats['packed_tokens']} / {pack_stats['budget_tokens']} tokens "
+                 f"(原始 {pack_stats['original_tokens']}，截断 {pack_stats['truncated']}，"
+                 f"去重叠 {pack_stats['overlap_segments']} 句) [{pack_stats['tokenizer']}]")
+
         user_prompt_content = f"Query: {user_original_query}\n\nRetrieved Chunks:{context_str}"
 
         headers = { 'Content-Type': 'application/json', 'Authorization': f'Bearer {API_KEY}' }
@@ -506,93 +1116,83 @@ Content:
         try:
             if self._is_interrupted: return
 
-            # 总结生成也给足超时时间
-            response = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload, verify=False, stream=True, timeout=120)
-            
-            if response.status_code == 200:
-                full_reasoning = ""
-                full_content = ""
-                is_thinking_logged = False
+            # 总结生成也给足超时时间 (流式响应读完或中断后关闭，连接归还连接池)
+            with http_post(DEEPSEEK_API_URL, endpoint="summary", headers=headers, json=payload, stream=True) as response:
+                if response.status_code == 200:
+                    full_reasoning = ""
+                    full_content = ""
+                    is_thinking_logged = False
                 
-                for line in response.iter_lines():
-                    if self._is_interrupted: 
-                        self.log("🛑 总结生成已中断")
-                        self.summary_signal.emit("\n\n[用户终止了生成]")
-                        break
-
-                    if line:
-                        decoded_line = line.decode('utf-8')
-                        if decoded_line.startswith("data: "):
-                            data_str = decoded_line[6:] 
-                            if data_str.strip() == "[DONE]":
-                                break
-                            try:
-                                json_chunk = json.loads(data_str)
-                                delta = json_chunk['choices'][0]['delta']
+                    for line in response.iter_lines():
+                        if self._is_interrupted: 
+                            self.log("🛑 总结生成已中断")
+                            self.summary_signal.emit("\n\n[用户终止了生成]")
+                            break
+
+                        if line:
+                            decoded_line = line.decode('utf-8')
+                            if decoded_line.startswith("data: "):
+                                data_str = decoded_line[6:] 
+                                if data_str.strip() == "[DONE]":
+                                    break
+                                try:
+                                    json_chunk = json.loads(data_str)
+                                    delta = json_chunk['choices'][0]['delta']
                                 
-                                # === Thinking Process 捕获 (适用于 R1, X1-thinking 等支持 reasoning_content 的模型) ===
-                                current_reasoning_delta = delta.get('reasoning_content', '')
-                                current_content_delta = delta.get('content', '')
-                                updated = False
+                                    # === Thinking Process 捕获 (适用于 R1, X1-thinking 等支持 reasoning_content 的模型) ===
+                                    current_reasoning_delta = delta.get('reasoning_content', '')
+                                    current_content_delta = delta.get('content', '')
+                                    updated = False
                                 
-                                if current_reasoning_delta:
-                                    if not is_thinking_logged:
-                                        self.log("🧠 检测到思维链 (CoT)，正在思考...")
-                                        is_thinking_logged = True
-                                    full_reasoning += current_reasoning_delta
-                                    updated = True
+                                    if current_reasoning_delta:
+                                        if not is_thinking_logged:
+                                            self.log("🧠 检测到思维链 (CoT)，正在思考...")
+                                            is_thinking_logged = True
+                                        full_reasoning += current_reasoning_delta
+                                        updated = True
                                 
-                                if current_content_delta:
-                                    full_content += current_content_delta
-                                    updated = True
+                                    if current_content_delta:
+                                        full_content += current_content_delta
+                                        updated = True
 
-                                if updated:
-                                    formatted_output = ""
+                                    if updated:
+                                        formatted_output = ""
                                     
-                                    # 实时展示思考过程
-                                    if full_reasoning:
-                                        clean_reasoning = full_reasoning.replace('\n', '\n> ')
-                                        formatted_output += f"> 🧠 **Thinking Process:**\n> {clean_reasoning}\n\n"
+                                        # 实时展示思考过程
+                                        if full_reasoning:
+                                            clean_reasoning = full_reasoning.replace('\n', '\n> ')
+                                            formatted_output += f"> 🧠 **Thinking Process:**\n> {clean_reasoning}\n\n"
                                     
-                                    if full_reasoning and full_content:
-                                        formatted_output += "---\n\n" 
+                                        if full_reasoning and full_content:
+                                            formatted_output += "---\n\n" 
                                         
-                                    if full_content:
-                                        formatted_output += f"{full_content}"
+                                        if full_content:
+                                            formatted_output += f"{full_content}"
                                         
-                                    self.summary_signal.emit(formatted_output)
-                            except Exception:
-                                continue
-                if not self._is_interrupted:
-                    self.log(f"✅ {target_model} 总结生成完毕")
-            else:
-                self.log(f"❌ API 错误: {response.status_code}")
-                self.summary_signal.emit(f"⚠️ 无法生成总结: API Error {response.status_code}")
+                                        self.summary_signal.emit(formatted_output)
+                                except Exception:
+                                    continue
+                    if not self._is_interrupted:
+                        self.log(f"✅ {target_model} 总结生成完毕")
+                else:
+                    self.log(f"❌ API 错误: {response.status_code}")
+                    self.summary_signal.emit(f"⚠️ 无法生成总结: API Error {response.status_code}")
 
         except Exception as e:
             self.log(f"❌ DeepSeek 调用异常: {str(e)}")
             self.summary_signal.emit(f"⚠️ 总结生成失败: {str(e)}")
 
     # --- 核心算法: RRF Fusion + Content Deduplication ---
-    def apply_rrf_fusion(self, vector_items, json_items, k=60):
+    def apply_rrf_fusion(self, vector_items, json_items, k=RRF_K):
         """
         倒数排名融合算法 (Reciprocal Rank Fusion)
+        按通道加权融合 (RAG_Fusion.fuse_ranked_lists)，并按预计算的内容指纹去重、SimHash 折叠近似重复
         """
-        fused_scores = defaultdict(float)
-        item_map = {}
-        
-        # 1. 处理 Vector 结果
-        for rank, item in enumerate(vector_items):
-            doc_id = item['id']
-            item_map[doc_id] = item
-            # Vector 权重默认 1.0
-            fused_scores[doc_id] += 1.0 / (k + rank + 1)
-            
-        # 2. 处理 JSON 结果
+        # JSON 结果列表顺序即词法排名 (倒排索引可用时为 BM25F 排序)
         # 动态路由逻辑
         is_precise = is_precise_intent(self.original_query)
         
-        # 权重调节因子
+        # 权重调节因子 (Vector 权重默认 1.0)
         json_boost = 1.0
         if self.search_mode == 'precise':
             json_boost = 5.0 # 强制优先
@@ -602,37 +1202,21 @@ Content:
         elif self.search_mode == 'fuzzy':
             json_boost = 0.5 # 降低权重
 
-        for rank, item in enumerate(json_items):
-            doc_id = item['id']
-            if doc_id not in item_map:
-                item_map[doc_id] = item
-                item_map[doc_id]['debug_score'] = "JSON_New"
-            
-            # JSON 融合
-            fused_scores[doc_id] += json_boost * (1.0 / (k + rank + 1))
-            
-            # 标记来源
-            if "JSON" not in item_map[doc_id].get('source', ''):
-                item_map[doc_id]['source'] = "MIXED (Vec+JSON)"
+        dedup_stats = {}
+        fused = fuse_ranked_lists([vector_items, json_items], weights=[1.0, json_boost], k=k, stats=dedup_stats)
+        if dedup_stats.get("near_duplicates"):
+            self.log(f"🧹 近似重复折叠: {dedup_stats['near_duplicates']} 条 (SimHash LSH)")
 
-        # 3. 排序
-        sorted_doc_ids = sorted(fused_scores.keys(), key=lambda x: fused_scores[x], reverse=True)
-        
-        # 4. === 新增：内容指纹去重 ===
         final_results = []
-        seen_fingerprints = set()
-        
-        for doc_id in sorted_doc_ids:
-            item = item_map[doc_id]
-            item['final_score'] = fused_scores[doc_id]
-            
-            # 计算内容指纹 (MD5)
-            content_fingerprint = get_text_hash(item.get('content', ''))
-            
-            if content_fingerprint in seen_fingerprints:
-                continue
-            
-            seen_fingerprints.add(content_fingerprint)
+        for candidate in fused:
+            item = candidate.item
+            in_vector, in_json = candidate.channels
+            # 标记来源
+            if not in_vector:
+                item['debug_score'] = "JSON_New"
+            elif in_json and "JSON" not in item.get('source', ''):
+                item['source'] = "MIXED (Vec+JSON)"
+            item['final_score'] = candidate.score
             final_results.append(item)
             
         return final_results
@@ -640,14 +1224,18 @@ Content:
     def run(self):
         try:
             self._is_interrupted = False
+            self._query_start = time.time()
+            self.stage_times = []
 
             # 0. 加载 PageIndex 
             has_pageindex = False
             if self.json_path:
                 self.log(f"加载 PageIndex: {os.path.basename(self.json_path)}...")
-                success, msg = self.page_index.load_json(self.json_path)
-                if success:
+                shared_index, msg = _PAGEINDEX_REGISTRY.acquire(self.json_path)
+                if shared_index is not None:
+                    self.page_index = shared_index
                     has_pageindex = True
+                    self.log(f"📚 {msg} [缓存 {len(_PAGEINDEX_REGISTRY)} 份文档, 约 {_PAGEINDEX_REGISTRY.total_bytes() / 1048576:.0f} MB]")
                 else:
                     self.log(f"⚠️ PageIndex 加载失败: {msg}")
             
@@ -667,8 +1255,21 @@ Content:
             
             if self._is_interrupted: return
 
-            # --- Step 0: Query Rewrite ---
-            rewritten = self.rewrite_query(self.original_query)
+            # --- Step 0 + Step 1: Query Rewrite 与推测式向量检索并行 ---
+            # Rewrite (LLM 往返 1-3s) 在线程池中执行，同时用原始查询先做 Embedding + 向量检索；
+            # Rewrite 返回后，若改写与原始查询一致则直接采用推测结果，否则用改写查询再检索一次并与推测结果合并。
+            speculative_candidates = None
+            with ThreadPoolExecutor(max_workers=2, thread_name_prefix="RecallStage") as executor:
+                rewrite_future = executor.submit(self.timed_stage, "Rewrite", self.rewrite_query, self.original_query)
+                speculative_future = None
+                if self.search_mode != "precise":
+                    speculative_future = executor.submit(
+                        self.timed_stage, "推测向量检索 (原始查询)", self.search_vectors, self.original_query
+                    )
+
+                rewritten = rewrite_future.result()
+                if speculative_future is not None:
+                    speculative_candidates = speculative_future.result()
             # 如果被中断，rewritten 可能是 None
             if self._is_interrupted: return
             
@@ -676,44 +1277,39 @@ Content:
 
             # --- Step 1: Query Vector ---
             vector_candidates = []
-            
-            query_vec_list = self.get_remote_embedding(self.search_query)
-            if self._is_interrupted: return
 
-            if query_vec_list and os.path.exists(self.db_path):
-                query_vec_np = np.array(query_vec_list, dtype=np.float32)
+            if speculative_candidates is not None and \
+                    normalize_query_text(self.search_query) == normalize_query_text(self.original_query):
+                self.log("⚡ 改写结果与原始查询一致，直接采用推测检索结果")
+                top_candidates_raw = speculative_candidates
+            else:
+                top_candidates_raw = self.timed_stage("向量检索 (改写查询)", self.search_vectors, self.search_query)
+                if speculative_candidates:
+                    top_candidates_raw = merge_vector_candidates(top_candidates_raw, speculative_candidates, top_k=40)
+                    self.log(f"🔀 合并改写查询与原始查询的向量候选: {len(top_candidates_raw)} 条")
+            if self._is_interrupted: return
 
-                self.log(f"📂 正在连接数据库: {os.path.basename(self.db_path)}")
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
-                cursor.execute("SELECT id, embedding, section_id FROM vectors")
-                rows = cursor.fetchall()
-                
-                raw_candidates = []
-                for row in rows:
-                    if self._is_interrupted: break 
-                    v_id, emb_json, sec_id_db = row
+            if top_candidates_raw:
+                # --- Step 2: 填充内容 ---
+                # 优先从 PageIndex 内存拿，拿不到的统一批量查 DB
+                missing_ids = [
+                    item["section_id"] for item in top_candidates_raw
+                    if not (has_pageindex and item["section_id"] in self.page_index)
+                ]
+                db_rows = {}
+                if missing_ids:
+                    conn = sqlite3.connect(self.db_path)
                     try:
-                        doc_vec = np.array(json.loads(emb_json), dtype=np.float32)
-                        score = cosine_similarity(query_vec_np, doc_vec)
-                        raw_candidates.append({"id": v_id, "vec_score": score, "section_id": str(sec_id_db)})
-                    except: continue
-
-                if self._is_interrupted: 
-                    conn.close()
-                    return
+                        db_rows = self.hydrate_documents(conn.cursor(), missing_ids)
+                    finally:
+                        conn.close()
+                self.mark_stage("候选内容回填完成")
 
-                raw_candidates.sort(key=lambda x: x["vec_score"], reverse=True)
-                top_candidates_raw = raw_candidates[:40] 
-                
-                # --- Step 2: 填充内容 ---
                 rerank_input_texts = []
                 
                 for item in top_candidates_raw:
                     if self._is_interrupted: break
                     sec_id = item["section_id"]
-                    # 优先从 PageIndex 内存拿，拿不到查 DB
                     node_info = self.page_index.get_node(sec_id) if has_pageindex else None
                     
                     raw_text = ""
@@ -721,36 +1317,37 @@ Content:
                     summary_text = ""
 
                     if node_info:
-                        raw_text = node_info['text']
-                        path_str = " > ".join(node_info['path'])
-                        summary_text = node_info.get('summary', '')
+                        raw_text = node_info.text
+                        path_str = " > ".join(self.page_index.get_path(node_info.idx))
+                        summary_text = node_info.summary
+                        fingerprint = int(self.page_index.content_fingerprints[node_info.idx])
+                        simhash = int(self.page_index.content_simhashes[node_info.idx])
                     else:
-                        cursor.execute("SELECT embedding_text, original_snippet, section_path FROM documents WHERE id=?", (sec_id,))
-                        db_row = cursor.fetchone()
+                        db_row = db_rows.get(sec_id)
                         if db_row:
-                            emb_summary = db_row[0] if db_row[0] else ""
-                            raw_detail = db_row[1] if db_row[1] else ""
-                            raw_text = f"【内容摘要】：{emb_summary}\n\n【原始数据】：{raw_detail}"
+                            raw_text = format_document_text(db_row[0], db_row[1])
                             path_str = str(db_row[2])
+                            fingerprint, simhash = db_row[3], db_row[4]
                         else:
                             continue
 
                     rerank_input_texts.append(f"Section Path: {path_str}\nContent: {raw_text}")
-                    display_content = f"[Summary]\n{summary_text}\n\n[Text]\n{raw_text}" if summary_text else raw_text
+                    display_content = format_node_content(summary_text, raw_text)
                     
                     vector_candidates.append({
                         "id": sec_id, # 统一使用 section_id / node_id 作为 RRF 的 Key
                         "vec_score": item["vec_score"],
                         "path": path_str,
                         "content": display_content,
+                        "fingerprint": fingerprint, # display_content 的内容指纹 (预计算)，与原 get_text_hash(content) 一致
+                        "simhash": simhash, # display_content 的 SimHash (预计算)，近似重复折叠
                         "source": "VECTOR" 
                     })
                 
-                conn.close()
-                
                 # --- Step 3: Rerank Vector Results ---
                 if not self._is_interrupted and vector_candidates:
                     rerank_scores = self.rerank_with_bge(self.search_query, rerank_input_texts)
+                    self.mark_stage("Rerank 完成")
                     if rerank_scores:
                         for idx, candidate in enumerate(vector_candidates):
                             candidate['rerank_score'] = rerank_scores[idx]
@@ -774,6 +1371,7 @@ Content:
             if self._is_interrupted:
                 self.finish_signal.emit(False)
                 return
+            self.mark_stage("JSON 原文检索结果就绪")
 
             # --- Step 5: 执行 RRF 融合 (含指纹去重) ---
             self.log("⚖️ 执行 RRF 融合与内容指纹去重...")
@@ -788,9 +1386,12 @@ Content:
                 res['rank'] = idx + 1
                 
             self.result_signal.emit(final_top_results)
+            self.mark_stage("首批召回结果已输出")
             
             # --- Step 6: DeepSeek Summary ---
             self.call_deepseek_summary(self.original_query, final_top_results)
+            self.mark_stage("总结生成结束")
+            self.log_stage_summary()
             
             if self._is_interrupted:
                 self.finish_signal.emit(False)
@@ -801,4 +1402,8 @@ Content:
             self.log(f"❌ 严重错误: {str(e)}")
             import traceback
             self.log(traceback.format_exc())
-            self.finish_signal.emit(False)
\ No newline at end of file
+            self.finish_signal.emit(False)
+        finally:
+            if self.page_index.is_loaded:
+                _PAGEINDEX_REGISTRY.release(self.page_index)
+                self.page_index = PageIndexLoader()
\ No newline at end of file
@@ -0,0 +1,193 @@
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+
+# ================= 本地持久化缓存 (SQLite KV) =================
+# 为 RAG 流水线中的远程调用 (Embedding / Rewrite / Rerank) 提供跨进程、跨会话的结果缓存。
+# 每类缓存对应同一 SQLite 文件中的一张表:
+#   key TEXT PRIMARY KEY | value BLOB | created REAL | accessed REAL | tag TEXT
+# tag 为可选分组标记，用于按组枚举条目 (如同一模型 + 文档类型下的全部查询向量)。
+# 淘汰策略: 读取时检查 TTL (按写入时间)；写入后超过 max_entries 时按最近访问时间 (LRU) 删除最旧条目。
+
+_SHARED_CACHES = {}
+_SHARED_LOCK = threading.Lock()
+_TABLE_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def normalize_query_text(text):
+    """
+    查询文本归一化: NFKC (全角转半角) + 合并空白 + 去首尾空白。
+    保留大小写，bge-m3 等模型对大小写敏感 (如航班号 CA1234)。
+    """
+    text = unicodedata.normalize("NFKC", text or "")
+    return " ".join(text.split())
+
+
+def make_cache_key(*parts):
+    """多个字段拼接后取 SHA256 作为缓存 key"""
+    raw = "\x00".join(str(p) for p in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SqliteCache:
+    """线程安全的 SQLite KV 缓存，支持 TTL + LRU 淘汰与命中统计"""
+
+    def __init__(self, db_path, table, max_entries=10000, ttl_sec=None):
+        if not _TABLE_NAME_RE.match(table):
+            raise ValueError(f"非法的缓存表名: {table}")
+        self.db_path = db_path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            f"key TEXT PRIMARY KEY, value BLOB, created REAL, accessed REAL, tag TEXT)"
+        )
+        # 兼容早期无 tag 列的缓存文件
+        columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+        if "tag" not in columns:
+            self._conn.execute(f"ALTER TABLE {table} ADD COLUMN tag TEXT")
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_accessed ON {table}(accessed)")
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_tag ON {table}(tag)")
+        self._conn.commit()
+        self.purge_expired()
+
+    def get(self, key):
+        """命中返回 value (bytes/str)，未命中或已过期返回 None"""
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and self.ttl_sec and now - row[1] > self.ttl_sec:
+                    self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                    self._conn.commit()
+                    row = None
+                if row is not None:
+                    self._conn.execute(f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key))
+                    self._conn.commit()
+            except sqlite3.Error:
+                # 缓存文件被锁或损坏时按未命中处理，不影响主流程
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def get_many(self, keys):
+        """批量读取 (单次查询 + 单次提交)，返回 {key: value}，只包含命中的条目"""
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        now = time.time()
+        found = {}
+        with self._lock:
+            try:
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    for key, value, created in self._conn.execute(
+                        f"SELECT key, value, created FROM {self.table} WHERE key IN ({placeholders})", chunk
+                    ):
+                        if self.ttl_sec and now - created > self.ttl_sec:
+                            continue
+                        found[key] = value
+                if found:
+                    self._conn.executemany(
+                        f"UPDATE {self.table} SET accessed = ? WHERE key = ?",
+                        [(now, k) for k in found]
+                    )
+                    self._conn.commit()
+            except sqlite3.Error:
+                found = {}
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def items_by_tag(self, tag):
+        """返回 tag 分组下未过期的全部 (key, value)，不计入命中统计"""
+        with self._lock:
+            try:
+                if self.ttl_sec:
+                    return self._conn.execute(
+                        f"SELECT key, value FROM {self.table} WHERE tag = ? AND created >= ?",
+                        (tag, time.time() - self.ttl_sec)
+                    ).fetchall()
+                return self._conn.execute(
+                    f"SELECT key, value FROM {self.table} WHERE tag = ?", (tag,)
+                ).fetchall()
+            except sqlite3.Error:
+                return []
+
+    def put(self, key, value, tag=None):
+        self.put_many([(key, value)], tag=tag)
+
+    def put_many(self, items, tag=None):
+        items = list(items)
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, created, accessed, tag) VALUES (?, ?, ?, ?, ?)",
+                    [(k, v, now, now, tag) for k, v in items]
+                )
+                self._evict_locked()
+                self._conn.commit()
+            except sqlite3.Error:
+                self._conn.rollback()
+
+    def _evict_locked(self):
+        if not self.max_entries:
+            return
+        count = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY accessed ASC LIMIT ?)",
+                (overflow,)
+            )
+
+    def purge_expired(self):
+        if not self.ttl_sec:
+            return
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE created < ?", (time.time() - self.ttl_sec,))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def stats_str(self):
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100) if total else 0.0
+        return f"命中 {self.hits} / 未命中 {self.misses} ({rate:.0f}%)"
+
+
+def get_shared_cache(db_path, table, max_entries=10000, ttl_sec=None):
+    """进程内共享的缓存实例 (同一文件 + 表只打开一次)，打开失败返回 None"""
+    key = (os.path.abspath(db_path), table)
+    with _SHARED_LOCK:
+        cache = _SHARED_CACHES.get(key)
+        if cache is None:
+            try:
+                cache = SqliteCache(db_path, table, max_entries=max_entries, ttl_sec=ttl_sec)
+            except (OSError, sqlite3.Error):
+                return None
+            _SHARED_CACHES[key] = cache
+        return cache
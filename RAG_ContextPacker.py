@@ -0,0 +1,248 @@
+import os
+import re
+import hashlib
+import threading
+
+import numpy as np
+
+# 可选: HuggingFace tokenizers (加载本地 DeepSeek tokenizer.json，计数与服务端一致)
+try:
+    from tokenizers import Tokenizer
+    HAS_TOKENIZERS = True
+except ImportError:
+    HAS_TOKENIZERS = False
+
+# 可选: tiktoken (cl100k_base，与 DeepSeek 分词接近)
+try:
+    import tiktoken
+    HAS_TIKTOKEN = True
+except ImportError:
+    HAS_TIKTOKEN = False
+
+# ================= 总结 Prompt 上下文打包 (Token 预算) =================
+# 召回结果按排名 / 融合分装入固定 token 预算:
+#   1. 按排名逐条切分为句 / 行片段，丢弃与更高排名片段重复的句子 (重叠页、重复表头)
+#   2. 预算按 RRF 分数比例分配给各片段 (不低于 MIN_CHUNK_TOKENS)，片段用不完的额度按排名让给被截断的片段
+#   3. 超出额度的片段在 token 边界截断；剩余预算不足 MIN_CHUNK_TOKENS 时不再放入更低排名的片段
+# 分词器优先级: 本地 tokenizer.json (tokenizers) > tiktoken cl100k_base (仅限 TIKTOKEN_CACHE_DIR 中已缓存，
+# 不联网下载) > 按 DeepSeek 官方换算比例估算。分词器在启动时由 warm_token_counter 在后台选定，不占用召回路径
+
+TOKENIZER_JSON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tokenizers", "tokenizer.json")
+TIKTOKEN_ENCODING = "cl100k_base"
+# tiktoken 以 BPE 文件 URL 的 SHA1 作为缓存文件名
+TIKTOKEN_BPE_URL = f"https://openaipublic.blob.core.windows.net/encodings/{TIKTOKEN_ENCODING}.tiktoken"
+
+DEFAULT_CONTEXT_TOKEN_BUDGET = 6000
+MIN_CHUNK_TOKENS = 160
+# 参与去重叠的最短句子 (归一化后字符数)，过短的行 (分隔符、短标题) 不去重
+MIN_OVERLAP_SEGMENT_CHARS = 12
+TRUNCATION_MARK = "\n…(已截断)"
+OVERLAP_MARK = "…"
+
+# 估算模式: DeepSeek 文档给出的换算 (1 个中文字符 ≈ 0.6 token，1 个英文字符 ≈ 0.3 token)
+_CJK_TOKEN_RATIO = 0.6
+_OTHER_TOKEN_RATIO = 0.3
+_CJK_RE = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+# 句 / 行切分 (保留分隔符，''.join 后还原原文)
+_SEGMENT_RE = re.compile(r"[^\n。！？!?；;]*[。！？!?；;]*\n?")
+
+_COUNTER = None
+_COUNTER_LOCK = threading.Lock()
+
+
+class _EncodingCounter:
+    """基于真实分词器 (encode / decode) 的计数与截断"""
+
+    def __init__(self, name, encode, decode):
+        self.name = name
+        self._encode = encode
+        self._decode = decode
+
+    def count(self, text):
+        return len(self._encode(text)) if text else 0
+
+    def truncate(self, text, max_tokens):
+        ids = self._encode(text)
+        if len(ids) <= max_tokens:
+            return text
+        return self._decode(ids[:max(max_tokens, 0)])
+
+
+class _EstimateCounter:
+    """无分词器时的估算: 按字符类别加权累计，截断点用 searchsorted 定位"""
+    name = "estimate"
+
+    def _weights(self, text):
+        weights = np.full(len(text), _OTHER_TOKEN_RATIO)
+        for m in _CJK_RE.finditer(text):
+            weights[m.start()] = _CJK_TOKEN_RATIO
+        return weights
+
+    def count(self, text):
+        if not text:
+            return 0
+        return int(np.ceil(self._weights(text).sum()))
+
+    def truncate(self, text, max_tokens):
+        cumulative = np.cumsum(self._weights(text))
+        if not len(cumulative) or cumulative[-1] <= max_tokens:
+            return text
+        return text[:int(np.searchsorted(cumulative, max_tokens, side="right"))]
+
+
+def _has_cached_tiktoken_encoding():
+    """BPE 文件已在 TIKTOKEN_CACHE_DIR 中 (否则 get_encoding 会尝试联网下载)"""
+    cache_dir = os.environ.get("TIKTOKEN_CACHE_DIR")
+    if not cache_dir:
+        return False
+    return os.path.exists(os.path.join(cache_dir, hashlib.sha1(TIKTOKEN_BPE_URL.encode()).hexdigest()))
+
+
+def _create_counter():
+    if HAS_TOKENIZERS and os.path.exists(TOKENIZER_JSON_PATH):
+        try:
+            tokenizer = Tokenizer.from_file(TOKENIZER_JSON_PATH)
+            return _EncodingCounter(
+                "tokenizer.json",
+                lambda text: tokenizer.encode(text, add_special_tokens=False).ids,
+                tokenizer.decode,
+            )
+        except Exception:
+            pass
+    if HAS_TIKTOKEN and _has_cached_tiktoken_encoding():
+        try:
+            encoding = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+            return _EncodingCounter(
+                f"tiktoken/{TIKTOKEN_ENCODING}",
+                lambda text: encoding.encode(text, disallowed_special=()),
+                encoding.decode,
+            )
+        except Exception:
+            pass
+    return _EstimateCounter()
+
+
+def get_token_counter():
+    """进程级共享的 token 计数器 (首次调用时选择可用的分词器)"""
+    global _COUNTER
+    with _COUNTER_LOCK:
+        if _COUNTER is None:
+            _COUNTER = _create_counter()
+        return _COUNTER
+
+
+def warm_token_counter():
+    """在后台线程中选定并加载分词器 (模块导入时调用)，之后的 get_token_counter 直接返回"""
+    threading.Thread(target=get_token_counter, daemon=True).start()
+
+
+def _normalize_segment(segment):
+    return " ".join(segment.lower().split())
+
+
+def remove_overlaps(text, seen):
+    """
+    去掉与更高排名片段重复的句 / 行 (seen 为已放入的归一化句子集合，会被更新)。
+    连续被删的句子替换为一个省略号，返回 (新文本, 删除的句子数)。
+    """
+    kept = []
+    removed = 0
+    skipping = False
+    for segment in _SEGMENT_RE.findall(text):
+        if not segment:
+            continue
+        key = _normalize_segment(segment)
+        if len(key) >= MIN_OVERLAP_SEGMENT_CHARS:
+            if key in seen:
+                removed += 1
+                if not skipping:
+                    kept.append(OVERLAP_MARK + ("\n" if segment.endswith("\n") else ""))
+                    skipping = True
+                continue
+            seen.add(key)
+        kept.append(segment)
+        skipping = False
+    return "".join(kept), removed
+
+
+def format_chunk_header(item):
+    source_tag = item.get('source', 'VECTOR')
+    return f"""
+---
+[Rank {item['rank']}] [Source: {source_tag}] (RRF: {item['final_score']:.4f})
+Section Path: {item['path']}
+Content:
+"""
+
+
+def pack_context(items, budget_tokens=DEFAULT_CONTEXT_TOKEN_BUDGET, counter=None):
+    """
+    items: 已按排名排序的召回结果 (含 rank / final_score / path / content / source)
+    返回 (context_str, stats)，stats 含 packed_tokens / original_tokens / chunks / truncated / dropped /
+    overlap_segments / tokenizer
+    """
+    counter = counter or get_token_counter()
+    mark_tokens = counter.count(TRUNCATION_MARK)
+    seen = set()
+    chunks = []
+    original_tokens = 0
+    overlap_segments = 0
+    for item in items:
+        header = format_chunk_header(item)
+        content = item.get('content') or ""
+        original_tokens += counter.count(header) + counter.count(content)
+        content, removed = remove_overlaps(content, seen)
+        overlap_segments += removed
+        chunks.append({
+            "header": header,
+            "content": content,
+            "header_tokens": counter.count(header) + 1,    # 含片段末尾换行
+            "content_tokens": counter.count(content),
+            "score": max(float(item.get('final_score') or 0.0), 0.0),
+        })
+
+    # 第一轮: 按融合分比例分配额度 (不低于 MIN_CHUNK_TOKENS)，按排名放入直到预算不足
+    total_score = sum(c["score"] for c in chunks) or 1.0
+    remaining = budget_tokens
+    packed = []
+    for chunk in chunks:
+        if remaining - chunk["header_tokens"] < MIN_CHUNK_TOKENS:
+            break
+        remaining -= chunk["header_tokens"]
+        share = max(MIN_CHUNK_TOKENS, int(budget_tokens * chunk["score"] / total_score))
+        chunk["allowed"] = min(chunk["content_tokens"], share, remaining)
+        remaining -= chunk["allowed"]
+        packed.append(chunk)
+
+    # 第二轮: 剩余额度按排名补给被截断的片段
+    for chunk in packed:
+        if remaining <= 0:
+            break
+        extra = min(chunk["content_tokens"] - chunk["allowed"], remaining)
+        if extra > 0:
+            chunk["allowed"] += extra
+            remaining -= extra
+
+    parts = []
+    truncated = 0
+    for chunk in packed:
+        content = chunk["content"]
+        if chunk["allowed"] < chunk["content_tokens"]:
+            content = counter.truncate(content, max(chunk["allowed"] - mark_tokens, 0)) + TRUNCATION_MARK
+            truncated += 1
+        parts.append(chunk["header"] + content + "\n")
+    context_str = "".join(parts)
+    packed_tokens = counter.count(context_str)
+
+    stats = {
+        "packed_tokens": packed_tokens,
+        "original_tokens": original_tokens,
+        "budget_tokens": budget_tokens,
+        "chunks": len(packed),
+        "total_chunks": len(chunks),
+        "truncated": truncated,
+        "dropped": len(chunks) - len(packed),
+        "overlap_segments": overlap_segments,
+        "tokenizer": counter.name,
+    }
+    return context_str, stats
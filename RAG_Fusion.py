@@ -0,0 +1,167 @@
+import hashlib
+from collections import namedtuple
+
+import numpy as np
+
+# ================= 多路排序融合 (RRF) 与内容指纹去重 =================
+# 接受 N 路任意深度的排序候选列表 (每个候选为 dict，至少包含 "id")，按通道加权的倒数排名融合:
+#   score(id) = Σ_c  w_c / (k + rank_c(id) + 1)
+# 打分、排序与去重全部在 NumPy 数组上完成，Python 层只做一次 id -> 整数编码。
+# 去重使用 64 位内容指纹 (候选的 "fingerprint" 字段)，由 PageIndexLoader / 关键词索引 / sidecar
+# 在建索引时预先计算，查询时不再对全文做哈希；缺少该字段的候选才现场计算。
+#
+# 近似重复折叠: 精确去重之后，再按 64 位 SimHash (候选的 "simhash" 字段，同样预先计算) 折叠
+# 重叠页、重复表头等近似内容。签名按 max_distance + 1 段切分建 LSH 桶: 汉明距离 <= max_distance 的两个签名
+# 至少有一段完全相同 (鸽巢原理)，因此每个候选只需与同桶签名比较，无需两两比较。
+
+RRF_K = 60
+
+# SimHash: 字符 3-gram 特征 (CJK 无需分词)，正文过短不生成签名 (签名为 0 表示不参与近似折叠)
+SIMHASH_SHINGLE = 3
+SIMHASH_MIN_CHARS = 16
+# 判定为近似重复的最大汉明距离 (64 位签名)，None 关闭近似折叠
+SIMHASH_MAX_DISTANCE = 3
+
+_SHINGLE_PRIMES = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9], dtype=np.uint64)
+
+FusedCandidate = namedtuple("FusedCandidate", ["item", "score", "channels"])
+
+
+def format_node_content(summary, text):
+    """节点候选的 content 拼接格式 (有摘要时摘要在前)；向量通道候选的指纹 / SimHash 即对此字符串计算"""
+    return f"[Summary]\n{summary}\n\n[Text]\n{text}" if summary else text
+
+
+def content_fingerprint(text):
+    """内容指纹: 去首尾空白 + 小写后取 BLAKE2b-64 (与 get_text_hash 的归一化一致)，返回 Python int (uint64)"""
+    clean_text = (text or "").strip().lower()
+    digest = hashlib.blake2b(clean_text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def content_fingerprints(texts):
+    """批量计算指纹，返回 np.uint64 数组"""
+    return np.fromiter((content_fingerprint(t) for t in texts), dtype=np.uint64, count=len(texts))
+
+
+def content_simhash(text):
+    """64 位 SimHash: 空白归一 + 小写后取字符 shingle，特征哈希逐位投票 (NumPy 向量化)，返回 Python int"""
+    clean_text = " ".join((text or "").lower().split())
+    if len(clean_text) < max(SIMHASH_MIN_CHARS, SIMHASH_SHINGLE):
+        return 0
+    codes = np.frombuffer(clean_text.encode("utf-32-le"), dtype="<u4").astype(np.uint64)
+    n = len(codes) - SIMHASH_SHINGLE + 1
+    h = np.zeros(n, dtype=np.uint64)
+    for i in range(SIMHASH_SHINGLE):
+        h += codes[i:i + n] * _SHINGLE_PRIMES[i % len(_SHINGLE_PRIMES)]
+    # splitmix64 混合，使各位近似独立
+    h ^= h >> np.uint64(30)
+    h *= np.uint64(0xBF58476D1CE4E5B9)
+    h ^= h >> np.uint64(27)
+    h *= np.uint64(0x94D049BB133111EB)
+    h ^= h >> np.uint64(31)
+    bits = np.unpackbits(h.astype("<u8").view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    signature = bits.sum(axis=0, dtype=np.int32) * 2 > n
+    return int(np.packbits(signature, bitorder="little").view("<u8")[0])
+
+
+def content_simhashes(texts):
+    """批量计算 SimHash，返回 np.uint64 数组"""
+    return np.fromiter((content_simhash(t) for t in texts), dtype=np.uint64, count=len(texts))
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def suppress_near_duplicates(signatures, max_distance=SIMHASH_MAX_DISTANCE):
+    """
+    按给定顺序扫描签名，返回保留的位置列表 (与之前保留的签名汉明距离均 > max_distance)。
+    签名为 0 (正文过短) 的候选始终保留。
+    """
+    bands = max_distance + 1
+    bounds = [64 * b // bands for b in range(bands + 1)]
+    masks = [(1 << (bounds[b + 1] - bounds[b])) - 1 for b in range(bands)]
+    buckets = [{} for _ in range(bands)]
+    kept = []
+    for pos, signature in enumerate(signatures):
+        signature = int(signature)
+        if signature == 0:
+            kept.append(pos)
+            continue
+        keys = [(signature >> bounds[b]) & masks[b] for b in range(bands)]
+        if any(hamming_distance(signature, other) <= max_distance
+               for b, key in enumerate(keys) for other in buckets[b].get(key, ())):
+            continue
+        kept.append(pos)
+        for b, key in enumerate(keys):
+            buckets[b].setdefault(key, []).append(signature)
+    return kept
+
+
+def fuse_ranked_lists(ranked_lists, weights=None, k=RRF_K, dedup=True,
+                      max_distance=SIMHASH_MAX_DISTANCE, stats=None):
+    """
+    多路 RRF 融合。
+    ranked_lists: N 个按相关度降序排列的候选列表
+    weights:      各通道权重 (默认全为 1.0)
+    同一 id 以首次出现 (通道顺序在前、排名靠前) 的候选作为代表；同分时保持首次出现顺序。
+    dedup=True 时按代表候选的内容指纹去重，保留融合分最高者；max_distance 不为 None 时再按 SimHash 折叠近似重复。
+    stats 传入 dict 时写入 {"exact_duplicates": n, "near_duplicates": m}。
+    返回 [FusedCandidate(item, score, channels)]，channels 为该 id 出现过的通道布尔数组。
+    """
+    n_channels = len(ranked_lists)
+    weights = np.ones(n_channels) if weights is None else np.asarray(weights, dtype=np.float64)
+    lengths = np.fromiter((len(items) for items in ranked_lists), dtype=np.int64, count=n_channels)
+    total = int(lengths.sum())
+    if total == 0:
+        return []
+
+    flat_items = [item for items in ranked_lists for item in items]
+    code_of = {}
+    codes = np.fromiter((code_of.setdefault(item["id"], len(code_of)) for item in flat_items),
+                        dtype=np.int64, count=total)
+    channel = np.repeat(np.arange(n_channels), lengths)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    ranks = np.arange(total) - np.repeat(starts, lengths)
+
+    n_unique = len(code_of)
+    scores = np.bincount(codes, weights=weights[channel] / (k + ranks + 1), minlength=n_unique)
+    membership = np.zeros((n_unique, n_channels), dtype=bool)
+    membership[codes, channel] = True
+    # 编码按首次出现顺序分配，首次出现位置即代表候选
+    _, first_pos = np.unique(codes, return_index=True)
+
+    order = np.lexsort((np.arange(n_unique), -scores))
+    exact_dups = near_dups = 0
+    if dedup:
+        fingerprints = np.fromiter(
+            (_item_fingerprint(flat_items[pos]) for pos in first_pos), dtype=np.uint64, count=n_unique
+        )
+        _, keep = np.unique(fingerprints[order], return_index=True)
+        exact_dups = len(order) - len(keep)
+        order = order[np.sort(keep)]
+        if max_distance is not None:
+            signatures = [_item_simhash(flat_items[first_pos[code]]) for code in order]
+            keep = suppress_near_duplicates(signatures, max_distance)
+            near_dups = len(order) - len(keep)
+            order = order[keep]
+    if stats is not None:
+        stats.update(exact_duplicates=exact_dups, near_duplicates=near_dups)
+
+    return [FusedCandidate(flat_items[first_pos[code]], float(scores[code]), membership[code])
+            for code in order]
+
+
+def _item_fingerprint(item):
+    fingerprint = item.get("fingerprint")
+    if fingerprint is None:
+        fingerprint = content_fingerprint(item.get("content", ""))
+    return fingerprint
+
+
+def _item_simhash(item):
+    simhash = item.get("simhash")
+    if simhash is None:
+        simhash = content_simhash(item.get("content", ""))
+    return simhash
@@ -0,0 +1,140 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 可选: httpx + h2 可用时走 HTTP/2 (单连接多路复用)，否则回退到 requests 连接池 (HTTP/1.1 keep-alive)
+try:
+    import httpx
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    HAS_HTTP2 = True
+except ImportError:
+    HAS_HTTP2 = False
+
+# ================= 共享 HTTP 客户端 (连接池 + Keep-Alive) =================
+# Rewrite / Embedding / Rerank / Summary 以及向量化脚本都通过同一个进程级客户端访问内网网关，
+# 复用已建立的 TCP/TLS 连接，避免每次调用重新握手。
+
+# 每个 host 的连接池大小 (召回流程中 Rewrite 与推测检索会并发请求同一网关)
+POOL_CONNECTIONS = 4       # 缓存的 host 连接池个数
+POOL_MAXSIZE = 8           # 单个 host 保持的最大空闲连接数
+KEEPALIVE_EXPIRY_SEC = 60  # HTTP/2 客户端空闲连接保留时间
+# 是否读取环境变量中的代理设置 (HTTP(S)_PROXY / NO_PROXY)，与原先每次 requests.post 的行为一致；
+# 确认网关不需要经过代理时可设为 False
+HTTP_TRUST_ENV = True
+
+# 各接口超时 (连接超时, 读取超时)，单位秒
+ENDPOINT_TIMEOUTS = {
+    "rewrite": (5, 15),
+    "embedding": (5, 30),
+    "rerank": (5, 120),
+    "summary": (5, 120),
+    "vector_gen": (10, 60),
+}
+DEFAULT_TIMEOUT = (10, 60)
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_endpoint_timeout(endpoint):
+    return ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+
+
+class _Http2Response:
+    """把 httpx 响应包装成与 requests.Response 一致的接口 (status_code / headers / json / iter_lines)"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    @property
+    def text(self):
+        self._response.read()
+        return self._response.text
+
+    def json(self):
+        self._response.read()
+        return self._response.json()
+
+    def iter_lines(self):
+        # requests 的 iter_lines 产出 bytes，这里保持一致
+        for line in self._response.iter_lines():
+            yield line.encode("utf-8")
+
+    def close(self):
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PooledHttpClient:
+    """线程安全的共享 HTTP 客户端，按 endpoint 名称选择超时"""
+
+    def __init__(self, use_http2=None, verify=False, trust_env=HTTP_TRUST_ENV):
+        self.verify = verify
+        self.use_http2 = HAS_HTTP2 if use_http2 is None else (use_http2 and HAS_HTTP2)
+        self._session = None
+        self._http2_client = None
+
+        if self.use_http2:
+            self._http2_client = httpx.Client(
+                http2=True,
+                verify=verify,
+                trust_env=trust_env,
+                limits=httpx.Limits(
+                    max_connections=POOL_MAXSIZE,
+                    max_keepalive_connections=POOL_MAXSIZE,
+                    keepalive_expiry=KEEPALIVE_EXPIRY_SEC,
+                ),
+            )
+        else:
+            session = requests.Session()
+            session.trust_env = trust_env
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._session = session
+
+    def post(self, url, endpoint=None, json=None, headers=None, stream=False, timeout=None):
+        """
+        发送 POST 请求。stream=True 时调用方需在读完后 close() 或使用 with 语句，连接才会归还连接池。
+        """
+        timeout = timeout or get_endpoint_timeout(endpoint)
+        if self._http2_client is not None:
+            connect_timeout, read_timeout = timeout
+            request = self._http2_client.build_request(
+                "POST", url, json=json, headers=headers,
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            )
+            response = self._http2_client.send(request, stream=True)
+            if not stream:
+                response.read()
+            return _Http2Response(response)
+        return self._session.post(url, json=json, headers=headers, stream=stream,
+                                  timeout=timeout, verify=self.verify)
+
+    def close(self):
+        if self._http2_client is not None:
+            self._http2_client.close()
+        if self._session is not None:
+            self._session.close()
+
+
+def get_http_client():
+    """进程级共享客户端 (首次调用时创建)"""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = PooledHttpClient()
+        return _CLIENT
+
+
+def http_post(url, endpoint=None, json=None, headers=None, stream=False, timeout=None):
+    return get_http_client().post(url, endpoint=endpoint, json=json, headers=headers,
+                                  stream=stream, timeout=timeout)
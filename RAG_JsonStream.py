@@ -0,0 +1,198 @@
+import os
+import re
+import json
+import codecs
+from collections import namedtuple
+
+# ================= PageIndex JSON 流式解析 =================
+# json.load 需要一次性读入并构建整棵树，书籍级 PDF 的结构文件会带来内存尖峰与界面卡顿。
+# 这里按块读取文件，只对「节点对象」做结构化解析，节点内的普通字段 (title/text/summary/...)
+# 交给 C 实现的 JSONDecoder.raw_decode 直接解码，每个节点在其对象闭合时立即产出，
+# 调用方无需等待整个文件读完即可开始处理。
+#
+# 节点位置: 根列表的元素、根对象 root_keys 数组 (默认 "structure") 的元素、以及任意节点 "nodes" 数组的元素。
+# 产出顺序: 对象闭合顺序 (子节点先于父节点)；idx 为前序编号，与 json.load 后递归遍历的顺序一致。
+# path 为从根到该节点的 title 列表 (缺失为 None)，要求节点的 "title" 写在 "nodes" 之前 (PageIndex 输出满足)。
+
+StreamNode = namedtuple("StreamNode", ["node", "path", "depth", "idx", "parent_idx", "child_count"])
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+_WS_RE = re.compile(r"[ \t\n\r]*")
+_DECODER = json.JSONDecoder()
+
+
+class JsonStreamError(ValueError):
+    pass
+
+
+class PageIndexJsonStream:
+    """
+    用法:
+        stream = PageIndexJsonStream(path)
+        for item in stream:      # StreamNode
+            ...
+        stream.root_fields       # 根对象中除节点数组外的字段 (如 doc_name)，随解析进度逐步填充
+        stream.progress          # 已解析位置占文件大小的比例 (0 ~ 1，按缓冲区内字符比例折算字节)
+    """
+
+    def __init__(self, json_path, root_keys=("structure",), root_as_node=False, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.json_path = json_path
+        self.root_keys = tuple(root_keys)
+        self.root_as_node = root_as_node
+        self.chunk_size = chunk_size
+        self.root_fields = {}
+        self.node_count = 0
+        self.file_size = os.path.getsize(json_path)
+        self.bytes_read = 0
+
+        self._file = None
+        self._buf_bytes = 0     # 当前缓冲区对应的 (近似) 字节数
+        self._decoder = None
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _pending_bytes(self):
+        """缓冲区中尚未解析部分对应的近似字节数"""
+        if not self._buf:
+            return 0
+        return self._buf_bytes * (len(self._buf) - self._pos) / len(self._buf)
+
+    @property
+    def progress(self):
+        if not self.file_size:
+            return 1.0
+        return min(1.0, max(0.0, (self.bytes_read - self._pending_bytes()) / self.file_size))
+
+    # ---------- 缓冲区 ----------
+    def _fill(self):
+        """读入下一块 (保留未消费部分)，已到文件末尾返回 False"""
+        if self._eof:
+            return False
+        data = self._file.read(self.chunk_size)
+        self.bytes_read += len(data)
+        pending = self._pending_bytes()
+        if not data:
+            self._eof = True
+            tail = self._decoder.decode(b"", final=True)
+            if tail:
+                self._buf = self._buf[self._pos:] + tail
+                self._pos = 0
+                self._buf_bytes = pending
+            return bool(tail)
+        self._buf = self._buf[self._pos:] + self._decoder.decode(data)
+        self._pos = 0
+        self._buf_bytes = pending + len(data)
+        return True
+
+    def _peek(self):
+        """跳过空白并返回下一个字符，文件结束返回空串"""
+        while True:
+            self._pos = _WS_RE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, chars):
+        ch = self._peek()
+        if ch not in chars:
+            raise JsonStreamError(f"JSON 格式错误: 位置附近应为 {chars!r}，实际为 {ch!r}")
+        self._pos += 1
+        return ch
+
+    def _value(self):
+        """解码一个完整的普通 JSON 值 (C 实现)，缓冲区不足时续读后重试"""
+        self._peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # 数字可能在块边界被截断，值恰好结束于缓冲区末尾时续读一次确认
+            if end >= len(self._buf) and not self._eof and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    # ---------- 节点解析 ----------
+    def _node_array(self, parent_idx, parent_path, depth):
+        """当前位置为节点数组 '['，逐个解析元素；返回子节点个数"""
+        self._expect("[")
+        count = 0
+        if self._peek() == "]":
+            self._pos += 1
+            return count
+        while True:
+            if self._peek() == "{":
+                count += 1
+                yield from self._node_object(parent_idx, parent_path, depth)
+            else:
+                self._value()   # 非对象元素: 与遍历逻辑一致，直接跳过
+            if self._expect(",]") == "]":
+                return count
+
+    def _node_object(self, parent_idx, parent_path, depth):
+        idx = self.node_count
+        self.node_count += 1
+        node = {}
+        child_count = 0
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+        else:
+            while True:
+                key = self._value()
+                self._expect(":")
+                if key == "nodes" and self._peek() == "[":
+                    child_path = parent_path + [node.get("title")]
+                    child_count = yield from self._node_array(idx, child_path, depth + 1)
+                else:
+                    node[key] = self._value()
+                if self._expect(",}") == "}":
+                    break
+        yield StreamNode(node, parent_path + [node.get("title")], depth, idx, parent_idx, child_count)
+
+    def _root_object(self):
+        self._expect("{")
+        found_nodes = False
+        if self._peek() == "}":
+            self._pos += 1
+        else:
+            while True:
+                key = self._value()
+                self._expect(":")
+                if key in self.root_keys and self._peek() == "[":
+                    found_nodes = True
+                    yield from self._node_array(-1, [], 1)
+                else:
+                    self.root_fields[key] = self._value()
+                if self._expect(",}") == "}":
+                    break
+        if self.root_as_node and not found_nodes:
+            # 根对象本身即单个节点 (与 _smart_parse_structure 的 [data] 分支一致)
+            idx = self.node_count
+            self.node_count += 1
+            yield StreamNode(dict(self.root_fields), [self.root_fields.get("title")], 1, idx, -1, 0)
+
+    def __iter__(self):
+        with open(self.json_path, "rb") as f:
+            self._file = f
+            self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+            self._buf, self._pos, self._eof = "", 0, False
+            self.bytes_read = self._buf_bytes = 0
+            first = self._peek()
+            if first == "[":
+                yield from self._node_array(-1, [], 1)
+            elif first == "{":
+                yield from self._root_object()
+            elif first:
+                self._value()
+            self._file = None
+
+
+def iter_json_nodes(json_path, root_keys=("structure",), root_as_node=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """便捷函数: 流式产出 StreamNode"""
+    return iter(PageIndexJsonStream(json_path, root_keys=root_keys, root_as_node=root_as_node, chunk_size=chunk_size))
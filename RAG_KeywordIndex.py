@@ -0,0 +1,569 @@
+import os
+import re
+import sys
+import time
+import hashlib
+import sqlite3
+import argparse
+import threading
+from collections import defaultdict
+
+import numpy as np
+import jieba
+
+from RAG_JsonStream import PageIndexJsonStream
+from RAG_PageIndexSidecar import open_sidecar
+from RAG_Fusion import content_fingerprint, content_simhash
+
+# 可选: pyahocorasick (C 实现的 Aho–Corasick 自动机)，缺失时使用等价的正则多模式匹配
+try:
+    import ahocorasick
+    HAS_AHOCORASICK = True
+except ImportError:
+    HAS_AHOCORASICK = False
+
+# ================= PageIndex 关键词倒排索引 =================
+# JSON 原文硬查询的语义是「关键词 (小写) 是节点正文 (小写) 的子串」。
+# 为避免每次查询 json.load 整个文件并逐节点做子串扫描，预先构建倒排索引并持久化到 JSON 同目录:
+#   <json_path>.kwidx  (SQLite)
+#     meta      索引版本 / JSON 内容 SHA256 / mtime / size
+#     nodes     节点按遍历顺序编号 idx，保存 node_id、标题、路径、正文、长度与正文内容指纹 / SimHash (RRF 去重用)
+#     postings  (kind, term) -> 升序 int32 节点编号 (+ 词频)
+#               kind=0: 正文 jieba 分词 (带词频)
+#               kind=1: 字符 bigram (CJK 连续段 / 小写字母数字连续段内)
+#               kind=2: 单字符
+#               kind=3 / 4: 标题 / 摘要 jieba 分词 (带词频)，与正文一起用于 BM25F 打分
+# 查询时: 关键词的全部 n-gram 倒排表求交得到候选 -> 仅对候选做子串校验，结果与线性扫描完全一致；
+# 关键词本身是 jieba 词条时，其倒排表中的节点直接判定命中，无需校验。
+# 失效策略: JSON 的 mtime/size 变化时重新计算内容哈希，哈希不同才重建。
+
+KEYWORD_INDEX_VERSION = 4
+KEYWORD_INDEX_SUFFIX = ".kwidx"
+DEFAULT_NODE_TITLE = "未命名章节"
+
+TERM_TOKEN = 0
+TERM_BIGRAM = 1
+TERM_UNIGRAM = 2
+TERM_TITLE_TOKEN = 3
+TERM_SUMMARY_TOKEN = 4
+
+# ================= BM25F 参数 =================
+# 字段: (词条类型, nodes 表长度列, meta 平均长度键, 字段权重, 长度归一化 b)
+BM25_K1 = 1.2
+BM25F_FIELDS = (
+    ("title", TERM_TITLE_TOKEN, "title_tok_len", "avg_title_tokens", 3.0, 0.5),
+    ("summary", TERM_SUMMARY_TOKEN, "summary_tok_len", "avg_summary_tokens", 1.5, 0.75),
+    ("text", TERM_TOKEN, "token_len", "avg_text_tokens", 1.0, 0.75),
+)
+
+_SQL_BATCH = 500
+_HASH_CHUNK = 1 << 20
+_GRAM_RUN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+|[a-z0-9]+")
+_TOKEN_RE = re.compile(r"\w")
+
+_BUILD_LOCKS = defaultdict(threading.Lock)
+_BUILD_LOCKS_GUARD = threading.Lock()
+
+
+def _noop_log(msg):
+    pass
+
+
+def get_index_path(json_path):
+    return os.path.abspath(json_path) + KEYWORD_INDEX_SUFFIX
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _to_sqlite_int(value):
+    """uint64 -> SQLite INTEGER (有符号 64 位)"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def text_grams(text_lower):
+    """小写文本 -> (bigram 集合, 单字符集合)，只在 CJK / 字母数字连续段内部取 n-gram"""
+    bigrams = set()
+    unigrams = set()
+    for run in _GRAM_RUN_RE.findall(text_lower):
+        unigrams.update(run)
+        bigrams.update(run[i:i + 2] for i in range(len(run) - 1))
+    return bigrams, unigrams
+
+
+def keyword_grams(keyword_lower):
+    """关键词需要满足的 n-gram 条件: 长度 >= 2 的连续段取 bigram，长度为 1 的段取单字符"""
+    grams = []
+    for run in _GRAM_RUN_RE.findall(keyword_lower):
+        if len(run) == 1:
+            grams.append((TERM_UNIGRAM, run))
+        else:
+            grams.extend((TERM_BIGRAM, run[i:i + 2]) for i in range(len(run) - 1))
+    return list(dict.fromkeys(grams))
+
+
+def tokenize(text_lower):
+    """jieba 精确模式分词，丢弃纯空白/标点"""
+    return [t for t in jieba.lcut(text_lower) if _TOKEN_RE.search(t)]
+
+
+# ================= 多模式关键词匹配 =================
+# 一组关键词编译一次，对每段文本单次扫描得到全部 (可重叠) 命中位置，用于命中计数与片段高亮。
+# 匹配语义与 `kw.lower() in text.lower()` 一致，位置为小写文本中的 [start, end)。
+
+class KeywordMatcher:
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        # 同一 (小写) 模式可能对应多个关键词条目，命中计数按条目计
+        self._pattern_slots = defaultdict(list)
+        self._always_hit = []
+        for slot, kw in enumerate(self.keywords):
+            pattern = (kw or "").lower()
+            if pattern:
+                self._pattern_slots[pattern].append(slot)
+            else:
+                self._always_hit.append(slot)
+        self.patterns = list(self._pattern_slots)
+
+        self._automaton = None
+        self._regex = None
+        if not self.patterns:
+            return
+        if HAS_AHOCORASICK:
+            self._automaton = ahocorasick.Automaton()
+            for pattern in self.patterns:
+                self._automaton.add_word(pattern, pattern)
+            self._automaton.make_automaton()
+        else:
+            # 零宽前瞻使每个起点都尝试匹配 (可重叠)，长模式优先得到该起点的最长命中；
+            # 同一起点的较短命中必为最长命中的前缀，由 _prefixes 补齐
+            ordered = sorted(self.patterns, key=len, reverse=True)
+            self._regex = re.compile("(?=(" + "|".join(re.escape(p) for p in ordered) + "))")
+            self._prefixes = {
+                p: [q for q in ordered if len(q) < len(p) and p.startswith(q)] for p in ordered
+            }
+
+    def iter_matches(self, text_lower):
+        """产出 (start, end, pattern)，按结束位置 (自动机) 或起点 (正则) 顺序"""
+        if self._automaton is not None:
+            for end, pattern in self._automaton.iter(text_lower):
+                yield end - len(pattern) + 1, end + 1, pattern
+        elif self._regex is not None:
+            for m in self._regex.finditer(text_lower):
+                start = m.start()
+                longest = m.group(1)
+                yield start, start + len(longest), longest
+                for prefix in self._prefixes[longest]:
+                    yield start, start + len(prefix), prefix
+
+    def count_hits(self, text):
+        """命中的关键词条目数 (所有模式均已命中时提前结束扫描)"""
+        hit_patterns = set()
+        for _, _, pattern in self.iter_matches((text or "").lower()):
+            hit_patterns.add(pattern)
+            if len(hit_patterns) == len(self.patterns):
+                break
+        return len(self._always_hit) + sum(len(self._pattern_slots[p]) for p in hit_patterns)
+
+    def find(self, text):
+        """返回 (命中的关键词条目数, [(start, end, keyword)] 按起点排序)"""
+        spans = []
+        hit_patterns = set()
+        for start, end, pattern in self.iter_matches((text or "").lower()):
+            hit_patterns.add(pattern)
+            spans.append((start, end, self.keywords[self._pattern_slots[pattern][0]]))
+        spans.sort()
+        hit_count = len(self._always_hit) + sum(len(self._pattern_slots[p]) for p in hit_patterns)
+        return hit_count, spans
+
+
+def build_keyword_index(json_path, index_path=None, json_sha=None, log=None):
+    """从 PageIndex JSON 构建倒排索引 (写临时文件后原子替换)"""
+    log = log or _noop_log
+    index_path = index_path or get_index_path(json_path)
+    start = time.time()
+    stat = os.stat(json_path)
+    json_sha = json_sha or file_sha256(json_path)
+
+    node_rows = []
+    token_postings = defaultdict(list)   # (kind, term) -> [(idx, tf)]
+    gram_postings = defaultdict(list)    # (kind, term) -> [idx]
+
+    def add_tokens(kind, idx, field_text):
+        tokens = tokenize(field_text.lower())
+        tf = defaultdict(int)
+        for t in tokens:
+            tf[t] += 1
+        for t, count in tf.items():
+            token_postings[(kind, t)].append((idx, count))
+        return len(tokens)
+
+    # 新鲜的 sidecar 按前序直接读取；否则流式解析 JSON，边读边分词 (节点按对象闭合顺序到达，idx 为前序编号)
+    sidecar = open_sidecar(json_path)
+    nodes = sidecar.iter_nodes() if sidecar is not None else PageIndexJsonStream(json_path)
+    try:
+        for item in nodes:
+            idx, node = item.idx, item.node
+            title = node.get("title", DEFAULT_NODE_TITLE)
+            path = [DEFAULT_NODE_TITLE if t is None else t for t in item.path]
+            text = node.get("text") or ""
+            summary = node.get("summary") or ""
+            token_len = add_tokens(TERM_TOKEN, idx, text)
+            title_tok_len = add_tokens(TERM_TITLE_TOKEN, idx, str(title or ""))
+            summary_tok_len = add_tokens(TERM_SUMMARY_TOKEN, idx, summary)
+            bigrams, unigrams = text_grams(text.lower())
+            for g in bigrams:
+                gram_postings[(TERM_BIGRAM, g)].append(idx)
+            for g in unigrams:
+                gram_postings[(TERM_UNIGRAM, g)].append(idx)
+            node_rows.append((
+                idx, str(node.get("node_id", "unknown")), title, " > ".join(str(p) for p in path),
+                text, summary, len(text), token_len, title_tok_len, summary_tok_len,
+                _to_sqlite_int(content_fingerprint(text)), _to_sqlite_int(content_simhash(text))
+            ))
+    finally:
+        if sidecar is not None:
+            sidecar.close()
+
+    # 倒排列表按 idx 升序存储 (查询时 searchsorted 依赖有序)
+    for plist in token_postings.values():
+        plist.sort()
+    for docs in gram_postings.values():
+        docs.sort()
+
+    tmp_path = index_path + f".tmp{os.getpid()}_{threading.get_ident()}"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE nodes (idx INTEGER PRIMARY KEY, node_id TEXT, title TEXT, path TEXT,
+                                text TEXT, summary TEXT, text_len INTEGER, token_len INTEGER,
+                                title_tok_len INTEGER, summary_tok_len INTEGER, fingerprint INTEGER,
+                                simhash INTEGER);
+            CREATE TABLE postings (kind INTEGER, term TEXT, df INTEGER, docs BLOB, tfs BLOB,
+                                   PRIMARY KEY (kind, term)) WITHOUT ROWID;
+        """)
+        conn.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", node_rows)
+        conn.executemany(
+            "INSERT INTO postings VALUES (?, ?, ?, ?, ?)",
+            ((kind, term, len(plist),
+              np.fromiter((p[0] for p in plist), dtype="<i4", count=len(plist)).tobytes(),
+              np.fromiter((p[1] for p in plist), dtype="<i4", count=len(plist)).tobytes())
+             for (kind, term), plist in token_postings.items())
+        )
+        conn.executemany(
+            "INSERT INTO postings VALUES (?, ?, ?, ?, NULL)",
+            ((kind, term, len(docs), np.asarray(docs, dtype="<i4").tobytes())
+             for (kind, term), docs in gram_postings.items())
+        )
+        meta = {
+            "version": KEYWORD_INDEX_VERSION,
+            "json_sha256": json_sha,
+            "json_mtime": stat.st_mtime,
+            "json_size": stat.st_size,
+            "node_count": len(node_rows),
+        }
+        # BM25F 长度归一化所需的各字段平均词数
+        node_count = max(len(node_rows), 1)
+        meta["avg_text_tokens"] = sum(r[7] for r in node_rows) / node_count
+        meta["avg_title_tokens"] = sum(r[8] for r in node_rows) / node_count
+        meta["avg_summary_tokens"] = sum(r[9] for r in node_rows) / node_count
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", [(k, str(v)) for k, v in meta.items()])
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, index_path)
+    log(f"🗂️ 关键词倒排索引构建完成: {len(node_rows)} 个节点, "
+        f"{len(token_postings)} 个词条, {len(gram_postings)} 个 n-gram ({time.time() - start:.2f}s)")
+    return index_path
+
+
+def _read_meta(index_path):
+    try:
+        conn = sqlite3.connect(index_path)
+        try:
+            return dict(conn.execute("SELECT key, value FROM meta").fetchall())
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+
+def _touch_meta(index_path, stat):
+    """内容未变但 mtime/size 变化 (如文件被复制) 时只更新记录的文件状态"""
+    try:
+        conn = sqlite3.connect(index_path)
+        try:
+            conn.executemany("UPDATE meta SET value = ? WHERE key = ?",
+                             [(str(stat.st_mtime), "json_mtime"), (str(stat.st_size), "json_size")])
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        pass
+
+
+class KeywordIndex:
+    """倒排索引的查询接口 (只读使用)，每个查询线程单独打开一个实例"""
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._conn = sqlite3.connect(index_path)
+        self.meta = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        self.node_count = int(self.meta.get("node_count", 0))
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def postings(self, kind, term):
+        """返回升序节点编号数组 (int32)，词条不存在时返回空数组"""
+        row = self._conn.execute(
+            "SELECT docs FROM postings WHERE kind = ? AND term = ?", (kind, term)
+        ).fetchone()
+        if row is None:
+            return np.empty(0, dtype=np.int32)
+        return np.frombuffer(row[0], dtype="<i4")
+
+    def _fetch_texts(self, idxs, cache):
+        pending = [int(i) for i in idxs if int(i) not in cache]
+        for start in range(0, len(pending), _SQL_BATCH):
+            chunk = pending[start:start + _SQL_BATCH]
+            placeholders = ",".join("?" * len(chunk))
+            for idx, text in self._conn.execute(
+                f"SELECT idx, text FROM nodes WHERE idx IN ({placeholders})", chunk
+            ):
+                cache[idx] = (text or "").lower()
+        return cache
+
+    def match_keyword(self, keyword, text_cache=None):
+        """返回正文 (小写) 包含该关键词 (小写) 的全部节点编号 (升序 int32)"""
+        kw = keyword.lower()
+        text_cache = {} if text_cache is None else text_cache
+        sure = self.postings(TERM_TOKEN, kw)
+
+        candidates = None
+        for kind, gram in sorted(keyword_grams(kw), key=lambda g: g[0]):
+            plist = self.postings(kind, gram)
+            candidates = plist if candidates is None else np.intersect1d(candidates, plist, assume_unique=True)
+            if candidates.size == 0:
+                return sure
+        if candidates is None:
+            # 关键词中没有可索引字符 (如纯标点)，退化为全量校验
+            candidates = np.arange(self.node_count, dtype=np.int32)
+
+        to_verify = np.setdiff1d(candidates, sure, assume_unique=True)
+        self._fetch_texts(to_verify, text_cache)
+        verified = np.fromiter((i for i in to_verify if kw in text_cache.get(int(i), "")), dtype=np.int32)
+        return np.union1d(sure, verified).astype(np.int32)
+
+    def match_keywords(self, keywords, should_stop=None):
+        """{keyword: 命中节点编号数组}，共享候选正文缓存"""
+        keyword_hits = {}
+        text_cache = {}
+        for kw in keywords:
+            if should_stop and should_stop():
+                break
+            keyword_hits[kw] = self.match_keyword(kw, text_cache)
+        return keyword_hits
+
+    def search(self, keywords, should_stop=None):
+        """统计每个节点命中的关键词个数，返回 {idx: hit_count}"""
+        hit_counts = defaultdict(int)
+        for hits in self.match_keywords(keywords, should_stop).values():
+            for idx in hits.tolist():
+                hit_counts[idx] += 1
+        return dict(hit_counts)
+
+    def token_tfs(self, kind, term, idxs):
+        """词条在给定节点 (升序数组) 上的词频，不出现为 0"""
+        row = self._conn.execute(
+            "SELECT docs, tfs FROM postings WHERE kind = ? AND term = ?", (kind, term)
+        ).fetchone()
+        if row is None:
+            return np.zeros(len(idxs), dtype=np.float64)
+        docs = np.frombuffer(row[0], dtype="<i4")
+        tfs = np.frombuffer(row[1], dtype="<i4")
+        pos = np.minimum(np.searchsorted(docs, idxs), len(docs) - 1)
+        return np.where(docs[pos] == idxs, tfs[pos], 0).astype(np.float64)
+
+    def field_lengths(self, idxs):
+        """{字段列名: 与 idxs 对齐的词数数组}"""
+        columns = [field[2] for field in BM25F_FIELDS]
+        rows = {}
+        idx_list = [int(i) for i in idxs]
+        for start in range(0, len(idx_list), _SQL_BATCH):
+            chunk = idx_list[start:start + _SQL_BATCH]
+            placeholders = ",".join("?" * len(chunk))
+            for row in self._conn.execute(
+                f"SELECT idx, {', '.join(columns)} FROM nodes WHERE idx IN ({placeholders})", chunk
+            ):
+                rows[row[0]] = row[1:]
+        return {col: np.array([rows.get(i, (0,) * len(columns))[c] or 0 for i in idx_list], dtype=np.float64)
+                for c, col in enumerate(columns)}
+
+    def bm25f_scores(self, keyword_hits, idxs):
+        """
+        BM25F: 每个关键词视为一个查询项，字段内伪词频
+            tf~ = Σ_f w_f · tf_f / (1 - b_f + b_f · len_f / avglen_f)
+            score = Σ_k idf(k) · tf~ (k1 + 1) / (k1 + tf~)
+        关键词分词后含多个词条时，字段词频取各词条词频的最小值 (近似短语频次)；
+        正文命中 (子串) 但分词未对齐时，正文词频至少按 1 计。
+        df(k) 取正文命中节点数，idf = ln(1 + (N - df + 0.5) / (df + 0.5))。
+        返回与 idxs 对齐的分数数组。
+        """
+        idxs = np.asarray(sorted(int(i) for i in idxs), dtype=np.int32)
+        scores = np.zeros(len(idxs), dtype=np.float64)
+        if not len(idxs):
+            return idxs, scores
+
+        lengths = self.field_lengths(idxs)
+        norms = {}
+        for name, kind, len_col, avg_key, weight, b in BM25F_FIELDS:
+            avg_len = float(self.meta.get(avg_key, 0) or 0) or 1.0
+            norms[name] = weight / (1.0 - b + b * lengths[len_col] / avg_len)
+
+        n_docs = max(self.node_count, 1)
+        for kw, hits in keyword_hits.items():
+            df = len(hits)
+            if not df:
+                continue
+            idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            in_text = np.isin(idxs, hits, assume_unique=True)
+            terms = list(dict.fromkeys(tokenize(kw.lower()))) or [kw.lower()]
+            pseudo_tf = np.zeros(len(idxs), dtype=np.float64)
+            for name, kind, len_col, avg_key, weight, b in BM25F_FIELDS:
+                field_tf = np.min([self.token_tfs(kind, t, idxs) for t in terms], axis=0)
+                if kind == TERM_TOKEN:
+                    field_tf = np.where(in_text, np.maximum(field_tf, 1.0), 0.0)
+                pseudo_tf += field_tf * norms[name]
+            scores += idf * pseudo_tf * (BM25_K1 + 1.0) / (BM25_K1 + pseudo_tf)
+        return idxs, scores
+
+    def node_lengths(self, idxs):
+        """{idx: 正文字符数}"""
+        result = {}
+        idxs = [int(i) for i in idxs]
+        for start in range(0, len(idxs), _SQL_BATCH):
+            chunk = idxs[start:start + _SQL_BATCH]
+            placeholders = ",".join("?" * len(chunk))
+            result.update(self._conn.execute(
+                f"SELECT idx, text_len FROM nodes WHERE idx IN ({placeholders})", chunk
+            ).fetchall())
+        return result
+
+    def get_nodes(self, idxs):
+        """{idx: {node_id, title, path, text, summary, fingerprint, simhash}}"""
+        result = {}
+        idxs = [int(i) for i in idxs]
+        for start in range(0, len(idxs), _SQL_BATCH):
+            chunk = idxs[start:start + _SQL_BATCH]
+            placeholders = ",".join("?" * len(chunk))
+            for idx, node_id, title, path, text, summary, fingerprint, simhash in self._conn.execute(
+                f"SELECT idx, node_id, title, path, text, summary, fingerprint, simhash FROM nodes "
+                f"WHERE idx IN ({placeholders})", chunk
+            ):
+                result[idx] = {"node_id": node_id, "title": title, "path": path, "text": text, "summary": summary,
+                               "fingerprint": fingerprint & 0xFFFFFFFFFFFFFFFF,
+                               "simhash": simhash & 0xFFFFFFFFFFFFFFFF}
+        return result
+
+
+def _refresh_index(json_path, index_path, log, build=True):
+    """
+    检查索引是否与 JSON 内容一致 (调用方持有构建锁)。
+    需要重建时: build=True 就地构建并返回 True，build=False 返回 False。
+    """
+    stat = os.stat(json_path)
+    meta = _read_meta(index_path) if os.path.exists(index_path) else None
+    json_sha = None
+    if meta is None or meta.get("version") != str(KEYWORD_INDEX_VERSION):
+        reason = "🗂️ 正在构建关键词倒排索引 (首次使用)..."
+    elif meta.get("json_mtime") != str(stat.st_mtime) or meta.get("json_size") != str(stat.st_size):
+        json_sha = file_sha256(json_path)
+        if json_sha == meta.get("json_sha256"):
+            _touch_meta(index_path, stat)
+            return True
+        reason = "🗂️ JSON 内容已变化，重建关键词倒排索引..."
+    else:
+        return True
+
+    if not build:
+        return False
+    log(reason)
+    build_keyword_index(json_path, index_path, json_sha=json_sha, log=log)
+    return True
+
+
+def _build_in_background(json_path, log):
+    index = load_keyword_index(json_path, log=log, wait=True)
+    if index is not None:
+        index.close()
+
+
+def load_keyword_index(json_path, log=None, wait=True):
+    """
+    打开 JSON 对应的倒排索引，缺失或内容哈希不一致时 (重新) 构建。
+    wait=False 时不阻塞查询: 索引未就绪则转入后台线程构建并立即返回 None。
+    不可用时返回 None，调用方应回退到线性扫描。
+    """
+    log = log or _noop_log
+    json_path = os.path.abspath(json_path)
+    index_path = get_index_path(json_path)
+    with _BUILD_LOCKS_GUARD:
+        build_lock = _BUILD_LOCKS[index_path]
+
+    try:
+        if wait:
+            with build_lock:
+                _refresh_index(json_path, index_path, log, build=True)
+            return KeywordIndex(index_path)
+
+        # 其他线程正在构建，本次直接回退
+        if not build_lock.acquire(blocking=False):
+            return None
+        try:
+            ready = _refresh_index(json_path, index_path, log, build=False)
+        finally:
+            build_lock.release()
+        if not ready:
+            threading.Thread(target=_build_in_background, args=(json_path, log), daemon=True).start()
+            return None
+        return KeywordIndex(index_path)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        log(f"⚠️ 关键词倒排索引不可用，回退线性扫描: {str(e)}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PageIndex 关键词倒排索引工具")
+    parser.add_argument("json_path", help="PageIndex 结构 JSON 路径")
+    parser.add_argument("--force", action="store_true", help="忽略内容哈希，强制重建")
+    args = parser.parse_args()
+
+    if args.force:
+        build_keyword_index(args.json_path, log=print)
+    else:
+        index = load_keyword_index(args.json_path, log=print)
+        if index is None:
+            sys.exit(1)
+        print(f"索引可用: {get_index_path(args.json_path)} ({index.node_count} 个节点)")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
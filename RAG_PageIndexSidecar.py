@@ -0,0 +1,353 @@
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import argparse
+import threading
+
+import numpy as np
+
+from RAG_JsonStream import PageIndexJsonStream, StreamNode
+from RAG_Fusion import content_fingerprints, content_simhashes, format_node_content
+
+# ================= PageIndex 二进制旁路文件 (sidecar) =================
+# results/*.json 为 indent=2 的 UTF-8-BOM JSON，每个消费者都要完整解析一遍。
+# 这里在 JSON 同目录写一个紧凑的列式二进制文件 <json_path>.pidx，按节点偏移表随机访问:
+#
+#   header   magic(8) | version u32 | node_count u32 | meta_offset u64 | meta_len u64
+#   sections 8 字节对齐，按前序编号 idx 排列 (与 JSON 递归遍历顺序一致):
+#     parents / child_counts      int32[n]
+#     flags                       uint8[n]   bit i = STRING_COLUMNS[i] 在原节点中存在且为字符串
+#     <col>_offsets / <col>_buf   int64[n+1] + UTF-8 缓冲区 (node_id / title / text / summary)
+#     extra_offsets / extra_buf   其余字段 (start_index / end_index / ...) 的紧凑 JSON
+#     id_order                    int32[n]   按 (node_id, idx) 排序的 idx，用于二分查找 node_id
+#     text_fingerprints           uint64[n]  正文内容指纹 (RAG_Fusion.content_fingerprint)，RRF 去重直接使用
+#     text_simhashes              uint64[n]  正文 SimHash (RAG_Fusion.content_simhash)，近似重复折叠使用
+#     content_fingerprints / content_simhashes  同上，按 format_node_content(summary, text) 计算 (向量通道候选)
+#   meta     JSON: 各段位置、根对象字段 (doc_name 等)、生成时 JSON 的 mtime / size
+#
+# 新鲜度: sidecar 的 mtime 不早于 JSON 且记录的 JSON 大小一致时才使用，否则回退到流式解析 JSON。
+# 读取使用 mmap，单个节点只解码其所在的字节区间。Windows 下映射中的文件无法被替换，读取方应尽快 close()。
+
+SIDECAR_MAGIC = b"PGIDX\x00\x00\x00"
+SIDECAR_VERSION = 4
+SIDECAR_SUFFIX = ".pidx"
+STRING_COLUMNS = ("node_id", "title", "text", "summary")
+
+_HEADER = struct.Struct("<8sIIQQ")
+_ALIGN = 8
+_BUILD_LOCK = threading.Lock()
+
+
+def _noop_log(msg):
+    pass
+
+
+def get_sidecar_path(json_path):
+    return os.path.abspath(json_path) + SIDECAR_SUFFIX
+
+
+def sidecar_is_fresh(json_path, sidecar_path=None):
+    """sidecar 存在且不早于 JSON"""
+    sidecar_path = sidecar_path or get_sidecar_path(json_path)
+    try:
+        return os.path.getmtime(sidecar_path) >= os.path.getmtime(json_path)
+    except OSError:
+        return False
+
+
+# ---------- 写入 ----------
+def _pack_strings(values):
+    """字符串列表 -> (int64 偏移表, UTF-8 缓冲区)"""
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+    if encoded:
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, b"".join(encoded)
+
+
+def build_sidecar(json_path, sidecar_path=None, log=None):
+    """流式解析 JSON 并写出 sidecar (写临时文件后原子替换)，返回 sidecar 路径"""
+    log = log or _noop_log
+    sidecar_path = sidecar_path or get_sidecar_path(json_path)
+    start = time.time()
+    stat = os.stat(json_path)
+
+    columns = {name: [] for name in STRING_COLUMNS}
+    extras, flags, parents, child_counts = [], [], [], []
+    all_lists = list(columns.values()) + [extras, flags, parents, child_counts]
+
+    stream = PageIndexJsonStream(json_path)
+    for item in stream:
+        idx = item.idx
+        if idx >= len(parents):
+            grow = idx + 1 - len(parents)
+            for column in all_lists:
+                column.extend([None] * grow)
+        node = item.node
+        bits = 0
+        for bit, name in enumerate(STRING_COLUMNS):
+            value = node.get(name)
+            if isinstance(value, str):
+                bits |= 1 << bit
+                columns[name][idx] = value
+            else:
+                columns[name][idx] = ""
+        rest = {k: v for k, v in node.items()
+                if not (k in STRING_COLUMNS and isinstance(v, str))}
+        extras[idx] = json.dumps(rest, ensure_ascii=False, separators=(",", ":")) if rest else ""
+        flags[idx] = bits
+        parents[idx] = item.parent_idx
+        child_counts[idx] = item.child_count
+
+    node_count = len(parents)
+    sections = [
+        ("parents", np.asarray(parents, dtype="<i4").tobytes()),
+        ("child_counts", np.asarray(child_counts, dtype="<i4").tobytes()),
+        ("flags", np.asarray(flags, dtype="u1").tobytes()),
+    ]
+    for name in STRING_COLUMNS + ("extra",):
+        offsets, buf = _pack_strings(extras if name == "extra" else columns[name])
+        sections.append((f"{name}_offsets", offsets.tobytes()))
+        sections.append((f"{name}_buf", buf))
+    # 重复 node_id 时二分查找取同 id 中 idx 最大者，与 PageIndexLoader.id_to_idx 的「靠后为准」一致
+    id_keys = [s.encode("utf-8") for s in columns["node_id"]]
+    id_order = sorted(range(node_count), key=lambda i: (id_keys[i], i))
+    sections.append(("id_order", np.asarray(id_order, dtype="<i4").tobytes()))
+    sections.append(("text_fingerprints", content_fingerprints(columns["text"]).astype("<u8").tobytes()))
+    sections.append(("text_simhashes", content_simhashes(columns["text"]).astype("<u8").tobytes()))
+    contents = [format_node_content(s, t) for s, t in zip(columns["summary"], columns["text"])]
+    sections.append(("content_fingerprints", content_fingerprints(contents).astype("<u8").tobytes()))
+    sections.append(("content_simhashes", content_simhashes(contents).astype("<u8").tobytes()))
+
+    tmp_path = sidecar_path + f".tmp{os.getpid()}_{threading.get_ident()}"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(b"\x00" * _HEADER.size)
+            layout = {}
+            for name, payload in sections:
+                pad = -f.tell() % _ALIGN
+                if pad:
+                    f.write(b"\x00" * pad)
+                layout[name] = [f.tell(), len(payload)]
+                f.write(payload)
+            meta = json.dumps({
+                "sections": layout,
+                "root_fields": stream.root_fields,
+                "json_mtime": stat.st_mtime,
+                "json_size": stat.st_size,
+            }, ensure_ascii=False).encode("utf-8")
+            meta_offset = f.tell()
+            f.write(meta)
+            f.seek(0)
+            f.write(_HEADER.pack(SIDECAR_MAGIC, SIDECAR_VERSION, node_count, meta_offset, len(meta)))
+        with _BUILD_LOCK:
+            os.replace(tmp_path, sidecar_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    log(f"📦 PageIndex sidecar 已生成: {os.path.basename(sidecar_path)} "
+        f"({node_count} 个节点, {os.path.getsize(sidecar_path) / 1024:.0f} KB, {time.time() - start:.2f}s)")
+    return sidecar_path
+
+
+# ---------- 读取 ----------
+class PageIndexSidecar:
+    """mmap 只读访问 sidecar；按 idx 或 node_id 取单个节点时只解码对应区间"""
+
+    def __init__(self, sidecar_path):
+        self.path = sidecar_path
+        self._file = open(sidecar_path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, node_count, meta_offset, meta_len = _HEADER.unpack_from(self._mm, 0)
+            if magic != SIDECAR_MAGIC or version != SIDECAR_VERSION:
+                raise ValueError(f"sidecar 格式或版本不匹配: {sidecar_path}")
+            meta = json.loads(self._mm[meta_offset:meta_offset + meta_len].decode("utf-8"))
+        except Exception:
+            self.close()
+            raise
+        self.node_count = node_count
+        self.root_fields = meta.get("root_fields", {})
+        self.json_mtime = meta.get("json_mtime")
+        self.json_size = meta.get("json_size")
+        self._layout = meta["sections"]
+
+        self.parents = self._array("parents", "<i4")
+        self.child_counts = self._array("child_counts", "<i4")
+        self.flags = self._array("flags", "u1")
+        self._offsets = {name: self._array(f"{name}_offsets", "<i8") for name in STRING_COLUMNS + ("extra",)}
+        self._id_order = self._array("id_order", "<i4")
+        self.text_fingerprints = self._array("text_fingerprints", "<u8")
+        self.text_simhashes = self._array("text_simhashes", "<u8")
+        self.content_fingerprints = self._array("content_fingerprints", "<u8")
+        self.content_simhashes = self._array("content_simhashes", "<u8")
+
+    def _array(self, name, dtype):
+        offset, nbytes = self._layout[name]
+        return np.frombuffer(self._mm, dtype=dtype, count=nbytes // np.dtype(dtype).itemsize, offset=offset)
+
+    def __len__(self):
+        return self.node_count
+
+    def close(self):
+        # 先释放 numpy 视图，否则 mmap 仍被引用无法关闭
+        for attr in ("parents", "child_counts", "flags", "_offsets", "_id_order", "text_fingerprints",
+                     "text_simhashes", "content_fingerprints", "content_simhashes"):
+            self.__dict__.pop(attr, None)
+        mm = self.__dict__.pop("_mm", None)
+        if mm is not None:
+            mm.close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------- 列访问 ----------
+    def _raw(self, name, idx):
+        offsets = self._offsets[name]
+        base = self._layout[f"{name}_buf"][0]
+        return self._mm[base + int(offsets[idx]):base + int(offsets[idx + 1])]
+
+    def string(self, name, idx):
+        return self._raw(name, idx).decode("utf-8")
+
+    def has_field(self, idx, name):
+        return bool(self.flags[idx] >> STRING_COLUMNS.index(name) & 1)
+
+    def column_buffer(self, name):
+        """整列 UTF-8 缓冲区 (bytes 副本) 与偏移表 (ndarray 副本)，供 PageIndexLoader 一次性载入"""
+        offset, nbytes = self._layout[f"{name}_buf"]
+        return self._mm[offset:offset + nbytes], np.array(self._offsets[name])
+
+    def column_strings(self, name):
+        buf, offsets = self.column_buffer(name)
+        return [buf[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(self.node_count)]
+
+    def node_text(self, idx):
+        return self.string("text", idx)
+
+    def node_summary(self, idx):
+        return self.string("summary", idx)
+
+    def title(self, idx):
+        """原始标题，节点无字符串标题时为 None"""
+        return self.string("title", idx) if self.has_field(idx, "title") else self._extra(idx).get("title")
+
+    def _extra(self, idx):
+        raw = self._raw("extra", idx)
+        return json.loads(raw.decode("utf-8")) if raw else {}
+
+    def node_dict(self, idx):
+        """还原节点字典 (不含子节点列表)"""
+        node = {}
+        bits = int(self.flags[idx])
+        for bit, name in enumerate(STRING_COLUMNS):
+            if bits >> bit & 1:
+                node[name] = self.string(name, idx)
+        node.update(self._extra(idx))
+        return node
+
+    def get_path(self, idx):
+        """经父指针回溯出从根到该节点的原始标题列表"""
+        path = []
+        while idx >= 0:
+            path.append(self.title(idx))
+            idx = int(self.parents[idx])
+        path.reverse()
+        return path
+
+    def depth(self, idx):
+        depth = 0
+        while idx >= 0:
+            depth += 1
+            idx = int(self.parents[idx])
+        return depth
+
+    # ---------- node_id 查找 ----------
+    def find(self, node_id):
+        """二分查找 node_id，返回 idx (重复时取最靠后者)，不存在返回 -1"""
+        key = str(node_id).encode("utf-8")
+        lo, hi = 0, self.node_count
+        while lo < hi:   # 第一个 id > key 的位置
+            mid = (lo + hi) // 2
+            if self._raw("node_id", int(self._id_order[mid])) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return -1
+        idx = int(self._id_order[lo - 1])
+        return idx if self._raw("node_id", idx) == key else -1
+
+    def get_text(self, node_id):
+        idx = self.find(node_id)
+        return self.node_text(idx) if idx >= 0 else None
+
+    def iter_nodes(self):
+        """按前序产出与 PageIndexJsonStream 相同的 StreamNode"""
+        depths = []
+        for idx in range(self.node_count):
+            parent_idx = int(self.parents[idx])
+            depths.append(depths[parent_idx] + 1 if parent_idx >= 0 else 1)
+            yield StreamNode(self.node_dict(idx), self.get_path(idx), depths[idx],
+                             idx, parent_idx, int(self.child_counts[idx]))
+
+
+def open_sidecar(json_path, sidecar_path=None):
+    """JSON 对应的 sidecar 新鲜且可读时返回 PageIndexSidecar，否则返回 None"""
+    sidecar_path = sidecar_path or get_sidecar_path(json_path)
+    if not sidecar_is_fresh(json_path, sidecar_path):
+        return None
+    try:
+        sidecar = PageIndexSidecar(sidecar_path)
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+    if sidecar.json_size != os.path.getsize(json_path):
+        sidecar.close()
+        return None
+    return sidecar
+
+
+def ensure_sidecar(json_path, log=None):
+    """sidecar 缺失、过期或版本不符时重新生成；失败 (只读目录等) 返回 None，不影响调用方回退到 JSON"""
+    sidecar_path = get_sidecar_path(json_path)
+    sidecar = open_sidecar(json_path, sidecar_path)
+    if sidecar is not None:
+        sidecar.close()
+        return sidecar_path
+    try:
+        return build_sidecar(json_path, sidecar_path, log=log)
+    except (OSError, ValueError) as e:
+        (log or _noop_log)(f"⚠️ PageIndex sidecar 生成失败: {e}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PageIndex 二进制 sidecar 工具")
+    parser.add_argument("json_paths", nargs="+", help="PageIndex 结构 JSON 路径")
+    parser.add_argument("--force", action="store_true", help="忽略新鲜度检查，强制重建")
+    args = parser.parse_args()
+
+    failed = False
+    for json_path in args.json_paths:
+        if args.force:
+            build_sidecar(json_path, log=print)
+        elif ensure_sidecar(json_path, log=print) is None:
+            failed = True
+        else:
+            print(f"sidecar 可用: {get_sidecar_path(json_path)}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
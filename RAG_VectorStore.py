@@ -0,0 +1,988 @@
+import os
+import sys
+import json
+import time
+import shutil
+import struct
+import sqlite3
+import argparse
+import functools
+import threading
+import numpy as np
+
+# ================= 向量矩阵缓存 (Vector Matrix Cache) =================
+# vectors 表中的 embedding 预先解码为 L2 归一化的 float32 矩阵并持久化到 .db 同目录，
+# 查询时以 mmap 方式加载，Top-K 打分 = 一次矩阵-向量乘法 + argpartition。
+#
+# 缓存目录结构: <db_path>.vcache/
+#   matrix_<指纹>.npy  (N, dim) float32, 已归一化 (按 DB 指纹命名)
+#   ids.npy       (N,)     int64, vectors.id
+#   sections.npy  (N,)     unicode, vectors.section_id
+#   meta.json     DB 指纹 (mtime + 行数)，最后写入，存在即表示缓存完整
+
+VECTOR_CACHE_VERSION = 2
+VECTOR_CACHE_DIR_SUFFIX = ".vcache"
+_FETCH_BATCH = 2000
+
+_MATRIX_REGISTRY = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def _noop_log(msg):
+    pass
+
+
+def get_cache_dir(db_path):
+    return os.path.abspath(db_path) + VECTOR_CACHE_DIR_SUFFIX
+
+
+def get_db_fingerprint(db_path):
+    """DB 指纹：文件 mtime + vectors 表行数，任一变化即视为缓存失效"""
+    conn = sqlite3.connect(db_path)
+    try:
+        row_count = conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+    finally:
+        conn.close()
+    return {"db_mtime": os.path.getmtime(db_path), "db_rows": int(row_count)}
+
+
+# ================= Embedding 存储格式 =================
+# Schema v1: vectors.embedding 为 JSON 文本 "[0.01, -0.2, ...]"
+# Schema v2: vectors.embedding 为 BLOB = 12 字节头 + 小端序浮点数组
+#   头部 struct "<4sBxxxI": magic b"EMB2" | dtype 代码 | 3 字节保留 | dim (uint32)
+# 读取端自动识别两种格式，BLOB 通过 np.frombuffer 零拷贝解码。
+# 版本号记录在 PRAGMA user_version 中。
+
+EMBEDDING_SCHEMA_BLOB = 2
+EMBEDDING_BLOB_MAGIC = b"EMB2"
+_BLOB_HEADER = struct.Struct("<4sBxxxI")
+_BLOB_DTYPES = {1: np.dtype("<f4"), 2: np.dtype("<f2")}
+_BLOB_DTYPE_CODES = {"float32": 1, "float16": 2}
+
+
+def encode_embedding(vec, dtype="float32"):
+    """将向量编码为 v2 BLOB (float32 或 float16)"""
+    if dtype not in _BLOB_DTYPE_CODES:
+        raise ValueError(f"不支持的 embedding dtype: {dtype}")
+    code = _BLOB_DTYPE_CODES[dtype]
+    arr = np.asarray(vec, dtype=_BLOB_DTYPES[code]).ravel()
+    return _BLOB_HEADER.pack(EMBEDDING_BLOB_MAGIC, code, arr.shape[0]) + arr.tobytes()
+
+
+def decode_embedding(value):
+    """
+    将 vectors.embedding 列的取值解码为向量，无法解析时返回 None。
+    BLOB (v2) 返回指向原缓冲区的只读视图 (float32/float16)，JSON 文本 (v1) 返回 float32 数组。
+    """
+    try:
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            magic, code, dim = _BLOB_HEADER.unpack_from(value, 0)
+            if magic != EMBEDDING_BLOB_MAGIC or code not in _BLOB_DTYPES:
+                return None
+            return np.frombuffer(value, dtype=_BLOB_DTYPES[code], count=dim, offset=_BLOB_HEADER.size)
+        return np.asarray(json.loads(value), dtype=np.float32)
+    except Exception:
+        return None
+
+
+def get_schema_version(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def migrate_embeddings_to_blob(db_path, dtype="float32", backup=True, vacuum=True, log=None):
+    """
+    一次性迁移：将 vectors.embedding 由 JSON 文本原地转换为 v2 BLOB。
+    已是 BLOB 的行保持不变，无法解析的行保留原值并计数。
+    返回 (converted, skipped)。
+    """
+    log = log or _noop_log
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(db_path)
+
+    if backup:
+        backup_path = db_path + ".bak"
+        shutil.copy2(db_path, backup_path)
+        log(f"📦 已备份原数据库: {backup_path}")
+
+    converted = 0
+    skipped = 0
+    last_rowid = -1
+    conn = sqlite3.connect(db_path)
+    try:
+        while True:
+            rows = conn.execute(
+                "SELECT rowid, embedding FROM vectors WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, _FETCH_BATCH)
+            ).fetchall()
+            if not rows:
+                break
+            last_rowid = rows[-1][0]
+
+            updates = []
+            for rowid, value in rows:
+                if isinstance(value, bytes):
+                    continue
+                vec = decode_embedding(value)
+                if vec is None or vec.ndim != 1 or vec.size == 0:
+                    skipped += 1
+                    continue
+                updates.append((encode_embedding(vec, dtype), rowid))
+
+            if updates:
+                conn.executemany("UPDATE vectors SET embedding = ? WHERE rowid = ?", updates)
+                conn.commit()
+                converted += len(updates)
+                log(f"   已转换 {converted} 条...")
+
+        conn.execute(f"PRAGMA user_version = {EMBEDDING_SCHEMA_BLOB}")
+        conn.commit()
+        if vacuum:
+            log("🧹 正在 VACUUM 回收空间...")
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+    log(f"✅ 迁移完成: 转换 {converted} 条, 跳过 {skipped} 条 (dtype={dtype})")
+    return converted, skipped
+
+
+class VectorMatrix:
+    """只读的预归一化向量矩阵，支持暴力余弦 Top-K 检索"""
+
+    def __init__(self, matrix, ids, section_ids, meta):
+        self.matrix = matrix
+        self.ids = ids
+        self.section_ids = section_ids
+        self.meta = meta
+
+    def __len__(self):
+        return int(self.matrix.shape[0])
+
+    @property
+    def dim(self):
+        return int(self.matrix.shape[1]) if self.matrix.ndim == 2 else 0
+
+    def score_all(self, query_vec):
+        """返回 query 与全部向量的余弦相似度；维度不符或零向量返回 None"""
+        if len(self) == 0:
+            return None
+        q = normalize_query(query_vec, self.dim)
+        if q is None:
+            return None
+        return self.matrix @ q
+
+    def search(self, query_vec, top_k=40):
+        """返回 [(vector_id, score, section_id), ...]，按分数降序"""
+        scores = self.score_all(query_vec)
+        if scores is None:
+            return []
+        return self._top_k_from_scores(scores, top_k)
+
+    def _top_k_from_scores(self, scores, top_k, rows=None):
+        """scores[i] 对应矩阵第 rows[i] 行 (rows 为 None 时即第 i 行)"""
+        idx = top_k_indices(scores, top_k)
+        if rows is None:
+            rows = idx
+        else:
+            rows = rows[idx]
+        return [(int(self.ids[r]), float(scores[i]), str(self.section_ids[r])) for i, r in zip(idx, rows)]
+
+
+def top_k_indices(scores, top_k):
+    """argpartition 取 Top-K 下标，并按分数降序排列"""
+    total = len(scores)
+    k = min(top_k, total)
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < total:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(total)
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+def normalize_query(query_vec, dim):
+    """query 向量转 float32 并归一化；维度不符或零向量返回 None"""
+    q = np.asarray(query_vec, dtype=np.float32).ravel()
+    if q.shape[0] != dim:
+        return None
+    norm = np.linalg.norm(q)
+    if norm == 0:
+        return None
+    return q / norm
+
+
+def _cache_token(fingerprint):
+    """由 DB 指纹生成文件名后缀；mmap 文件按版本命名，重建时无需覆盖正被映射的旧文件"""
+    return f"{int(fingerprint['db_mtime'] * 1000)}_{fingerprint['db_rows']}"
+
+
+def _cleanup_stale_files(cache_dir, prefix, keep_name):
+    """尽力删除旧版本文件 (仍被其他线程映射时删除失败，下次再清理)"""
+    try:
+        names = os.listdir(cache_dir)
+    except OSError:
+        return
+    for name in names:
+        if name.startswith(prefix) and name != keep_name:
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                pass
+
+
+def build_vector_matrix(db_path, fingerprint=None, log=None):
+    """
+    全量扫描 vectors 表，解码并归一化后写入缓存目录。
+    矩阵直接流式写入磁盘 memmap，构建过程不需要把全部向量放进内存。
+    返回 VectorMatrix (mmap 加载)；缓存目录不可写时退化为内存矩阵。
+    """
+    log = log or _noop_log
+    fingerprint = fingerprint or get_db_fingerprint(db_path)
+    capacity = fingerprint["db_rows"]
+    cache_dir = get_cache_dir(db_path)
+    matrix_name = f"matrix_{_cache_token(fingerprint)}.npy"
+
+    persist = True
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # 先移除旧 meta，保证中途失败时不会留下"看似完整"的缓存
+        meta_path = os.path.join(cache_dir, "meta.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+    except OSError as e:
+        log(f"⚠️ 向量矩阵缓存目录不可写 ({e})，本次使用内存矩阵")
+        persist = False
+
+    def allocate(dim):
+        nonlocal persist
+        if persist:
+            try:
+                return np.lib.format.open_memmap(
+                    os.path.join(cache_dir, matrix_name), mode="w+",
+                    dtype=np.float32, shape=(capacity, dim)
+                )
+            except OSError as e:
+                log(f"⚠️ 向量矩阵缓存写入失败 ({e})，本次使用内存矩阵")
+                persist = False
+        return np.zeros((capacity, dim), dtype=np.float32)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, embedding, section_id FROM vectors")
+
+        matrix = None
+        ids = np.zeros(capacity, dtype=np.int64)
+        sections = []
+        dim = 0
+        n = 0
+        skipped = 0
+
+        while n < capacity:
+            rows = cursor.fetchmany(_FETCH_BATCH)
+            if not rows:
+                break
+            for v_id, emb_value, sec_id in rows:
+                if n >= capacity:
+                    break
+                vec = decode_embedding(emb_value)
+                if vec is None or vec.ndim != 1 or vec.size == 0:
+                    skipped += 1
+                    continue
+                if matrix is None:
+                    dim = int(vec.shape[0])
+                    matrix = allocate(dim)
+                if vec.shape[0] != dim:
+                    skipped += 1
+                    continue
+                norm = np.linalg.norm(vec)
+                if norm > 0:
+                    vec = vec / norm
+                matrix[n] = vec
+                ids[n] = v_id
+                sections.append(str(sec_id))
+                n += 1
+    finally:
+        conn.close()
+
+    ids = ids[:n]
+    section_arr = np.array(sections, dtype=np.str_) if sections else np.zeros(0, dtype="<U1")
+
+    meta = dict(fingerprint)
+    meta.update({"version": VECTOR_CACHE_VERSION, "count": n, "dim": dim})
+    if skipped:
+        log(f"⚠️ 向量矩阵构建: 跳过 {skipped} 条无法解析或维度不一致的记录")
+
+    if matrix is None:
+        return VectorMatrix(np.zeros((0, 0), dtype=np.float32), ids, section_arr, meta)
+    if not persist:
+        return VectorMatrix(matrix[:n], ids, section_arr, meta)
+
+    # 矩阵文件按 capacity 行分配，无效记录被跳过时尾部留空，加载时按 count 截取
+    matrix.flush()
+    del matrix
+    meta["matrix_file"] = matrix_name
+    try:
+        _save_cache(cache_dir, ids, section_arr, meta)
+        _cleanup_stale_files(cache_dir, "matrix_", matrix_name)
+        log(f"💾 向量矩阵缓存已写入: {os.path.basename(cache_dir)} ({n} x {dim})")
+    except OSError as e:
+        log(f"⚠️ 向量矩阵缓存元数据写入失败 ({e})，本次直接使用已写入的矩阵文件")
+    return _load_cache(cache_dir, meta)
+
+
+def _save_cache(cache_dir, ids, section_arr, meta):
+    for name, arr in (("ids", ids), ("sections", section_arr)):
+        tmp_path = os.path.join(cache_dir, f"{name}.tmp.npy")
+        np.save(tmp_path, arr, allow_pickle=False)
+        os.replace(tmp_path, os.path.join(cache_dir, f"{name}.npy"))
+    _write_json_atomic(os.path.join(cache_dir, "meta.json"), meta)
+
+
+def _write_json_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_cache_meta(cache_dir):
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def _load_cache(cache_dir, meta):
+    count = meta["count"]
+    matrix = np.load(os.path.join(cache_dir, meta["matrix_file"]), mmap_mode="r", allow_pickle=False)
+    ids = np.load(os.path.join(cache_dir, "ids.npy"), allow_pickle=False)
+    sections = np.load(os.path.join(cache_dir, "sections.npy"), allow_pickle=False)
+    return VectorMatrix(matrix[:count], ids[:count], sections[:count], meta)
+
+
+def _is_cache_valid(meta, fingerprint):
+    if not meta or meta.get("version") != VECTOR_CACHE_VERSION:
+        return False
+    return (meta.get("db_mtime") == fingerprint["db_mtime"]
+            and meta.get("db_rows") == fingerprint["db_rows"])
+
+
+def load_vector_matrix(db_path, log=None):
+    """
+    获取 db_path 对应的向量矩阵。
+    优先复用进程内已加载实例 -> 其次 mmap 加载磁盘缓存 -> 最后全量重建。
+    """
+    log = log or _noop_log
+    key = os.path.abspath(db_path)
+    fingerprint = get_db_fingerprint(db_path)
+
+    with _REGISTRY_LOCK:
+        cached = _MATRIX_REGISTRY.get(key)
+        if cached is not None and _is_cache_valid(cached.meta, fingerprint):
+            return cached
+
+        cache_dir = get_cache_dir(db_path)
+        meta = _read_cache_meta(cache_dir)
+        vm = None
+        if _is_cache_valid(meta, fingerprint):
+            try:
+                vm = _load_cache(cache_dir, meta)
+                log(f"⚡ 已加载向量矩阵缓存 (mmap): {len(vm)} 条, dim={vm.dim}")
+            except Exception as e:
+                log(f"⚠️ 向量矩阵缓存损坏 ({e})，重新构建...")
+                vm = None
+
+        if vm is None:
+            # 释放旧实例的 mmap 句柄，以便清理旧版本矩阵文件
+            _MATRIX_REGISTRY.pop(key, None)
+            log(f"🔧 正在构建向量矩阵缓存 ({fingerprint['db_rows']} 条)...")
+            vm = build_vector_matrix(db_path, fingerprint, log=log)
+
+        _MATRIX_REGISTRY[key] = vm
+        return vm
+
+
+# ================= 近似最近邻索引 (ANN) =================
+# 可选的向量检索后端，由 RecallWorker 的 vector_index 参数选择：
+#   "exact" - 暴力矩阵乘 (默认，召回率 100%)
+#   "ivf"   - IVF-Flat，纯 NumPy 实现：球面 k-means 分桶，查询时只扫描 nprobe 个桶
+#   "hnsw"  - HNSW 图索引，依赖可选包 hnswlib，未安装时回退到 exact
+#   "int8" / "pq" - 量化压缩存储 + 全精度精排，见下方「量化向量存储」
+# 索引文件与矩阵缓存一起保存在 <db_path>.vcache/ 中，并记录构建时的 DB 指纹；
+# 构建完成后会抽样对比 exact 检索，输出 recall@40。
+
+try:
+    import hnswlib
+    HAS_HNSWLIB = True
+except ImportError:
+    HAS_HNSWLIB = False
+
+VECTOR_INDEX_KINDS = ("exact", "ivf", "hnsw", "int8", "pq")
+ANN_RECALL_TOP_K = 40
+ANN_RECALL_QUERIES = 50
+
+IVF_NPROBE = 16
+IVF_TRAIN_ITERS = 15
+IVF_TRAIN_POINTS_PER_LIST = 64
+_ASSIGN_BATCH = 8192
+
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 128
+
+_INDEX_REGISTRY = {}
+
+
+def _assign_to_centroids(data, centroids):
+    assign = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), _ASSIGN_BATCH):
+        block = np.asarray(data[start:start + _ASSIGN_BATCH], dtype=np.float32)
+        assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assign
+
+
+def spherical_kmeans(data, n_clusters, n_iter=IVF_TRAIN_ITERS, seed=0):
+    """归一化数据上的球面 k-means (以内积作为相似度)，返回归一化的质心"""
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assign = _assign_to_centroids(data, centroids)
+        order = np.argsort(assign, kind="stable")
+        sorted_assign = assign[order]
+        clusters, starts = np.unique(sorted_assign, return_index=True)
+
+        sums = np.zeros_like(centroids)
+        sums[clusters] = np.add.reduceat(data[order], starts, axis=0)
+
+        # 空桶：随机挑选样本点重新播种
+        empty = np.setdiff1d(np.arange(n_clusters), clusters)
+        if empty.size:
+            sums[empty] = data[rng.choice(len(data), empty.size, replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+
+    return centroids
+
+
+class IvfFlatIndex:
+    """IVF-Flat：质心 + 倒排桶 (按桶排序的行号)，向量本体直接读取 mmap 矩阵"""
+
+    kind = "ivf"
+
+    def __init__(self, vm, centroids, order, offsets, meta, nprobe=IVF_NPROBE):
+        self.vm = vm
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.meta = meta
+        self.nprobe = nprobe
+
+    def __len__(self):
+        return len(self.vm)
+
+    @property
+    def nlist(self):
+        return int(self.centroids.shape[0])
+
+    @classmethod
+    def build(cls, vm, nlist=None, seed=0):
+        n = len(vm)
+        if nlist is None:
+            nlist = int(np.sqrt(n))
+        nlist = max(1, min(nlist, n))
+
+        rng = np.random.default_rng(seed)
+        train_size = min(n, nlist * IVF_TRAIN_POINTS_PER_LIST)
+        train_rows = np.sort(rng.choice(n, train_size, replace=False))
+        centroids = spherical_kmeans(vm.matrix[train_rows], nlist, seed=seed)
+
+        assign = _assign_to_centroids(vm.matrix, centroids)
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        counts = np.bincount(assign, minlength=nlist)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        meta = {"kind": cls.kind, "nlist": nlist, "count": n}
+        return cls(vm, centroids, order, offsets, meta)
+
+    def save(self, cache_dir):
+        tmp_path = os.path.join(cache_dir, "ivf.tmp.npz")
+        np.savez(tmp_path, centroids=self.centroids, order=self.order, offsets=self.offsets)
+        os.replace(tmp_path, os.path.join(cache_dir, "ivf.npz"))
+
+    @classmethod
+    def load(cls, vm, cache_dir, meta):
+        with np.load(os.path.join(cache_dir, "ivf.npz"), allow_pickle=False) as data:
+            return cls(vm, data["centroids"], data["order"], data["offsets"], meta)
+
+    def search(self, query_vec, top_k=40, nprobe=None):
+        q = normalize_query(query_vec, self.vm.dim)
+        if q is None or len(self) == 0:
+            return []
+        nprobe = max(1, min(nprobe or self.nprobe, self.nlist))
+        probe = top_k_indices(self.centroids @ q, nprobe)
+
+        rows = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probe])
+        if rows.size == 0:
+            return []
+        # 行号升序读取，mmap 访问更接近顺序 I/O
+        rows.sort()
+        scores = self.vm.matrix[rows] @ q
+        return self.vm._top_k_from_scores(scores, top_k, rows=rows)
+
+
+class HnswIndex:
+    """基于 hnswlib 的 HNSW 索引 (内积空间，向量已归一化即余弦)"""
+
+    kind = "hnsw"
+
+    def __init__(self, vm, index, meta):
+        self.vm = vm
+        self.index = index
+        self.meta = meta
+
+    def __len__(self):
+        return len(self.vm)
+
+    @classmethod
+    def build(cls, vm, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION):
+        index = hnswlib.Index(space="ip", dim=vm.dim)
+        index.init_index(max_elements=max(1, len(vm)), ef_construction=ef_construction, M=m)
+        for start in range(0, len(vm), _ASSIGN_BATCH):
+            block = np.asarray(vm.matrix[start:start + _ASSIGN_BATCH], dtype=np.float32)
+            index.add_items(block, np.arange(start, start + len(block)))
+        index.set_ef(HNSW_EF_SEARCH)
+        meta = {"kind": cls.kind, "M": m, "ef_construction": ef_construction, "count": len(vm)}
+        return cls(vm, index, meta)
+
+    def save(self, cache_dir):
+        tmp_path = os.path.join(cache_dir, "hnsw.tmp.bin")
+        self.index.save_index(tmp_path)
+        os.replace(tmp_path, os.path.join(cache_dir, "hnsw.bin"))
+
+    @classmethod
+    def load(cls, vm, cache_dir, meta):
+        index = hnswlib.Index(space="ip", dim=vm.dim)
+        index.load_index(os.path.join(cache_dir, "hnsw.bin"), max_elements=max(1, len(vm)))
+        index.set_ef(HNSW_EF_SEARCH)
+        return cls(vm, index, meta)
+
+    def search(self, query_vec, top_k=40):
+        q = normalize_query(query_vec, self.vm.dim)
+        k = min(top_k, len(self))
+        if q is None or k <= 0:
+            return []
+        if self.index.ef < k:
+            self.index.set_ef(k)
+        labels, distances = self.index.knn_query(q, k=k)
+        # hnswlib 内积空间的距离为 1 - ip
+        return [
+            (int(self.vm.ids[r]), float(1.0 - d), str(self.vm.section_ids[r]))
+            for r, d in zip(labels[0], distances[0])
+        ]
+
+
+# ================= 量化向量存储 (int8 / PQ) =================
+# 面向百万级语料：常驻内存的只有压缩码，查询分两步
+#   1) 在压缩码上做非对称距离计算 (ADC)：query 保持 float32，只有库向量被量化
+#   2) 取 ADC 分数 Top-N (QUANT_RESCORE_CANDIDATES) 回读 mmap 全精度矩阵精排，再截取 Top-K
+# 内存 / 召回权衡：
+#   int8 - 每维 1 字节 (float32 的 1/4)，召回几乎无损
+#   pq   - 每向量 PQ_M 字节 (dim=1024, M=64 时为 float32 的 1/64)，依赖精排弥补召回
+# QUANT_RESCORE_CANDIDATES 越大召回越高、精排读盘越多。
+
+QUANT_RESCORE_CANDIDATES = 400
+PQ_M = 64
+PQ_CENTROIDS = 256
+PQ_TRAIN_ITERS = 12
+PQ_TRAIN_SAMPLES = 25600
+# 分块大小: PQ 查表每行只展开 M 个 float；按整行展开为 float32 的扫描 (int8 ADC、exact 对照) 每行 dim 个 float，
+# 用小块 (4096 × 1024 维 ≈ 16 MB) 避免临时数组接近全精度矩阵的内存占用
+_ADC_BATCH = 65536
+_WIDE_BATCH = 4096
+
+
+def _int8_adc_scores(codes, scale, offset, q):
+    # q·x ≈ (q*scale)·(code + 128) + q·offset
+    q_scaled = (q * scale).astype(np.float32)
+    bias = float(q @ offset) + 128.0 * float(q_scaled.sum())
+    scores = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), _WIDE_BATCH):
+        block = codes[start:start + _WIDE_BATCH]
+        scores[start:start + len(block)] = block.astype(np.float32) @ q_scaled
+    return scores + bias
+
+
+def _pq_adc_scores(codes, codebooks, q):
+    m, _, dsub = codebooks.shape
+    # 查找表 LUT[j, c] = q_j · codebook[j, c]
+    lut = np.einsum("mcd,md->mc", codebooks, q.reshape(m, dsub)).astype(np.float32)
+    sub_idx = np.arange(m)
+    scores = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), _ADC_BATCH):
+        block = codes[start:start + _ADC_BATCH]
+        scores[start:start + len(block)] = lut[sub_idx, block].sum(axis=1)
+    return scores
+
+
+class _QuantizedIndex:
+    """量化索引公共部分：ADC 粗排 + 全精度精排 (adc_scores 由子类传入: 归一化查询 -> 每行近似内积)"""
+
+    def __init__(self, vm, meta, adc_scores, rescore=QUANT_RESCORE_CANDIDATES):
+        self.vm = vm
+        self.meta = meta
+        self.adc_scores = adc_scores
+        self.rescore = rescore
+
+    def __len__(self):
+        return len(self.vm)
+
+    def search(self, query_vec, top_k=40, rescore=None):
+        q = normalize_query(query_vec, self.vm.dim)
+        if q is None or len(self) == 0:
+            return []
+        n_candidates = max(top_k, rescore or self.rescore)
+        rows = top_k_indices(self.adc_scores(q), n_candidates)
+        rows.sort()
+        scores = self.vm.matrix[rows] @ q
+        return self.vm._top_k_from_scores(scores, top_k, rows=rows)
+
+
+class Int8Index(_QuantizedIndex):
+    """逐维标量量化：x ≈ offset + scale * (code + 128)，code 为 int8"""
+
+    kind = "int8"
+
+    def __init__(self, vm, codes, scale, offset, meta, rescore=QUANT_RESCORE_CANDIDATES):
+        super().__init__(vm, meta, functools.partial(_int8_adc_scores, codes, scale, offset), rescore)
+        self.codes = codes
+        self.scale = scale
+        self.offset = offset
+
+    @classmethod
+    def build(cls, vm, codes_path=None):
+        n, dim = len(vm), vm.dim
+        lo = np.full(dim, np.inf, dtype=np.float32)
+        hi = np.full(dim, -np.inf, dtype=np.float32)
+        for start in range(0, n, _ASSIGN_BATCH):
+            block = np.asarray(vm.matrix[start:start + _ASSIGN_BATCH], dtype=np.float32)
+            lo = np.minimum(lo, block.min(axis=0))
+            hi = np.maximum(hi, block.max(axis=0))
+        scale = (hi - lo) / 255.0
+        scale[scale == 0] = 1.0
+        offset = lo
+
+        if codes_path:
+            codes = np.lib.format.open_memmap(codes_path, mode="w+", dtype=np.int8, shape=(n, dim))
+        else:
+            codes = np.empty((n, dim), dtype=np.int8)
+        for start in range(0, n, _ASSIGN_BATCH):
+            block = np.asarray(vm.matrix[start:start + _ASSIGN_BATCH], dtype=np.float32)
+            q = np.rint((block - offset) / scale) - 128
+            codes[start:start + len(block)] = np.clip(q, -128, 127).astype(np.int8)
+
+        meta = {"kind": cls.kind, "count": n, "bytes_per_vector": dim}
+        return cls(vm, codes, scale.astype(np.float32), offset.astype(np.float32), meta)
+
+    def save(self, cache_dir):
+        np.savez(os.path.join(cache_dir, "int8.tmp.npz"), scale=self.scale, offset=self.offset)
+        os.replace(os.path.join(cache_dir, "int8.tmp.npz"), os.path.join(cache_dir, "int8.npz"))
+
+    @classmethod
+    def load(cls, vm, cache_dir, meta):
+        codes = np.load(os.path.join(cache_dir, meta["codes_file"]), mmap_mode="r", allow_pickle=False)
+        with np.load(os.path.join(cache_dir, "int8.npz"), allow_pickle=False) as data:
+            return cls(vm, codes, data["scale"], data["offset"], meta,
+                       rescore=meta.get("rescore", QUANT_RESCORE_CANDIDATES))
+
+
+def _pick_pq_m(dim, target=PQ_M):
+    """选取不超过 target 且能整除 dim 的子空间个数"""
+    for m in range(min(target, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def _kmeans_l2(data, n_clusters, n_iter=PQ_TRAIN_ITERS, seed=0):
+    """欧氏 k-means，用于 PQ 子空间码本训练"""
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(data))
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        # argmin ||x - c||^2 = argmax (x·c - ||c||^2 / 2)
+        assign = np.argmax(data @ centroids.T - 0.5 * np.sum(centroids ** 2, axis=1), axis=1)
+        counts = np.bincount(assign, minlength=n_clusters)
+        sums = np.stack(
+            [np.bincount(assign, weights=data[:, d], minlength=n_clusters) for d in range(data.shape[1])],
+            axis=1
+        )
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        empty = np.flatnonzero(~filled)
+        if empty.size:
+            centroids[empty] = data[rng.choice(len(data), empty.size, replace=False)]
+    return centroids.astype(np.float32)
+
+
+class PqIndex(_QuantizedIndex):
+    """乘积量化：dim 切成 M 个子空间，每个子空间 256 个码字，每向量 M 字节"""
+
+    kind = "pq"
+
+    def __init__(self, vm, codes, codebooks, meta, rescore=QUANT_RESCORE_CANDIDATES):
+        super().__init__(vm, meta, functools.partial(_pq_adc_scores, codes, codebooks), rescore)
+        self.codes = codes
+        self.codebooks = codebooks   # (M, 256, dsub)
+
+    @classmethod
+    def build(cls, vm, codes_path=None, m=PQ_M, seed=0):
+        n, dim = len(vm), vm.dim
+        m = _pick_pq_m(dim, m)
+        dsub = dim // m
+
+        rng = np.random.default_rng(seed)
+        train_rows = np.sort(rng.choice(n, min(n, PQ_TRAIN_SAMPLES), replace=False))
+        train = np.asarray(vm.matrix[train_rows], dtype=np.float32)
+        n_codes = min(PQ_CENTROIDS, len(train))
+        codebooks = np.zeros((m, PQ_CENTROIDS, dsub), dtype=np.float32)
+        for j in range(m):
+            codebooks[j, :n_codes] = _kmeans_l2(train[:, j * dsub:(j + 1) * dsub], n_codes, seed=seed + j)
+
+        if codes_path:
+            codes = np.lib.format.open_memmap(codes_path, mode="w+", dtype=np.uint8, shape=(n, m))
+        else:
+            codes = np.empty((n, m), dtype=np.uint8)
+        half_norms = 0.5 * np.sum(codebooks[:, :n_codes] ** 2, axis=2)
+        for start in range(0, n, _ASSIGN_BATCH):
+            block = np.asarray(vm.matrix[start:start + _ASSIGN_BATCH], dtype=np.float32)
+            for j in range(m):
+                sub = block[:, j * dsub:(j + 1) * dsub]
+                codes[start:start + len(block), j] = np.argmax(
+                    sub @ codebooks[j, :n_codes].T - half_norms[j], axis=1
+                )
+
+        meta = {"kind": cls.kind, "count": n, "M": m, "bytes_per_vector": m}
+        return cls(vm, codes, codebooks, meta)
+
+    def save(self, cache_dir):
+        np.save(os.path.join(cache_dir, "pq_codebooks.tmp.npy"), self.codebooks, allow_pickle=False)
+        os.replace(os.path.join(cache_dir, "pq_codebooks.tmp.npy"), os.path.join(cache_dir, "pq_codebooks.npy"))
+
+    @classmethod
+    def load(cls, vm, cache_dir, meta):
+        codes = np.load(os.path.join(cache_dir, meta["codes_file"]), mmap_mode="r", allow_pickle=False)
+        codebooks = np.load(os.path.join(cache_dir, "pq_codebooks.npy"), allow_pickle=False)
+        return cls(vm, codes, codebooks, meta, rescore=meta.get("rescore", QUANT_RESCORE_CANDIDATES))
+
+
+_ANN_CLASSES = {"ivf": IvfFlatIndex, "hnsw": HnswIndex, "int8": Int8Index, "pq": PqIndex}
+_QUANTIZED_KINDS = ("int8", "pq")
+
+
+def exact_top_k_rows(vm, queries, top_k):
+    """分块扫描一遍矩阵，同时求多条 (已归一化) 查询的 exact Top-K 行号"""
+    n_q = len(queries)
+    best_scores = np.full((n_q, 0), -np.inf, dtype=np.float32)
+    best_rows = np.zeros((n_q, 0), dtype=np.int64)
+    for start in range(0, len(vm), _WIDE_BATCH):
+        block = np.asarray(vm.matrix[start:start + _WIDE_BATCH], dtype=np.float32)
+        scores = np.concatenate([best_scores, queries @ block.T], axis=1)
+        rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(block)), (n_q, len(block)))], axis=1)
+        keep = min(top_k, scores.shape[1])
+        idx = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+        best_scores = np.take_along_axis(scores, idx, axis=1)
+        best_rows = np.take_along_axis(rows, idx, axis=1)
+    return best_rows
+
+
+def evaluate_recall(vm, index, top_k=ANN_RECALL_TOP_K, n_queries=ANN_RECALL_QUERIES, seed=0):
+    """抽样库内向量作为查询，计算 ANN 相对 exact 检索的平均 recall@top_k"""
+    n = len(vm)
+    if n == 0:
+        return 1.0
+    rng = np.random.default_rng(seed)
+    query_rows = np.sort(rng.choice(n, min(n_queries, n), replace=False))
+    queries = np.asarray(vm.matrix[query_rows], dtype=np.float32)
+    exact_rows = exact_top_k_rows(vm, queries, top_k)
+
+    recalls = []
+    for q, rows in zip(queries, exact_rows):
+        exact_ids = {int(vm.ids[r]) for r in rows}
+        ann_ids = {hit[0] for hit in index.search(q, top_k)}
+        recalls.append(len(exact_ids & ann_ids) / len(exact_ids))
+    return float(np.mean(recalls)) if recalls else 1.0
+
+
+def _read_index_meta(cache_dir, kind):
+    meta_path = os.path.join(cache_dir, f"{kind}.json")
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def _write_index_meta(cache_dir, kind, meta):
+    _write_json_atomic(os.path.join(cache_dir, f"{kind}.json"), meta)
+
+
+def _is_index_valid(meta, vm):
+    if not meta:
+        return False
+    return (meta.get("db_mtime") == vm.meta.get("db_mtime")
+            and meta.get("db_rows") == vm.meta.get("db_rows")
+            and meta.get("count") == len(vm))
+
+
+def build_ann_index(vm, kind, cache_dir=None, log=None, rescore=None, **build_opts):
+    """
+    构建 ANN / 量化索引，评估 recall@40 并 (可选) 持久化到 cache_dir。
+    rescore 仅对量化索引有效 (精排候选数)，build_opts 透传给索引的 build (如 PQ 的 m)。
+    """
+    log = log or _noop_log
+    cls = _ANN_CLASSES[kind]
+    start = time.time()
+    codes_file = None
+    if kind in _QUANTIZED_KINDS:
+        # 压缩码同样按指纹命名并以 mmap 写入；目录不可写时在内存中构建
+        codes_file = f"{kind}_codes_{_cache_token(vm.meta)}.npy"
+        codes_path = None
+        if cache_dir:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                codes_path = os.path.join(cache_dir, codes_file)
+            except OSError:
+                codes_path = None
+        index = cls.build(vm, codes_path=codes_path, **build_opts)
+        if codes_path is None:
+            codes_file = None
+        index.rescore = rescore or QUANT_RESCORE_CANDIDATES
+        index.meta["rescore"] = index.rescore
+    else:
+        index = cls.build(vm, **build_opts)
+    build_sec = time.time() - start
+
+    recall = evaluate_recall(vm, index)
+    index.meta.update({
+        "db_mtime": vm.meta.get("db_mtime"),
+        "db_rows": vm.meta.get("db_rows"),
+        "build_sec": round(build_sec, 3),
+        f"recall@{ANN_RECALL_TOP_K}": round(recall, 4),
+    })
+    log(f"📐 {kind.upper()} 索引构建完成 ({build_sec:.1f}s)，"
+        f"recall@{ANN_RECALL_TOP_K} = {recall:.3f} (对比 exact，{ANN_RECALL_QUERIES} 条抽样查询)")
+    if "bytes_per_vector" in index.meta:
+        log(f"   压缩码: {index.meta['bytes_per_vector']} 字节/向量 "
+            f"(float32 为 {vm.dim * 4} 字节)，精排候选数 {index.rescore}")
+
+    if cache_dir and (kind not in _QUANTIZED_KINDS or codes_file):
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            index.save(cache_dir)
+            if codes_file:
+                index.meta["codes_file"] = codes_file
+                _cleanup_stale_files(cache_dir, f"{kind}_codes_", codes_file)
+            _write_index_meta(cache_dir, kind, index.meta)
+        except OSError as e:
+            log(f"⚠️ {kind.upper()} 索引写入失败 ({e})，本次仅在内存中使用")
+    return index
+
+
+def get_vector_searcher(db_path, index_kind="exact", log=None):
+    """
+    返回带 search(query_vec, top_k) 接口的检索后端：
+    exact -> VectorMatrix；ivf / hnsw -> 对应 ANN 索引 (缺失或过期时自动构建)。
+    """
+    log = log or _noop_log
+    vm = load_vector_matrix(db_path, log=log)
+    if index_kind not in _ANN_CLASSES or len(vm) == 0:
+        return vm
+    if index_kind == "hnsw" and not HAS_HNSWLIB:
+        log("⚠️ 未安装 hnswlib (pip install hnswlib)，HNSW 模式回退为 exact 检索")
+        return vm
+
+    key = (os.path.abspath(db_path), index_kind)
+    with _REGISTRY_LOCK:
+        cached = _INDEX_REGISTRY.get(key)
+        if cached is not None and cached.vm is vm:
+            return cached
+
+        cache_dir = get_cache_dir(db_path)
+        meta = _read_index_meta(cache_dir, index_kind)
+        index = None
+        if _is_index_valid(meta, vm):
+            try:
+                index = _ANN_CLASSES[index_kind].load(vm, cache_dir, meta)
+                log(f"⚡ 已加载 {index_kind.upper()} 索引 "
+                    f"(recall@{ANN_RECALL_TOP_K} = {meta.get(f'recall@{ANN_RECALL_TOP_K}', 'N/A')})")
+            except Exception as e:
+                log(f"⚠️ {index_kind.upper()} 索引损坏 ({e})，重新构建...")
+                index = None
+
+        if index is None:
+            log(f"🔧 正在构建 {index_kind.upper()} 索引 ({len(vm)} 条)...")
+            index = build_ann_index(vm, index_kind, cache_dir=cache_dir, log=log)
+
+        _INDEX_REGISTRY[key] = index
+        return index
+
+
+# ================= 命令行入口 =================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RAG 向量库维护工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_migrate = sub.add_parser("migrate", help="将 vectors.embedding 由 JSON 文本迁移为二进制 BLOB")
+    p_migrate.add_argument("db_path")
+    p_migrate.add_argument("--dtype", choices=sorted(_BLOB_DTYPE_CODES), default="float32")
+    p_migrate.add_argument("--no-backup", action="store_true", help="不生成 <db>.bak 备份")
+    p_migrate.add_argument("--no-vacuum", action="store_true", help="迁移后不执行 VACUUM")
+
+    p_index = sub.add_parser("build-index", help="构建 ANN 索引并报告 recall@40")
+    p_index.add_argument("db_path")
+    p_index.add_argument("--kind", choices=[k for k in VECTOR_INDEX_KINDS if k != "exact"], default="ivf")
+    p_index.add_argument("--pq-m", type=int, default=PQ_M, help="PQ 子空间个数 (每向量字节数)，越大召回越高")
+    p_index.add_argument("--rescore", type=int, default=QUANT_RESCORE_CANDIDATES,
+                         help="量化索引的全精度精排候选数，越大召回越高")
+
+    args = parser.parse_args(argv)
+    cli_log = lambda m: print(f"[INFO] {m}", flush=True)
+
+    if args.command == "migrate":
+        version = get_schema_version(args.db_path)
+        print(f"[INFO] 当前 schema 版本: {version}", flush=True)
+        migrate_embeddings_to_blob(
+            args.db_path, dtype=args.dtype,
+            backup=not args.no_backup, vacuum=not args.no_vacuum,
+            log=cli_log
+        )
+    elif args.command == "build-index":
+        if args.kind == "hnsw" and not HAS_HNSWLIB:
+            print("[ERROR] 未安装 hnswlib，请运行: pip install hnswlib", flush=True)
+            return 1
+        vm = load_vector_matrix(args.db_path, log=cli_log)
+        build_opts = {"m": args.pq_m} if args.kind == "pq" else {}
+        build_ann_index(vm, args.kind, cache_dir=get_cache_dir(args.db_path), log=cli_log,
+                        rescore=args.rescore, **build_opts)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+import time
+import heapq
+import logging
+import itertools
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# === Global LLM scheduler ===
+# Every outgoing LLM request (request_api_stream_sync) takes a slot from the shared scheduler, so the
+# sync paths (find_toc_pages, map-reduce groups) and the async paths (verify_toc, summaries via
+# ChatGPT_API_async) are throttled together instead of each having its own limit.
+#   - token bucket: at most LLM_RATE_PER_SEC requests/s on average, bursts of LLM_RATE_BURST
+#   - AIMD concurrency: +1 slot per window of successful requests, halved on 429 / 5xx / connection
+#     errors (at most once per LLM_BACKOFF_COOLDOWN_SEC); a 429 Retry-After pauses dispatch
+#   - priorities: waiting requests are granted lowest priority value first, FIFO within a priority
+# ChatGPT_API_async runs on the scheduler's own executor; its threads park in acquire() so async
+# callers are ordered by priority as well.
+
+PRIORITY_HIGH = 0       # blocks the pipeline (TOC detection / extraction)
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10       # background enrichment (node summaries, doc description)
+
+# Start as conservatively as the old per-call Semaphore(2) (intranet WAF returns 429 on bursts) and ramp up from there
+LLM_RATE_PER_SEC = 2.0
+LLM_RATE_BURST = 4
+LLM_MIN_CONCURRENCY = 1
+LLM_MAX_CONCURRENCY = 8
+LLM_INITIAL_CONCURRENCY = 2
+LLM_BACKOFF_COOLDOWN_SEC = 2.0
+LLM_EXECUTOR_THREADS = 32
+
+_THROTTLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class LLMSlot:
+    """Handle for one granted request; report() the HTTP status so the scheduler can adapt"""
+
+    def __init__(self):
+        self.status = None
+        self.retry_after = None
+
+    def report(self, status, retry_after=None):
+        self.status = status
+        self.retry_after = retry_after
+
+
+class LLMScheduler:
+    def __init__(self, rate=LLM_RATE_PER_SEC, burst=LLM_RATE_BURST, min_concurrency=LLM_MIN_CONCURRENCY,
+                 max_concurrency=LLM_MAX_CONCURRENCY, initial_concurrency=LLM_INITIAL_CONCURRENCY):
+        self.rate = rate
+        self.burst = burst
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._limit = float(initial_concurrency)
+        self._in_flight = 0
+        self._tokens = float(burst)
+        self._refill_at = time.monotonic()
+        self._paused_until = 0.0
+        self._last_backoff = 0.0
+        self._executor = None
+        self._stats = {"requests": 0, "succeeded": 0, "throttled": 0, "failed": 0,
+                       "max_queued": 0, "wait_sec": 0.0, "max_wait_sec": 0.0}
+
+    # ---------- acquire / release ----------
+    def _take_token_locked(self, now):
+        """Takes a token and returns 0, or returns the seconds until one is available"""
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._refill_at) * self.rate)
+            self._refill_at = now
+            if self._tokens < 1.0:
+                return (1.0 - self._tokens) / self.rate
+            self._tokens -= 1.0
+        return 0
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        ticket = (priority, next(self._seq))
+        start = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._heap, ticket)
+            self._stats["max_queued"] = max(self._stats["max_queued"], len(self._heap))
+            try:
+                while True:
+                    if self._heap[0] == ticket and self._in_flight < int(self._limit):
+                        wait = self._take_token_locked(time.monotonic())
+                        if not wait:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+            except BaseException:
+                # interrupted while queued: drop the ticket so it does not block the waiters behind it
+                self._heap.remove(ticket)
+                heapq.heapify(self._heap)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._heap)
+            self._in_flight += 1
+            waited = time.monotonic() - start
+            self._stats["requests"] += 1
+            self._stats["wait_sec"] += waited
+            self._stats["max_wait_sec"] = max(self._stats["max_wait_sec"], waited)
+            # the next waiter may also fit (free slot + token)
+            self._cond.notify_all()
+
+    def release(self, status=None, retry_after=None, error=False):
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if error or status in _THROTTLE_STATUS:
+                self._stats["throttled" if status in _THROTTLE_STATUS else "failed"] += 1
+                if now - self._last_backoff >= LLM_BACKOFF_COOLDOWN_SEC:
+                    self._limit = max(float(self.min_concurrency), self._limit / 2)
+                    self._last_backoff = now
+                    logging.warning(f"⚠️ LLM backoff (status={status}): concurrency -> {int(self._limit)}")
+                if status == 429 and retry_after:
+                    try:
+                        self._paused_until = max(self._paused_until, now + float(retry_after))
+                    except (TypeError, ValueError):
+                        pass
+            elif status == 200:
+                self._stats["succeeded"] += 1
+                self._limit = min(float(self.max_concurrency), self._limit + 1.0 / max(self._limit, 1.0))
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_NORMAL):
+        """with scheduler.slot(priority) as slot: ...; slot.report(response.status_code)"""
+        self.acquire(priority)
+        slot = LLMSlot()
+        try:
+            yield slot
+        except BaseException:
+            self.release(slot.status, slot.retry_after, error=slot.status is None)
+            raise
+        self.release(slot.status, slot.retry_after)
+
+    # ---------- async support / metrics ----------
+    @property
+    def executor(self):
+        with self._cond:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=LLM_EXECUTOR_THREADS, thread_name_prefix="llm")
+            return self._executor
+
+    def stats(self):
+        """Snapshot: queue depth, in-flight requests, current concurrency limit and totals"""
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot.update(queued=len(self._heap), in_flight=self._in_flight, concurrency=int(self._limit))
+        requests = snapshot["requests"]
+        snapshot["avg_wait_sec"] = round(snapshot.pop("wait_sec") / requests, 3) if requests else 0.0
+        snapshot["max_wait_sec"] = round(snapshot["max_wait_sec"], 3)
+        return snapshot
+
+
+LLM_SCHEDULER = LLMScheduler()
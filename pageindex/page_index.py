@@ -5,9 +5,10 @@ import math
 import random
 import re
 import asyncio
+import threading
 from datetime import datetime
 from io import BytesIO
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
 # Import from your utils file
 from .utils import (
@@ -26,6 +27,8 @@ from .utils import (
     post_processing,
     JsonLogger,
     ConfigLoader,
+    set_llm_cache_enabled,
+    llm_cache_stats,
     get_pdf_name,
     convert_physical_index_to_int,
     get_json_content,
@@ -33,6 +36,20 @@ from .utils import (
     get_nodes,
     clean_deepseek_content  # 确保 utils 中有这个函数，如果没有请忽略
 )
+from .toc_prefilter import is_possible_toc_page
+from .llm_scheduler import LLM_SCHEDULER, PRIORITY_HIGH, PRIORITY_LOW
+
+# Optional: binary sidecar (<json>.pidx) consumed by the RAG loaders when run from the app root
+try:
+    from RAG_PageIndexSidecar import build_sidecar
+    HAS_SIDECAR = True
+except ImportError:
+    HAS_SIDECAR = False
+
+# Pages scored concurrently by find_toc_pages (override with opt.toc_detect_concurrency; 1 = serial scan)
+TOC_DETECT_CONCURRENCY = 4
+# Page groups processed concurrently when opt.toc_group_mode == 'map_reduce'
+GROUP_MAP_CONCURRENCY = 4
 
 # === CRITICAL FIX: Reference-based node collector ===
 def collect_nodes_by_reference(structure):
@@ -81,7 +98,7 @@ async def generate_document_description(page_list, model=None):
     Format: {{ "description": "<your description>" }}
     """
     try:
-        response_str = await ChatGPT_API_async(model=model, prompt=prompt)
+        response_str = await ChatGPT_API_async(model=model, prompt=prompt, priority=PRIORITY_LOW)
         
         # 尝试标准 JSON 提取
         data = extract_json(response_str)
@@ -110,10 +127,6 @@ async def generate_summaries_for_structure(structure, model=None):
     """
     nodes = collect_nodes_by_reference(structure)
 
-    # === 关键修改：降低并发 ===
-    # 内网环境建议设置为 2 或 1，防止触发 WAF 429 错误
-    sem = asyncio.Semaphore(2) 
-
     async def summarize_node(node):
         text_content = node.get('text', '')
         if not text_content or len(text_content.strip()) < 10: 
@@ -133,49 +146,46 @@ async def generate_summaries_for_structure(structure, model=None):
         Format: {{ "summary": "<your summary here>" }}
         """
         
-        async with sem:
-            try:
-                # 增加随机延时，避免瞬间并发击穿限流
-                await asyncio.sleep(random.uniform(0.5, 1.5))
-                
-                response_str = await ChatGPT_API_async(model, prompt)
-                
-                # 1. 尝试标准提取
-                data = extract_json(response_str)
-                data = ensure_dict_result(data)
-                summary_text = data.get("summary", "")
-                
-                # 2. 强力兜底 (DeepSeek 经常返回带思考过程的非标准 JSON)
-                if not summary_text and response_str and "Error" not in response_str:
-                     clean_raw = response_str.replace("```json", "").replace("```", "").strip()
-                     # 移除 <think> 标签 (如果 utils 没处理干净)
-                     clean_raw = re.sub(r'<think>.*?</think>', '', clean_raw, flags=re.DOTALL).strip()
-                     
-                     # 简单清洗尝试获取内容
-                     if "summary" in clean_raw:
-                         # 极其暴力的提取，为了保证有内容
-                         try:
-                             summary_text = clean_raw.split('"summary":')[1].strip().strip('"}').strip("',")
-                         except:
-                             summary_text = clean_raw
-                     else:
-                         summary_text = clean_raw # 既然无法解析 JSON，就认为整个回复都是摘要
-
-                # 清洗一下可能的首尾引号
-                if summary_text:
-                    summary_text = summary_text.strip('"').strip("'")
-
-                node['summary'] = summary_text
-                
-                if summary_text:
-                    # 在控制台打印简略信息，证明正在工作
-                    print(f"  [SUM] OK: {node.get('title', 'Node')[:15]}...", flush=True)
-                else:
-                    print(f"  [SUM] Empty: {node.get('title')}", flush=True)
-                
-            except Exception as e:
-                print(f"[ERROR] Failed to summarize node {node.get('title')}: {e}")
-                node['summary'] = ""
+        try:
+            # 并发与限速由全局 LLM_SCHEDULER 统一控制 (低优先级，让位于目录检测 / 校验请求)
+            response_str = await ChatGPT_API_async(model, prompt, priority=PRIORITY_LOW)
+            
+            # 1. 尝试标准提取
+            data = extract_json(response_str)
+            data = ensure_dict_result(data)
+            summary_text = data.get("summary", "")
+            
+            # 2. 强力兜底 (DeepSeek 经常返回带思考过程的非标准 JSON)
+            if not summary_text and response_str and "Error" not in response_str:
+                 clean_raw = response_str.replace("```json", "").replace("```", "").strip()
+                 # 移除 <think> 标签 (如果 utils 没处理干净)
+                 clean_raw = re.sub(r'<think>.*?</think>', '', clean_raw, flags=re.DOTALL).strip()
+                 
+                 # 简单清洗尝试获取内容
+                 if "summary" in clean_raw:
+                     # 极其暴力的提取，为了保证有内容
+                     try:
+                         summary_text = clean_raw.split('"summary":')[1].strip().strip('"}').strip("',")
+                     except:
+                         summary_text = clean_raw
+                 else:
+                     summary_text = clean_raw # 既然无法解析 JSON，就认为整个回复都是摘要
+
+            # 清洗一下可能的首尾引号
+            if summary_text:
+                summary_text = summary_text.strip('"').strip("'")
+
+            node['summary'] = summary_text
+            
+            if summary_text:
+                # 在控制台打印简略信息，证明正在工作
+                print(f"  [SUM] OK: {node.get('title', 'Node')[:15]}...", flush=True)
+            else:
+                print(f"  [SUM] Empty: {node.get('title')}", flush=True)
+            
+        except Exception as e:
+            print(f"[ERROR] Failed to summarize node {node.get('title')}: {e}")
+            node['summary'] = ""
 
     tasks = []
     for node in nodes: 
@@ -279,7 +289,7 @@ async def check_title_appearance_in_start_concurrent(structure, page_list, model
             item['appear_start'] = result
     return structure
 
-def toc_detector_single_page(content, model=None):
+def toc_detector_single_page(content, model=None, cancel_event=None):
     prompt = f"""
     Your job is to detect if there is a table of content provided in the given text.
     Given text: {content}
@@ -290,7 +300,7 @@ def toc_detector_single_page(content, model=None):
     }}
     Directly return the final JSON structure. Do not output anything else.
     Please note: abstract,summary, notation list, figure list, table list, etc. are not table of contents."""
-    response = ChatGPT_API(model=model, prompt=prompt)
+    response = ChatGPT_API(model=model, prompt=prompt, priority=PRIORITY_HIGH, cancel_event=cancel_event)
     json_content = extract_json(response)
     json_content = ensure_dict_result(json_content)
     return json_content.get('toc_detected', 'no')
@@ -418,21 +428,58 @@ def toc_transformer(toc_content, model=None):
     except: return []
 
 def find_toc_pages(start_page_index, page_list, opt, logger=None):
+    """
+    Speculative concurrent detection: keep up to `toc_detect_concurrency` pages ahead in flight,
+    but consume results strictly in page order so the contiguous-run semantics match the serial scan
+    (pages past toc_check_page_num are only checked while the run continues; stop after the last 'yes').
+    Once the run is known to have ended, queued requests are cancelled and in-flight requests are told to
+    stop via cancel_event (they give up their scheduler slot instead of streaming to completion).
+    Pages the local pre-filter rejects (see toc_prefilter.py) resolve to 'no' without an LLM call.
+    """
     print('start find_toc_pages')
+    window = max(1, int(getattr(opt, 'toc_detect_concurrency', None) or TOC_DETECT_CONCURRENCY))
+    use_prefilter = getattr(opt, 'if_use_toc_prefilter', 'yes') != 'no'
     last_page_is_yes = False
     toc_page_list = []
-    i = start_page_index
-    while i < len(page_list):
-        if i >= opt.toc_check_page_num and not last_page_is_yes: break
-        detected_result = toc_detector_single_page(page_list[i][0],model=opt.model)
-        if detected_result == 'yes':
-            if logger: logger.info(f'Page {i} has toc')
-            toc_page_list.append(i)
-            last_page_is_yes = True
-        elif detected_result == 'no' and last_page_is_yes:
-            if logger: logger.info(f'Found the last page with toc: {i-1}')
-            break
-        i += 1
+    futures = {}
+    next_page = start_page_index
+    prefiltered = 0
+
+    def may_need(page):
+        return page < len(page_list) and (page < opt.toc_check_page_num or last_page_is_yes)
+
+    executor = ThreadPoolExecutor(max_workers=window)
+    cancel_event = threading.Event()
+    try:
+        i = start_page_index
+        while i < len(page_list):
+            if i >= opt.toc_check_page_num and not last_page_is_yes: break
+            while next_page < i + window and may_need(next_page):
+                content = page_list[next_page][0]
+                if use_prefilter and not is_possible_toc_page(content):
+                    futures[next_page] = Future()
+                    futures[next_page].set_result('no')
+                    prefiltered += 1
+                else:
+                    futures[next_page] = executor.submit(toc_detector_single_page, content, model=opt.model,
+                                                     cancel_event=cancel_event)
+                next_page += 1
+            detected_result = futures.pop(i).result()
+            if detected_result == 'yes':
+                if logger: logger.info(f'Page {i} has toc')
+                toc_page_list.append(i)
+                last_page_is_yes = True
+            elif detected_result == 'no' and last_page_is_yes:
+                if logger: logger.info(f'Found the last page with toc: {i-1}')
+                break
+            i += 1
+    finally:
+        cancel_event.set()
+        for future in futures.values():
+            future.cancel()
+        executor.shutdown(wait=False)
+    if futures and logger: logger.info(f'Discarded {len(futures)} speculative TOC detections')
+    if prefiltered and logger: logger.info(f'TOC pre-filter skipped the LLM for {prefiltered} pages')
     if not toc_page_list and logger: logger.info('No toc found')
     return toc_page_list
 
@@ -561,7 +608,94 @@ def generate_toc_init(part, model=None):
     print("[WARNING] generate_toc_init failed. Returning empty list.")
     return []
 
-def process_no_toc(page_list, start_index=1, model=None, logger=None):
+def generate_toc_group(part, model=None):
+    print('start generate_toc_group')
+    prompt = """
+    You are an expert in extracting hierarchical tree structure.
+    You are given one part of a longer document. Extract the section headings that start in this part.
+    "level" is the depth of the heading in the whole document (1 for top-level sections, 2 for their subsections, ...).
+    Use the document's own numbering for "structure" if it is printed, otherwise number the headings within this part.
+    The response should be in the following format. 
+        [ { "structure": "...", "title": "...", "level": <1, 2, 3, ...>, "physical_index": "<physical_index_X>" }, ... ]
+    Directly return the final JSON structure. Do not output anything else."""
+    prompt = prompt + '\nGiven text\n:' + part
+    response, finish_reason = ChatGPT_API_with_finish_reason(model=model, prompt=prompt)
+    if finish_reason == 'finished': return extract_json(response)
+    print("[WARNING] generate_toc_group failed. Returning empty list.")
+    return []
+
+def _group_page_range(group_text):
+    pages = [int(x) for x in re.findall(r'<physical_index_(\d+)>', group_text)]
+    return (min(pages), max(pages)) if pages else (None, None)
+
+def _map_groups(func, group_texts, *args):
+    """Runs func(group_text, *args) for every group concurrently, results in group order"""
+    with ThreadPoolExecutor(max_workers=min(GROUP_MAP_CONCURRENCY, max(len(group_texts), 1))) as executor:
+        return list(executor.map(lambda group_text: func(group_text, *args), group_texts))
+
+def _physical_index_in_range(item, page_range):
+    index = convert_physical_index_to_int([{'physical_index': item.get('physical_index')}])[0]['physical_index']
+    if index is None or page_range[0] is None or not (page_range[0] <= index <= page_range[1]):
+        return None
+    return index
+
+def _normalize_title(title):
+    return re.sub(r'\s+', '', str(title or '')).lower()
+
+def merge_group_tocs(group_results, group_ranges):
+    """
+    Reduce step of the map-reduce no-TOC mode: concatenate per-group headings in group order,
+    drop headings repeated on the overlapping boundary pages (same title + page), and renumber
+    'structure' globally from each heading's level.
+    """
+    merged = []
+    seen = set()
+    for items, page_range in zip(group_results, group_ranges):
+        if not isinstance(items, list): continue
+        for item in items:
+            if not isinstance(item, dict) or not item.get('title'): continue
+            index = _physical_index_in_range(item, page_range)
+            key = (_normalize_title(item['title']), index)
+            if index is not None and key in seen: continue
+            seen.add(key)
+            try:
+                level = int(item.get('level'))
+            except (TypeError, ValueError):
+                level = str(item.get('structure') or '1').count('.') + 1
+            merged.append((max(level, 1), {'title': item['title'], 'physical_index': index}))
+
+    counters = []
+    toc = []
+    for level, item in merged:
+        level = min(level, len(counters) + 1)
+        counters = counters[:level]
+        if len(counters) < level: counters.append(0)
+        counters[-1] += 1
+        toc.append({'structure': '.'.join(str(c) for c in counters), **item})
+    return toc
+
+def merge_group_page_numbers(toc_content, group_results, group_ranges):
+    """
+    Reduce step of the map-reduce TOC-without-page-numbers mode: every group filled in the same TOC
+    independently; take each item's physical_index from the earliest group whose own pages contain it.
+    """
+    toc_with_page_number = copy.deepcopy(toc_content)
+    for i, item in enumerate(toc_with_page_number):
+        item['physical_index'] = None
+        key = (str(item.get('structure')), _normalize_title(item.get('title')))
+        for items, page_range in zip(group_results, group_ranges):
+            if not isinstance(items, list): continue
+            by_key = {(str(x.get('structure')), _normalize_title(x.get('title'))): x for x in items if isinstance(x, dict)}
+            candidate = by_key.get(key)
+            if candidate is None and len(items) == len(toc_with_page_number) and isinstance(items[i], dict):
+                candidate = items[i]
+            index = _physical_index_in_range(candidate, page_range) if candidate else None
+            if index is not None:
+                item['physical_index'] = index
+                break
+    return toc_with_page_number
+
+def process_no_toc(page_list, start_index=1, model=None, logger=None, group_mode='sequential'):
     page_contents=[]
     token_lengths=[]
     for page_index in range(start_index, start_index+len(page_list)):
@@ -570,18 +704,25 @@ def process_no_toc(page_list, start_index=1, model=None, logger=None):
         token_lengths.append(count_tokens(page_text, model))
     group_texts = page_list_to_group_text(page_contents, token_lengths)
     if logger: logger.info(f'len(group_texts): {len(group_texts)}')
-    toc_with_page_number = generate_toc_init(group_texts[0], model)
-    if not isinstance(toc_with_page_number, list): toc_with_page_number = []
-    for group_text in group_texts[1:]:
-        toc_with_page_number_additional = generate_toc_continue(toc_with_page_number, group_text, model)    
-        if isinstance(toc_with_page_number_additional, list):
-            toc_with_page_number.extend(toc_with_page_number_additional)
+    if group_mode == 'map_reduce' and len(group_texts) > 1:
+        group_results = _map_groups(generate_toc_group, group_texts, model)
+        toc_with_page_number = merge_group_tocs(group_results, [_group_page_range(t) for t in group_texts])
+        if logger: logger.info({'group_mode': 'map_reduce', 'groups': len(group_texts),
+                                'extracted': sum(len(r) for r in group_results if isinstance(r, list)),
+                                'merged': len(toc_with_page_number)})
+    else:
+        toc_with_page_number = generate_toc_init(group_texts[0], model)
+        if not isinstance(toc_with_page_number, list): toc_with_page_number = []
+        for group_text in group_texts[1:]:
+            toc_with_page_number_additional = generate_toc_continue(toc_with_page_number, group_text, model)    
+            if isinstance(toc_with_page_number_additional, list):
+                toc_with_page_number.extend(toc_with_page_number_additional)
     if logger: logger.info(f'generate_toc: {toc_with_page_number}')
     toc_with_page_number = convert_physical_index_to_int(toc_with_page_number)
     if logger: logger.info(f'convert_physical_index_to_int: {toc_with_page_number}')
     return toc_with_page_number
 
-def process_toc_no_page_numbers(toc_content, toc_page_list, page_list,  start_index=1, model=None, logger=None):
+def process_toc_no_page_numbers(toc_content, toc_page_list, page_list,  start_index=1, model=None, logger=None, group_mode='sequential'):
     page_contents=[]
     token_lengths=[]
     toc_content = toc_transformer(toc_content, model)
@@ -592,9 +733,15 @@ def process_toc_no_page_numbers(toc_content, toc_page_list, page_list,  start_in
         token_lengths.append(count_tokens(page_text, model))
     group_texts = page_list_to_group_text(page_contents, token_lengths)
     if logger: logger.info(f'len(group_texts): {len(group_texts)}')
-    toc_with_page_number=copy.deepcopy(toc_content)
-    for group_text in group_texts:
-        toc_with_page_number = add_page_number_to_toc(group_text, toc_with_page_number, model)
+    if group_mode == 'map_reduce' and len(group_texts) > 1 and isinstance(toc_content, list):
+        group_results = _map_groups(add_page_number_to_toc, group_texts, copy.deepcopy(toc_content), model)
+        toc_with_page_number = merge_group_page_numbers(toc_content, group_results, [_group_page_range(t) for t in group_texts])
+        if logger: logger.info({'group_mode': 'map_reduce', 'groups': len(group_texts),
+                                'located': sum(1 for item in toc_with_page_number if item.get('physical_index') is not None)})
+    else:
+        toc_with_page_number=copy.deepcopy(toc_content)
+        for group_text in group_texts:
+            toc_with_page_number = add_page_number_to_toc(group_text, toc_with_page_number, model)
     if logger: logger.info(f'add_page_number_to_toc: {toc_with_page_number}')
     toc_with_page_number = convert_physical_index_to_int(toc_with_page_number)
     if logger: logger.info(f'convert_physical_index_to_int: {toc_with_page_number}')
@@ -809,9 +956,9 @@ async def meta_processor(page_list, mode=None, toc_content=None, toc_page_list=N
     if mode == 'process_toc_with_page_numbers':
         toc_with_page_number = process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_check_page_num=opt.toc_check_page_num, model=opt.model, logger=logger)
     elif mode == 'process_toc_no_page_numbers':
-        toc_with_page_number = process_toc_no_page_numbers(toc_content, toc_page_list, page_list, model=opt.model, logger=logger)
+        toc_with_page_number = process_toc_no_page_numbers(toc_content, toc_page_list, page_list, model=opt.model, logger=logger, group_mode=getattr(opt, 'toc_group_mode', 'sequential'))
     else:
-        toc_with_page_number = process_no_toc(page_list, start_index=start_index, model=opt.model, logger=logger)
+        toc_with_page_number = process_no_toc(page_list, start_index=start_index, model=opt.model, logger=logger, group_mode=getattr(opt, 'toc_group_mode', 'sequential'))
             
     toc_with_page_number = [item for item in toc_with_page_number if item.get('physical_index') is not None] 
     toc_with_page_number = validate_and_truncate_physical_indices(toc_with_page_number, len(page_list), start_index=start_index, logger=logger)
@@ -872,6 +1019,9 @@ async def tree_parser(page_list, opt, doc=None, logger=None):
 
 def page_index_main(doc, opt=None):
     logger = JsonLogger(doc)
+    if getattr(opt, 'if_use_llm_cache', None) is not None:
+        set_llm_cache_enabled(opt.if_use_llm_cache == 'yes')
+    cache_stats_start = llm_cache_stats()
     is_valid_pdf = (
         (isinstance(doc, str) and os.path.isfile(doc) and doc.lower().endswith(".pdf")) or 
         isinstance(doc, BytesIO)
@@ -927,6 +1077,12 @@ def page_index_main(doc, opt=None):
             traceback.print_exc()
         
         finally:
+            cache_stats = {k: v - cache_stats_start[k] for k, v in llm_cache_stats().items()}
+            logger.info({'llm_cache': cache_stats})
+            logger.info({'llm_scheduler': LLM_SCHEDULER.stats()})
+            print(f"[INFO] LLM cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                  f"{cache_stats['stores']} stored, {cache_stats['bypassed']} bypassed")
+
             # === EMERGENCY SAVE BLOCK ===
             final_data = {
                 "doc_name": get_pdf_name(doc),
@@ -945,6 +1101,12 @@ def page_index_main(doc, opt=None):
                 print(f"\n[SUCCESS] Data Saved (Complete or Partial): {os.path.abspath(full_save_path)}")
             except Exception as e:
                 print(f"[ERROR] Failed to save result file: {e}")
+            else:
+                if HAS_SIDECAR:
+                    try:
+                        build_sidecar(full_save_path, log=print)
+                    except Exception as e:
+                        print(f"[WARN] Failed to write sidecar: {e}")
 
             if opt.if_add_node_text == 'no':
                  remove_structure_text(final_data['structure'])
@@ -954,7 +1116,8 @@ def page_index_main(doc, opt=None):
     return asyncio.run(page_index_builder())
 
 def page_index(doc, model=None, toc_check_page_num=None, max_page_num_each_node=None, max_token_num_each_node=None,
-               if_add_node_id=None, if_add_node_summary=None, if_add_doc_description=None, if_add_node_text=None):
+               if_add_node_id=None, if_add_node_summary=None, if_add_doc_description=None, if_add_node_text=None,
+               if_use_llm_cache=None, if_use_toc_prefilter=None, toc_group_mode=None):
     user_opt = {
         arg: value for arg, value in locals().items()
         if arg != "doc" and value is not None
@@ -0,0 +1,165 @@
+import os
+import re
+import sys
+import glob
+import argparse
+
+import numpy as np
+
+# === Local TOC pre-filter ===
+# Scores how TOC-like a page is from its line shapes, so find_toc_pages can skip the LLM
+# for pages that are confidently not a table of contents (prose, tables, blank pages).
+# Features (fraction of non-empty lines):
+#   leader   - dot / ellipsis / middle-dot leaders ("Overview ........ 12", "概述……12")
+#   entry    - text followed by a single trailing page number (arabic or roman), not a numeric table row
+#   heading  - numbered headings ("2.1 ...", "II. ...", "A. ...", "第三章", "Chapter 4")
+# plus a standalone "Contents" / "目录" line. Only pages scoring below the threshold are skipped;
+# anything borderline still goes to the LLM, so the filter is tuned for recall, not precision.
+# Pages without usable line structure (fewer than TOC_PREFILTER_MIN_LINES lines, or text extraction
+# that merged the page into one long line) carry no evidence either way and are never skipped.
+
+TOC_PREFILTER_THRESHOLD = 0.25
+TOC_PREFILTER_MIN_LINES = 2
+# a single line this long holding most of the page's text means the line breaks were lost
+TOC_PREFILTER_MERGED_LINE_CHARS = 200
+TOC_PREFILTER_MERGED_LINE_SHARE = 0.5
+
+_FEATURE_WEIGHTS = np.array([2.5, 1.5, 1.0])    # leader, entry, heading
+_KEYWORD_SCORE = 1.0
+
+_KEYWORD_RE = re.compile(r"^\s*(?:table\s+of\s+contents|contents|目\s*[录錄次])\s*$", re.IGNORECASE)
+_LEADER_RE = re.compile(r"(?:\.\s*){4,}|(?:…\s*){2,}|(?:·\s*){4,}|(?:_\s*){4,}|(?:-\s*){6,}")
+_PAGE_NUMBER_RE = re.compile(r"^(?:\d{1,4}|[ivxlcdm]{1,6})$", re.IGNORECASE)
+_NUMERIC_RE = re.compile(r"^[\d,.$%()\-]+$")
+_TEXT_RE = re.compile(r"[A-Za-z一-鿿]{2,}")
+_HEADING_RE = re.compile(
+    r"^\s*(?:第[一二三四五六七八九十百零\d]+[章节篇部条]"
+    r"|(?i:chapter|part|section|appendix)\s+\w"
+    r"|附\s*录"
+    r"|\d+(?:\.\d+)*[.、]?\s+\S"
+    r"|[IVXLC]+[.、]\s*\S"
+    r"|[A-Z][.、]\s+\S"
+    r"|[一二三四五六七八九十]+[、.]\s*\S)"
+)
+
+# Hand-labelled TOC pages (0-based) of the sample PDFs within the default toc_check_page_num window
+SAMPLE_TOC_LABELS = {
+    "2023-annual-report.pdf": [2, 3],
+    "2023-annual-report-truncated.pdf": [2, 3],
+    "Regulation Best Interest_Interpretive release.pdf": [1],
+    "Regulation Best Interest_proposed rule.pdf": [2, 3, 4],
+    "aidishengtest.pdf": [],
+    "earthmover.pdf": [],
+    "four-lectures.pdf": [],
+    "q1-fy25-earnings.pdf": [],
+}
+
+
+# Synthetic pages for failure modes the sample PDFs do not cover: (name, text, is_toc)
+SYNTHETIC_TOC_PAGES = [
+    ("merged-line TOC",
+     "Contents 1 Introduction 1 2 Background 3 2.1 Related Work 4 2.2 Definitions 6 3 Method 9 "
+     "3.1 Overview 9 3.2 Training 12 4 Experiments 15 4.1 Setup 15 4.2 Results 18 5 Conclusion 22 "
+     "Appendix A Proofs 24 Appendix B Additional Results 27 References 30",
+     True),
+    ("near-empty page", "目录", True),
+]
+
+
+def _page_lines(text):
+    return [line.strip() for line in (text or "").splitlines() if line.strip()]
+
+
+def _lacks_line_structure(lines):
+    """Too few lines, or one merged line holding most of the text: the line-shape features say nothing"""
+    if len(lines) < TOC_PREFILTER_MIN_LINES:
+        return True
+    longest = max(len(line) for line in lines)
+    return (longest >= TOC_PREFILTER_MERGED_LINE_CHARS
+            and longest >= TOC_PREFILTER_MERGED_LINE_SHARE * sum(len(line) for line in lines))
+
+
+def _is_entry_line(line):
+    tokens = line.split()
+    if len(tokens) < 2 or not _PAGE_NUMBER_RE.match(tokens[-1]):
+        return False
+    # numeric table rows end with several number columns; TOC entries have text (or a leader) before the page number
+    return not _NUMERIC_RE.match(tokens[-2]) and bool(_TEXT_RE.search(line))
+
+
+def toc_page_features(text):
+    """Returns (leader, entry, heading) line fractions and whether a standalone TOC keyword line exists"""
+    lines = _page_lines(text)
+    if len(lines) < TOC_PREFILTER_MIN_LINES:
+        return np.zeros(3), False
+    flags = np.array(
+        [(bool(_LEADER_RE.search(line)), _is_entry_line(line), bool(_HEADING_RE.match(line))) for line in lines],
+        dtype=np.float64,
+    )
+    has_keyword = any(_KEYWORD_RE.match(line) for line in lines)
+    return flags.mean(axis=0), has_keyword
+
+
+def toc_page_score(text):
+    features, has_keyword = toc_page_features(text)
+    return float(features @ _FEATURE_WEIGHTS) + (_KEYWORD_SCORE if has_keyword else 0.0)
+
+
+def is_possible_toc_page(text, threshold=TOC_PREFILTER_THRESHOLD):
+    """False only for pages that are confidently not a TOC (the LLM can be skipped)"""
+    if _lacks_line_structure(_page_lines(text)):
+        return True
+    return toc_page_score(text) >= threshold
+
+
+def benchmark(pdf_dir, labels=None, check_page_num=20, threshold=TOC_PREFILTER_THRESHOLD, synthetic=None):
+    """
+    Precision / recall of the pre-filter on the sample PDFs plus SYNTHETIC_TOC_PAGES.
+    'positive' = page forwarded to the LLM; recall must stay at 1.0 for the filter to be safe.
+    """
+    from .utils import get_page_tokens
+
+    labels = SAMPLE_TOC_LABELS if labels is None else labels
+    synthetic = SYNTHETIC_TOC_PAGES if synthetic is None else synthetic
+    tp = fp = fn = tn = 0
+    for pdf_path in sorted(glob.glob(os.path.join(pdf_dir, "*.pdf"))):
+        name = os.path.basename(pdf_path)
+        if name not in labels:
+            continue
+        page_list = get_page_tokens(pdf_path)[:check_page_num]
+        truth = set(labels[name])
+        kept = [i for i, (text, _) in enumerate(page_list) if is_possible_toc_page(text, threshold)]
+        missed = sorted(truth - set(kept))
+        tp += len(truth & set(kept))
+        fp += len(set(kept) - truth)
+        fn += len(missed)
+        tn += len(page_list) - len(set(kept) | truth)
+        print(f"{name}: {len(page_list)} pages, LLM {len(kept)}, skipped {len(page_list) - len(kept)}"
+              + (f", MISSED TOC pages {missed}" if missed else ""))
+    for name, text, is_toc in synthetic:
+        kept = is_possible_toc_page(text, threshold)
+        tp += kept and is_toc
+        fp += kept and not is_toc
+        fn += not kept and is_toc
+        tn += not kept and not is_toc
+        print(f"synthetic '{name}': {'LLM' if kept else 'skipped'}" + (", MISSED TOC page" if is_toc and not kept else ""))
+    total = tp + fp + fn + tn
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 1.0
+    skipped = (fn + tn) / total if total else 0.0
+    print(f"precision={precision:.2f} recall={recall:.2f} LLM calls skipped={skipped:.0%} ({fn + tn}/{total})")
+    return {"precision": precision, "recall": recall, "skipped": skipped}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the TOC pre-filter against labelled sample PDFs")
+    parser.add_argument("--pdf-dir", default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "pdfs"))
+    parser.add_argument("--pages", type=int, default=20, help="pages checked per PDF (toc_check_page_num)")
+    parser.add_argument("--threshold", type=float, default=TOC_PREFILTER_THRESHOLD)
+    args = parser.parse_args(argv)
+    result = benchmark(args.pdf_dir, check_page_num=args.pages, threshold=args.threshold)
+    return 0 if result["recall"] == 1.0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
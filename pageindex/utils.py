@@ -6,10 +6,12 @@ import time
 import copy
 import asyncio
 import logging
+import threading
 import requests
 import urllib3
 import yaml
 import random
+import functools
 from datetime import datetime
 from pathlib import Path
 from types import SimpleNamespace as config
@@ -17,6 +19,8 @@ from types import SimpleNamespace as config
 import tiktoken
 from dotenv import load_dotenv
 
+from .llm_scheduler import LLM_SCHEDULER, PRIORITY_NORMAL
+
 try:
     import pdfplumber
     HAS_PDFPLUMBER = True
@@ -38,6 +42,27 @@ load_dotenv()
 # 默认 Key，如果环境变量中有则优先使用环境变量
 CHATGPT_API_KEY = os.getenv("CHATGPT_API_KEY", "your api key")
 
+# 3. LLM Response Cache (SQLite，跨运行复用；同一 PDF 崩溃重跑或调参重跑时不再重复请求)
+# key = SHA256(model, messages)，只缓存成功的响应；淘汰: TTL (按写入时间) + 超过条目上限按最近访问 (LRU) 删除
+# 关闭方式: 环境变量 PAGEINDEX_LLM_CACHE=0 / config.yaml 中 if_use_llm_cache: "no" / set_llm_cache_enabled(False)
+try:
+    from RAG_Cache import SqliteCache, make_cache_key
+    HAS_LLM_CACHE = True
+except ImportError:
+    HAS_LLM_CACHE = False
+
+LLM_CACHE_PATH = os.getenv(
+    "PAGEINDEX_LLM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rag_cache", "pageindex_llm_cache.db")
+)
+LLM_CACHE_MAX_ENTRIES = 50000
+LLM_CACHE_TTL_SEC = 90 * 24 * 3600
+
+_llm_cache = None
+_llm_cache_enabled = os.getenv("PAGEINDEX_LLM_CACHE", "1").lower() not in ("0", "no", "false", "off")
+_llm_cache_lock = threading.Lock()
+_llm_cache_stats = {"hits": 0, "misses": 0, "stores": 0, "bypassed": 0}
+
 # --- Universal Fallback Object ---
 class UniversalFallback(dict):
     """防止解析失败导致 crash 的安全字典"""
@@ -52,7 +77,10 @@ class UniversalFallback(dict):
     def __len__(self): return 0
     def get(self, key, default=None): return super().get(key, default)
 
-def request_api_stream_sync(model, messages, timeout=600): 
+def _is_cancelled(cancel_event):
+    return cancel_event is not None and cancel_event.is_set()
+
+def request_api_stream_sync(model, messages, timeout=600, priority=PRIORITY_NORMAL, cancel_event=None): 
     target_model = "DeepSeek-V3"
     
     headers = {
@@ -89,44 +117,56 @@ def request_api_stream_sync(model, messages, timeout=600):
                 logging.warning(f"⚠️ Skipping invalid URL format: {url}")
                 continue
 
-            response = requests.post(
-                url, 
-                headers=headers, 
-                json=payload, 
-                timeout=timeout, 
-                verify=False,
-                stream=True 
-            )
+            # 调用方已放弃结果 (cancel_event 已置位) 时不再占用调度器槽位
+            if _is_cancelled(cancel_event):
+                return "Error"
+
+            # 每次请求占用全局调度器的一个槽位 (限速 + 自适应并发)，状态码回报给调度器
+            with LLM_SCHEDULER.slot(priority) as slot:
+                if _is_cancelled(cancel_event):
+                    return "Error"
+                response = requests.post(
+                    url, 
+                    headers=headers, 
+                    json=payload, 
+                    timeout=timeout, 
+                    verify=False,
+                    stream=True 
+                )
+                slot.report(response.status_code, response.headers.get("Retry-After"))
             
-            response.encoding = 'utf-8'
+                response.encoding = 'utf-8'
             
-            if "text/html" in response.headers.get("Content-Type", ""):
-                logging.warning(f"⚠️ URL {url} returned HTML (Login Page/Proxy Block). Skipping...")
-                continue
+                if "text/html" in response.headers.get("Content-Type", ""):
+                    logging.warning(f"⚠️ URL {url} returned HTML (Login Page/Proxy Block). Skipping...")
+                    continue
             
-            if response.status_code != 200:
-                logging.warning(f"⚠️ URL {url} failed with status {response.status_code}")
-                continue
-
-            full_content = ""
-            for line in response.iter_lines():
-                if not line: continue
-                line_str = line.decode('utf-8', errors='ignore').strip()
+                if response.status_code != 200:
+                    logging.warning(f"⚠️ URL {url} failed with status {response.status_code}")
+                    continue
+
+                full_content = ""
+                for line in response.iter_lines():
+                    if _is_cancelled(cancel_event):
+                        response.close()
+                        return "Error"
+                    if not line: continue
+                    line_str = line.decode('utf-8', errors='ignore').strip()
                 
-                if line_str.startswith("data:"):
-                    data_part = line_str[5:].strip()
-                    if data_part == "[DONE]": break
-                    try:
-                        data_json = json.loads(data_part)
-                        delta = data_json['choices'][0].get('delta', {})
-                        if 'content' in delta:
-                            content_str = delta['content']
-                            full_content += content_str
-                            print(f"DEBUG_AI_CHAR:{content_str}", flush=True)
-                    except: continue
+                    if line_str.startswith("data:"):
+                        data_part = line_str[5:].strip()
+                        if data_part == "[DONE]": break
+                        try:
+                            data_json = json.loads(data_part)
+                            delta = data_json['choices'][0].get('delta', {})
+                            if 'content' in delta:
+                                content_str = delta['content']
+                                full_content += content_str
+                                print(f"DEBUG_AI_CHAR:{content_str}", flush=True)
+                        except: continue
             
-            if full_content:
-                return full_content
+                if full_content:
+                    return full_content
                 
         except Exception as e:
             logging.error(f"❌ Connection error to {url}: {str(e)}")
@@ -139,30 +179,89 @@ def clean_deepseek_content(content):
     content = re.sub(r'<think>.*?</think>', '', content, flags=re.DOTALL)
     return content.strip()
 
-def ChatGPT_API_with_finish_reason(model, prompt, api_key=None, chat_history=None):
+def set_llm_cache_enabled(enabled):
+    """开启 / 关闭 LLM 响应缓存 (关闭时既不读也不写)"""
+    global _llm_cache_enabled
+    _llm_cache_enabled = bool(enabled)
+
+def _get_llm_cache():
+    """懒加载缓存实例；不可用 (未开启 / 缺少 RAG_Cache / 文件无法打开) 返回 None"""
+    global _llm_cache, HAS_LLM_CACHE
+    if not (_llm_cache_enabled and HAS_LLM_CACHE):
+        return None
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            try:
+                _llm_cache = SqliteCache(LLM_CACHE_PATH, "llm_responses",
+                                         max_entries=LLM_CACHE_MAX_ENTRIES, ttl_sec=LLM_CACHE_TTL_SEC)
+            except Exception as e:
+                logging.warning(f"⚠️ LLM cache disabled: {e}")
+                HAS_LLM_CACHE = False
+                return None
+        return _llm_cache
+
+def _count_llm_cache(field):
+    with _llm_cache_lock:
+        _llm_cache_stats[field] += 1
+
+def llm_cache_stats():
+    """本进程内的缓存统计快照 (hits / misses / stores / bypassed)"""
+    with _llm_cache_lock:
+        return dict(_llm_cache_stats)
+
+def _is_cacheable_response(content):
+    parsed = extract_json(content)
+    return isinstance(parsed, (dict, list)) and not isinstance(parsed, UniversalFallback) and len(parsed) > 0
+
+def ChatGPT_API_with_finish_reason(model, prompt, api_key=None, chat_history=None, priority=PRIORITY_NORMAL,
+                                   cancel_event=None):
     messages = chat_history + [{"role": "user", "content": prompt}] if chat_history else [{"role": "user", "content": prompt}]
+
+    cache = _get_llm_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = make_cache_key(model, json.dumps(messages, ensure_ascii=False, sort_keys=True))
+        cached = cache.get(cache_key)
+        if cached is not None:
+            _count_llm_cache("hits")
+            return cached, "finished"
+        _count_llm_cache("misses")
+    else:
+        _count_llm_cache("bypassed")
     
     max_retries = 5
     for i in range(max_retries):
-        raw = request_api_stream_sync(model, messages)
+        raw = request_api_stream_sync(model, messages, priority=priority, cancel_event=cancel_event)
+        if _is_cancelled(cancel_event):
+            return "Error", "cancelled"
         if raw != "Error" and raw.strip():
             # 简单校验 JSON 结构
             if '{' in raw or '[' in raw:
-                return clean_deepseek_content(raw), "finished"
+                content = clean_deepseek_content(raw)
+                # only cache responses that parse to a non-empty JSON value, so a malformed answer is retried next run
+                if cache_key is not None and _is_cacheable_response(content):
+                    cache.put(cache_key, content)
+                    _count_llm_cache("stores")
+                return content, "finished"
         
         wait_time = 3 * (2 ** i)
         print(f'************* API Retry ({i+1}/{max_retries}) - Waiting {wait_time}s *************')
-        time.sleep(wait_time)
+        if cancel_event is not None:
+            if cancel_event.wait(wait_time):
+                return "Error", "cancelled"
+        else:
+            time.sleep(wait_time)
         
     return "Error", "failed"
 
-def ChatGPT_API(model, prompt, api_key=None, chat_history=None):
-    res, _ = ChatGPT_API_with_finish_reason(model, prompt, api_key, chat_history)
+def ChatGPT_API(model, prompt, api_key=None, chat_history=None, priority=PRIORITY_NORMAL, cancel_event=None):
+    res, _ = ChatGPT_API_with_finish_reason(model, prompt, api_key, chat_history, priority=priority,
+                                            cancel_event=cancel_event)
     return res
 
-async def ChatGPT_API_async(model, prompt, api_key=None):
+async def ChatGPT_API_async(model, prompt, api_key=None, priority=PRIORITY_NORMAL):
     loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, ChatGPT_API, model, prompt)
+    return await loop.run_in_executor(LLM_SCHEDULER.executor, functools.partial(ChatGPT_API, model, prompt, priority=priority))
 
 def get_json_content(content):
     if not content: return ""
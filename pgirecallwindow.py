@@ -11,7 +11,7 @@ from PyQt5.QtWidgets import (
     QListWidgetItem, QFileDialog, QSplitter, QMessageBox,
     QComboBox, QShortcut, QSlider
 )
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QEventLoop
 from PyQt5.QtGui import QTextCursor, QTextCharFormat, QColor
 
 # 兼容不同 PyQt5 版本的 QKeySequence 位置
@@ -33,6 +33,21 @@ try:
 except ImportError:
     HAS_PANDAS = False
 
+try:
+    from RAG_JsonStream import PageIndexJsonStream
+    HAS_JSON_STREAM = True
+except ImportError:
+    HAS_JSON_STREAM = False
+
+try:
+    from RAG_PageIndexSidecar import open_sidecar
+    HAS_SIDECAR = True
+except ImportError:
+    HAS_SIDECAR = False
+
+# 流式加载时每解析多少个节点刷新一次进度
+STREAM_UI_BATCH = 200
+
 
 class PGIRecallWindow(QMainWindow):
     def __init__(self):
@@ -313,12 +328,20 @@ class PGIRecallWindow(QMainWindow):
 
     def _load_file(self, file_path):
         try:
-            with open(file_path, 'r', encoding='utf-8-sig') as f:
-                self.data = json.load(f)
-
+            self.data = None
             self.all_nodes = []
-            root_nodes = self._smart_parse_structure(self.data)
-            self._flatten_structure(root_nodes)
+            self.list_results.clear()
+            if HAS_SIDECAR and self._load_sidecar_nodes(file_path):
+                pass
+            elif HAS_JSON_STREAM:
+                self._stream_load_nodes(file_path)
+            else:
+                with open(file_path, 'r', encoding='utf-8-sig') as f:
+                    self.data = json.load(f)
+                root_nodes = self._smart_parse_structure(self.data)
+                self._flatten_structure(root_nodes)
+                for node in self.all_nodes:
+                    self._add_item_to_list(node)
 
             if not self.all_nodes:
                 self.txt_detail.setPlainText(
@@ -331,9 +354,6 @@ class PGIRecallWindow(QMainWindow):
                 return
 
             self.last_loaded_path = file_path
-            self.list_results.clear()
-            for node in self.all_nodes:
-                self._add_item_to_list(node)
 
             self.txt_detail.setPlainText(
                 f"✅ 已成功加载索引文件\n"
@@ -350,6 +370,51 @@ class PGIRecallWindow(QMainWindow):
             self.txt_detail.setPlainText(error_msg)
             QMessageBox.critical(self, "错误", f"无法加载文件:\n{str(e)}")
 
+    def _load_sidecar_nodes(self, file_path):
+        """JSON 旁有新鲜的二进制 sidecar 时直接按前序读取节点，返回是否成功"""
+        sidecar = open_sidecar(file_path)
+        if sidecar is None:
+            return False
+        with sidecar:
+            if not len(sidecar):
+                # 非 PageIndex 布局 (如根对象为 {"nodes": [...]}) 交给流式解析处理
+                return False
+            self.list_results.setUpdatesEnabled(False)
+            try:
+                for idx in range(len(sidecar)):
+                    node = sidecar.node_dict(idx)
+                    self.all_nodes.append(node)
+                    self._add_item_to_list(node)
+            finally:
+                self.list_results.setUpdatesEnabled(True)
+        return True
+
+    def _stream_load_nodes(self, file_path):
+        """
+        流式解析: 大文件不再整体 json.load，解析期间只刷新进度 (子节点先于父节点产出)，
+        结束后按前序编号排序一次再批量填充左侧列表。节点字典不保留子节点列表；
+        加载期间只处理绘制事件，屏蔽用户输入。
+        """
+        stream = PageIndexJsonStream(file_path, root_keys=("structure", "nodes"), root_as_node=True)
+        loaded = []
+        file_name = os.path.basename(file_path)
+        for count, item in enumerate(stream, 1):
+            loaded.append((item.idx, item.node))
+            if count % STREAM_UI_BATCH == 0:
+                self.txt_detail.setPlainText(
+                    f"⏳ 正在加载 {file_name}: 已解析 {count} 个节点 ({stream.progress:.0%})"
+                )
+                QApplication.processEvents(QEventLoop.ExcludeUserInputEvents)
+
+        loaded.sort(key=lambda pair: pair[0])
+        self.list_results.setUpdatesEnabled(False)
+        try:
+            for _, node in loaded:
+                self.all_nodes.append(node)
+                self._add_item_to_list(node)
+        finally:
+            self.list_results.setUpdatesEnabled(True)
+
     def _smart_parse_structure(self, data):
         if isinstance(data, list):
             return data
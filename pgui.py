@@ -39,6 +39,7 @@ import json
 import os
 import time
 import argparse
+import itertools
 import requests
 import urllib3
 import re
@@ -50,6 +51,34 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 for k in ['HTTP_PROXY', 'HTTPS_PROXY', 'http_proxy', 'https_proxy']:
     os.environ.pop(k, None)
 
+# 共享连接池 (与 RAG 后端共用 RAG_HttpClient；脚本单独运行找不到该模块时退回本地 Session)
+try:
+    from RAG_HttpClient import http_post
+except ImportError:
+    from requests.adapters import HTTPAdapter
+    _SESSION = requests.Session()
+    _SESSION.trust_env = False
+    _SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    _SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+    def http_post(url, endpoint=None, json=None, headers=None, stream=False, timeout=None):
+        return _SESSION.post(url, headers=headers, json=json, stream=stream,
+                             timeout=timeout or (10, 60), verify=False)
+
+# 流式解析 PageIndex JSON (与 RAG 后端共用 RAG_JsonStream)，边读边处理节点；找不到该模块时整体 json.load
+try:
+    from RAG_JsonStream import PageIndexJsonStream
+    HAS_JSON_STREAM = True
+except ImportError:
+    HAS_JSON_STREAM = False
+
+# JSON 旁的二进制 sidecar (<json>.pidx) 比 JSON 新时直接读取，无需解析 JSON
+try:
+    from RAG_PageIndexSidecar import open_sidecar
+    HAS_SIDECAR = True
+except ImportError:
+    HAS_SIDECAR = False
+
 # 2. API 配置 (保持内网配置)
 API_KEY = "YOUR API KEY"
 BASE_URL = "https://WWW.DEEPSEEK.COM:18080/v1" 
@@ -111,16 +140,29 @@ def count_total_nodes(nodes):
             count += count_total_nodes(node["nodes"])
     return count
 
-def recursive_walk(nodes, path=[], depth=1):
+def recursive_walk(nodes, path=[], depth=1, counter=None):
+    # idx 为前序编号，与 stream_walk 的编号方式一致
+    counter = itertools.count() if counter is None else counter
     for node in nodes:
         current_title = node.get("title", "Untitled")
         current_title = current_title.replace('\n', ' ').strip()
         current_path = path + [current_title]
         
-        yield {"node": node, "path": current_path, "depth": depth}
+        yield {"node": node, "path": current_path, "depth": depth, "idx": next(counter)}
         
         if "nodes" in node and isinstance(node["nodes"], list):
-            yield from recursive_walk(node["nodes"], current_path, depth + 1)
+            yield from recursive_walk(node["nodes"], current_path, depth + 1, counter)
+
+def stream_walk(stream):
+    """流式遍历: 产出与 recursive_walk 相同的字段 (含前序编号 idx)，另附 has_children (子节点先于父节点产出)"""
+    for item in stream:
+        yield {
+            "node": item.node,
+            "path": [("Untitled" if t is None else t).replace('\n', ' ').strip() for t in item.path],
+            "depth": item.depth,
+            "idx": item.idx,
+            "has_children": item.child_count > 0,
+        }
 
 def extract_json_robust(content):
     if not content: return None
@@ -166,27 +208,25 @@ def call_llm_api(system_prompt, user_prompt, model_name):
         "stream": True 
     }
     try:
-        session = requests.Session()
-        session.trust_env = False 
         url = f"{BASE_URL.rstrip('/')}/chat/completions"
-        response = session.post(url, headers=headers, json=data, stream=True, timeout=60, verify=False)
-        
-        full_content = ""
-        for line in response.iter_lines():
-            if line:
-                decoded_line = line.decode('utf-8', errors='ignore')
-                if decoded_line.startswith("data:"):
-                    json_str = decoded_line[5:].strip()
-                    if json_str == "[DONE]": break
-                    try:
-                        chunk = json.loads(json_str)
-                        if "choices" in chunk and len(chunk["choices"]) > 0:
-                            content = chunk["choices"][0]["delta"].get("content", "")
-                            if content:
-                                full_content += content
-                                # === [FIX] 恢复可视化输出 ===
-                                print(f"DEBUG_AI_CHAR:{content}", flush=True) 
-                    except: pass
+        # 复用共享连接池中的 keep-alive 连接，读完后关闭响应以归还连接
+        with http_post(url, endpoint="vector_gen", headers=headers, json=data, stream=True) as response:
+            full_content = ""
+            for line in response.iter_lines():
+                if line:
+                    decoded_line = line.decode('utf-8', errors='ignore')
+                    if decoded_line.startswith("data:"):
+                        json_str = decoded_line[5:].strip()
+                        if json_str == "[DONE]": break
+                        try:
+                            chunk = json.loads(json_str)
+                            if "choices" in chunk and len(chunk["choices"]) > 0:
+                                content = chunk["choices"][0]["delta"].get("content", "")
+                                if content:
+                                    full_content += content
+                                    # === [FIX] 恢复可视化输出 ===
+                                    print(f"DEBUG_AI_CHAR:{content}", flush=True) 
+                        except: pass
         return full_content
     except Exception as e:
         return f"[FAILED] {str(e)}"
@@ -207,35 +247,59 @@ def main():
         log(f"Input file not found: {args.input}", "ERROR")
         return
 
+    sidecar = None
     try:
-        with open(args.input, 'r', encoding='utf-8-sig') as f:
-            data = json.load(f)
-        
-        root_nodes = []
         doc_title = "Unknown Document"
-        if isinstance(data, list):
-            root_nodes = data
-        elif isinstance(data, dict):
-            root_nodes = data.get("structure", [])
-            doc_title = data.get("doc_name", data.get("title", "Unknown Document"))
-        
-        # [FIX] 预计算总节点数，以便进度条工作
-        total_nodes = count_total_nodes(root_nodes)
-        log(f"Document Structure Loaded. Total Nodes detected: {total_nodes}", "INFO")
+        stream = None
+        sidecar = open_sidecar(args.input) if HAS_SIDECAR else None
+        if sidecar is not None:
+            walker = stream_walk(sidecar.iter_nodes())
+            total_nodes = len(sidecar)
+            doc_title = sidecar.root_fields.get("doc_name", sidecar.root_fields.get("title", doc_title))
+            log(f"Document Structure Loaded from sidecar. Total Nodes detected: {total_nodes}", "INFO")
+        elif HAS_JSON_STREAM:
+            # 流式: 读到第一个节点即开始调用 LLM，总节点数按已解析字节比例估算
+            stream = PageIndexJsonStream(args.input)
+            walker = stream_walk(stream)
+            total_nodes = 0
+            log("Streaming Document Structure...", "INFO")
+        else:
+            with open(args.input, 'r', encoding='utf-8-sig') as f:
+                data = json.load(f)
+            
+            root_nodes = []
+            if isinstance(data, list):
+                root_nodes = data
+            elif isinstance(data, dict):
+                root_nodes = data.get("structure", [])
+                doc_title = data.get("doc_name", data.get("title", "Unknown Document"))
+            
+            # [FIX] 预计算总节点数，以便进度条工作
+            total_nodes = count_total_nodes(root_nodes)
+            walker = recursive_walk(root_nodes)
+            log(f"Document Structure Loaded. Total Nodes detected: {total_nodes}", "INFO")
 
         output_data = []
         processed_count = 0
         start_time = time.time()
         
-        for item in recursive_walk(root_nodes):
+        for item in walker:
             node = item["node"]
             path = item["path"]
             depth = item["depth"]
+            idx = item["idx"]
+            if stream is not None:
+                # doc_name 写在 structure 之前，首个节点到达时已解析
+                doc_title = stream.root_fields.get("doc_name", stream.root_fields.get("title", doc_title))
+                total_nodes = max(processed_count + 1, round(stream.node_count / max(stream.progress, 1e-6)))
             content = node.get("text", node.get("content", ""))
-            node_id = node.get("node_id", f"{processed_count:04d}")
+            node_id = node.get("node_id", f"{idx:04d}")
             
             # 1. 过滤逻辑
-            has_children = "nodes" in node and isinstance(node["nodes"], list) and len(node["nodes"]) > 0
+            if "has_children" in item:
+                has_children = item["has_children"]
+            else:
+                has_children = "nodes" in node and isinstance(node["nodes"], list) and len(node["nodes"]) > 0
             
             # 跳过太短且没有子节点的
             if (not content or len(content.strip()) < 10) and not has_children:
@@ -299,7 +363,7 @@ def main():
                 "original_snippet": content[:500] 
             }
 
-            output_data.append(final_item)
+            output_data.append((idx, final_item))
             processed_count += 1
             
             # 报告进度
@@ -308,6 +372,9 @@ def main():
             # 避免 API 过载
             time.sleep(0.1)
 
+        # 流式解析时子节点先于父节点处理，输出仍按文档顺序 (前序) 排列
+        output_data.sort(key=lambda x: x[0])
+        output_data = [final_item for _, final_item in output_data]
         with open(args.output, 'w', encoding='utf-8') as f:
             json.dump(output_data, f, indent=2, ensure_ascii=False)
 
@@ -318,6 +385,9 @@ def main():
         log(f"Critical Error: {str(e)}", "ERROR")
         import traceback
         traceback.print_exc()
+    finally:
+        if sidecar is not None:
+            sidecar.close()
 
 if __name__ == "__main__":
     main()